@@ -6,15 +6,26 @@ print(f"Python version: {sys.version}")
 # 导入前的检查
 print("Checking imports...")
 try:
+    import asyncio
+    import concurrent.futures
+    import functools
+    import heapq
     import json
+    import mimetypes
     import random
     import threading
     import time
     import logging
+    import queue
+    import re
+    import shutil
+    import socket
+    import sqlite3
     import subprocess
+    import urllib.parse
     from datetime import datetime
-    from collections import deque
-    from flask import Flask, request, jsonify, render_template
+    from collections import Counter, deque, OrderedDict
+    from flask import Flask, Response, request, jsonify, render_template
     from flask_cors import CORS
     import logging.config
     print("All imports successful!")
@@ -22,6 +33,13 @@ except Exception as e:
     print(f"Import error: {e}")
     sys.exit(1)
 
+# 可选依赖：pypinyin，安装后搜索支持拼音全拼和首字母匹配
+try:
+    from pypinyin import lazy_pinyin, Style
+    PINYIN_AVAILABLE = True
+except ImportError:
+    PINYIN_AVAILABLE = False
+
 # 配置控制台实时日志记录 - 设置为DEBUG级别以输出详细调试信息
 logging.basicConfig(
     level=logging.DEBUG,
@@ -45,16 +63,36 @@ MPV_SOCKET_PATH = "/data/data/com.termux/files/usr/tmp/mpv_ctrl/socket"
 # 本地缓存目录
 LOCAL_DIR = "/data/data/com.termux/files/home/nas_audio_cache"
 
+# NAS上音频文件所在的rclone远程路径
+RCLONE_REMOTE = "synology:download/bilibili/push"
+
+# API服务端口（边下边播时mpv通过本地HTTP中转访问）
+API_PORT = int(os.environ.get('API_PORT', 5000))
+
+# 本地曲库索引（SQLite），保存NAS文件目录，重启后无需等待NAS列表
+LIBRARY_DB_PATH = "/data/data/com.termux/files/home/audio_library.db"
+
+# 批量加载播放列表时生成的M3U文件（通过一次loadlist命令交给mpv）
+PLAYLIST_M3U_PATH = "/data/data/com.termux/files/home/mpv_playlist.m3u"
+PLAYLIST_APPEND_BATCH = 10  # 非懒构建时每缓存这么多首追加一次（第一首缓存好后立即追加，尽快开始播放）
+
 # 自动缓存线程控制
 auto_cache_thread = None
 auto_cache_running = False
+AUTO_CACHE_INTERVAL = 600  # 自动缓存检查间隔（秒），10分钟
 
 # 播放结束监控线程控制
 playback_monitor_thread = None
 playback_monitor_running = False
 
+# 播放监控模式：event 基于mpv事件推送（observe_property/end-file），poll 为旧的定时轮询
+PLAYBACK_MONITOR_MODE = os.environ.get('PLAYBACK_MONITOR_MODE', 'event').lower()
+if PLAYBACK_MONITOR_MODE not in ('event', 'poll'):
+    PLAYBACK_MONITOR_MODE = 'event'
+mpv_event_queue = queue.Queue()  # IPC读取线程 -> 事件监控线程
+
 # 下载进度跟踪
-download_progress = {}  # {task_id: {filename, total_size, current_size, status, error, start_time}}
+download_progress = {}  # {task_id: {filename, total_size, current_size, speed, eta, status, error, start_time, finished_at}}
 download_lock = threading.Lock()
 
 # 时间轴配置
@@ -86,6 +124,9 @@ state_lock = threading.RLock()     # 用于播放状态的线程安全
 timer_thread_running = False  # 计时线程是否正在运行
 timer_thread = None  # 计时线程对象
 
+# 是否启用asyncio控制循环：启用后计时、淡入淡出、自动缓存、自动播放作为协程运行在同一个调度线程中
+ASYNC_CONTROL_PLANE = os.environ.get('ASYNC_CONTROL_PLANE', 'false').lower() == 'true'
+
 # 自动暂停配置
 AUTO_PAUSE_DURATION = 1800  # 自动暂停时长（秒），30分钟 = 1800秒
 continuous_play_start_time = None  # 连续播放开始时间
@@ -175,8 +216,313 @@ except Exception as _e:
     MPV_RUNTIME_ERROR = str(_e)
     operation_logger.error(f"MPV preflight error: {MPV_RUNTIME_ERROR}")
 
+class MPVIPCClient:
+    """常驻的MPV JSON IPC客户端
+
+    通过一条长连接的Unix socket直接与mpv通信，取代每次调用都启动socat子进程的方式。
+    每个请求携带递增的request_id，由后台读取线程按request_id把响应交还给等待的调用方；
+    mpv主动推送的事件（不带request_id）交给已注册的事件处理函数。
+    连接断开后会在后台按退避间隔自动重连，socket文件重新出现即可恢复。
+    """
+
+    def __init__(self, socket_path, timeout=2.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._sock = None
+        self._conn_lock = threading.RLock()      # 保护连接的建立、发送和断开
+        self._pending = {}                       # {request_id: [threading.Event, response]}
+        self._pending_lock = threading.Lock()
+        self._next_request_id = 0
+        self._event_handlers = []                # mpv事件回调
+        self._connect_handlers = []              # 每次（重新）连接成功后的回调
+        self._reconnecting = False
+
+    @property
+    def connected(self):
+        return self._sock is not None
+
+    def add_event_handler(self, handler):
+        """注册mpv事件回调，handler接收解析后的事件字典
+
+        回调在读取线程中执行，不能在其中发起同步请求，耗时处理应转交给其他线程。
+        """
+        self._event_handlers.append(handler)
+
+    def add_connect_handler(self, handler):
+        """注册连接建立回调，用于重连后恢复订阅等状态"""
+        self._connect_handlers.append(handler)
+
+    def connect(self):
+        """建立连接（已连接时直接返回True）"""
+        with self._conn_lock:
+            if self._sock is not None:
+                return True
+            if not os.path.exists(self.socket_path):
+                return False
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.socket_path)
+            except OSError as e:
+                sock.close()
+                operation_logger.debug(f"[MPV IPC] 连接socket失败: {e}")
+                return False
+            sock.settimeout(None)
+            self._sock = sock
+            reader = threading.Thread(target=self._reader_loop, args=(sock,), daemon=True)
+            reader.start()
+        operation_logger.info(f"[MPV IPC] 已连接到 {self.socket_path}")
+
+        for handler in list(self._connect_handlers):
+            try:
+                handler()
+            except Exception as e:
+                operation_logger.error(f"[MPV IPC] 连接回调执行失败: {e}", exc_info=True)
+        return True
+
+    def close(self):
+        """关闭当前连接（之后仍会在socket重新出现时自动重连）"""
+        with self._conn_lock:
+            sock = self._sock
+        if sock is not None:
+            self._handle_disconnect(sock)
+
+    def ensure_connection(self):
+        """尝试立即连接，失败时转为后台重连"""
+        if self.connect():
+            return True
+        self._schedule_reconnect()
+        return False
+
+    def request(self, command, timeout=None):
+        """发送一条命令并等待对应request_id的响应
+
+        Returns:
+            tuple: (响应字典或None, 消息)
+        """
+        responses, message = self.request_many([command], timeout)
+        return responses[0], message
+
+    def request_many(self, commands, timeout=None):
+        """一次写入多条命令，然后依次等待各自的响应
+
+        Returns:
+            tuple: (与commands一一对应的响应列表，失败项为None, 消息)
+        """
+        if not commands:
+            return [], "Success"
+        if not self.ensure_connection():
+            return [None] * len(commands), f"MPV Socket not connected at {self.socket_path}"
+
+        waiters = []
+        payload = b""
+        with self._pending_lock:
+            for command in commands:
+                self._next_request_id += 1
+                request_id = self._next_request_id
+                waiter = [threading.Event(), None]
+                self._pending[request_id] = waiter
+                waiters.append((request_id, waiter))
+                payload += json.dumps({"command": command, "request_id": request_id}).encode('utf-8') + b"\n"
+
+        sock = None
+        try:
+            with self._conn_lock:
+                sock = self._sock
+                if sock is None:
+                    raise OSError("connection closed")
+                sock.sendall(payload)
+        except OSError as e:
+            self._discard_waiters(waiters)
+            if sock is not None:
+                self._handle_disconnect(sock)
+            return [None] * len(commands), f"Failed to send to MPV socket: {e}"
+
+        deadline = time.monotonic() + (timeout if timeout is not None else self.timeout)
+        responses = []
+        message = "Success"
+        for request_id, waiter in waiters:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not waiter[0].wait(remaining):
+                message = f"Timeout waiting for MPV response (request_id={request_id})"
+            elif waiter[1] is None and message == "Success":
+                message = "MPV connection closed before response"
+            responses.append(waiter[1])
+        self._discard_waiters(waiters)
+        return responses, message
+
+    def _discard_waiters(self, waiters):
+        with self._pending_lock:
+            for request_id, _ in waiters:
+                self._pending.pop(request_id, None)
+
+    def _reader_loop(self, sock):
+        buffer = b""
+        try:
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                buffer += chunk
+                while b"\n" in buffer:
+                    line, buffer = buffer.split(b"\n", 1)
+                    if line.strip():
+                        self._dispatch(line)
+        except OSError as e:
+            operation_logger.debug(f"[MPV IPC] 读取socket出错: {e}")
+        finally:
+            self._handle_disconnect(sock)
+
+    def _dispatch(self, line):
+        try:
+            message = json.loads(line)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            operation_logger.warning(f"[MPV IPC] 无法解析的响应: {line[:200]!r}")
+            return
+
+        if "event" in message:
+            self._emit_event(message)
+            return
+
+        request_id = message.get("request_id")
+        with self._pending_lock:
+            waiter = self._pending.get(request_id)
+        if waiter is not None:
+            waiter[1] = message
+            waiter[0].set()
+
+    def _emit_event(self, message):
+        for handler in list(self._event_handlers):
+            try:
+                handler(message)
+            except Exception as e:
+                operation_logger.error(f"[MPV IPC] 事件处理失败: {e}", exc_info=True)
+
+    def _handle_disconnect(self, sock):
+        with self._conn_lock:
+            if self._sock is not sock:
+                return
+            self._sock = None
+        try:
+            sock.close()
+        except OSError:
+            pass
+        operation_logger.info("[MPV IPC] 连接已断开")
+
+        # 唤醒所有等待中的请求，response保持为None
+        with self._pending_lock:
+            waiters = list(self._pending.values())
+        for waiter in waiters:
+            waiter[0].set()
+
+        # 以合成事件通知订阅方连接已断开
+        self._emit_event({"event": "ipc-disconnected"})
+        self._schedule_reconnect()
+
+    def _schedule_reconnect(self):
+        with self._conn_lock:
+            if self._reconnecting:
+                return
+            self._reconnecting = True
+        threading.Thread(target=self._reconnect_loop, daemon=True).start()
+
+    def _reconnect_loop(self):
+        delay = 0.2
+        try:
+            while not self.connect():
+                time.sleep(delay)
+                delay = min(delay * 2, 5.0)
+        finally:
+            with self._conn_lock:
+                self._reconnecting = False
+
+
+mpv_ipc = MPVIPCClient(MPV_SOCKET_PATH)
+
+
+class ControlLoop:
+    """后台asyncio控制循环
+
+    在独立线程中运行一个事件循环，计时、淡入淡出、自动缓存、自动播放等后台任务作为协程在其中调度，
+    取代各自独立、靠time.sleep轮询的守护线程。Flask处理函数通过submit/spawn线程安全地提交任务；
+    按名称登记的任务在同名新任务启动或显式cancel时被取消。阻塞调用（IPC、rclone）经run_blocking转到线程池执行。
+    """
+
+    def __init__(self):
+        self.loop = None
+        self._thread = None
+        self._tasks = {}  # {任务名: asyncio.Task}，只在循环线程内访问
+
+    @property
+    def running(self):
+        return self.loop is not None and self.loop.is_running()
+
+    def start(self):
+        """启动循环线程（已启动时直接返回）"""
+        if self.running:
+            return
+        self.loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            self.loop.call_soon(ready.set)
+            self.loop.run_forever()
+
+        self._thread = threading.Thread(target=run, daemon=True, name="control-loop")
+        self._thread.start()
+        ready.wait()
+        app.logger.info("[CONTROL_LOOP] asyncio控制循环已启动")
+
+    def submit(self, coro):
+        """从任意线程提交协程，返回concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def spawn(self, name, coro_func, *args):
+        """启动名为name的任务，同名的旧任务会先被取消"""
+        async def _spawn():
+            old_task = self._tasks.get(name)
+            if old_task is not None and not old_task.done():
+                old_task.cancel()
+            task = self.loop.create_task(self._run_task(name, coro_func, *args))
+            self._tasks[name] = task
+            return task
+        return self.submit(_spawn())
+
+    def cancel(self, name):
+        """取消名为name的任务"""
+        def _cancel():
+            task = self._tasks.get(name)
+            if task is not None and not task.done():
+                task.cancel()
+        if self.running:
+            self.loop.call_soon_threadsafe(_cancel)
+
+    def is_active(self, name):
+        task = self._tasks.get(name)
+        return task is not None and not task.done()
+
+    async def run_blocking(self, func, *args):
+        """在线程池中执行阻塞函数"""
+        return await self.loop.run_in_executor(None, functools.partial(func, *args))
+
+    async def _run_task(self, name, coro_func, *args):
+        try:
+            return await coro_func(*args)
+        except asyncio.CancelledError:
+            app.logger.debug(f"[CONTROL_LOOP] 任务已取消: {name}")
+            raise
+        except Exception as e:
+            app.logger.error(f"[CONTROL_LOOP] 任务 {name} 出错: {str(e)}", exc_info=True)
+        finally:
+            if self._tasks.get(name) is asyncio.current_task():
+                del self._tasks[name]
+
+
+control_loop = ControlLoop()
+
 def send_mpv_command(command):
-    """使用 socat 向 mpv socket 发送命令"""
+    """通过常驻IPC连接向 mpv 发送命令"""
     operation_logger.debug(f"[MPV命令] 尝试发送命令: {command}")
     
     # 检查socket文件是否存在
@@ -186,50 +532,22 @@ def send_mpv_command(command):
         operation_logger.debug(f"[MPV命令] {error_msg}")
         return False, error_msg
     
-    # 记录socket文件权限信息以帮助排查权限问题
-    if os.path.exists(MPV_SOCKET_PATH):
-        import stat
-        stat_info = os.stat(MPV_SOCKET_PATH)
-        operation_logger.debug(f"[MPV命令] Socket文件存在，权限: {stat.filemode(stat_info.st_mode)}, 所有者: {stat_info.st_uid}:{stat_info.st_gid}")
-    
-    # 构建JSON命令
-    json_command = json.dumps({"command": command})
-    operation_logger.debug(f"[MPV命令] 构建的JSON命令: {json_command}")
-    
-    # 使用 socat 执行命令
-    # 转义单引号，防止 shell 注入或语法错误
-    safe_json_command = json_command.replace("'", "'\\''")
-    # 使用 subprocess.run(shell=True) 以便正确处理管道，同时使用 Python 的 timeout
-    cmd = f"echo '{safe_json_command}' | socat -t 0 - UNIX-CONNECT:{MPV_SOCKET_PATH}"
-    operation_logger.debug(f"[MPV命令] 执行的系统命令: {cmd}")
-    
     try:
-        result = subprocess.run(
-            cmd,
-            shell=True,
-            timeout=2,
-            capture_output=True,
-            text=True
-        )
+        response, message = mpv_ipc.request(command)
         
-        operation_logger.debug(f"[MPV命令] subprocess返回码: {result.returncode}")
-        if result.stdout:
-            operation_logger.debug(f"[MPV命令] 标准输出: {result.stdout.strip()}")
-        
-        # 即使成功，如果有 stderr 也记录下来，可能是警告
-        if result.stderr:
-            operation_logger.debug(f"[MPV命令] 标准错误: {result.stderr.strip()}")
+        if response is None:
+            # quit会让mpv直接关闭连接，收不到响应也视为成功
+            if command and command[0] == "quit" and "closed" in message:
+                return True, "Command sent successfully."
+            error_msg = f"Failed to send MPV command {command}: {message}"
+            operation_logger.debug(f"[MPV命令] {error_msg}")
+            return False, error_msg
         
-        if result.returncode == 0:
+        if response.get("error") == "success":
             operation_logger.debug(f"[MPV命令] 命令 '{command}' 发送成功")
             return True, "Command sent successfully."
-        else:
-            error_msg = f"Failed to send command via socat, return code: {result.returncode}, stderr: {result.stderr.strip()}"
-            operation_logger.debug(f"[MPV命令] {error_msg}")
-            return False, error_msg
-            
-    except subprocess.TimeoutExpired:
-        error_msg = f"Timeout (2s) when sending MPV command: {command}"
+        
+        error_msg = f"MPV rejected command {command}: {response.get('error')}"
         operation_logger.debug(f"[MPV命令] {error_msg}")
         return False, error_msg
     except Exception as e:
@@ -271,6 +589,87 @@ def is_playback_allowed():
     return allowed
 
 
+SSE_STATE_INTERVAL = 0.5       # 检查播放状态变化并推送增量的间隔（秒）
+SSE_KEEPALIVE_INTERVAL = 15    # 没有事件时发送注释行保持连接（秒）
+SSE_CLIENT_QUEUE_SIZE = 256    # 每个连接积压的事件上限，超出时改为推送一次完整状态
+
+
+class EventBus:
+    """/events 的服务端事件推送（Server-Sent Events）
+
+    每个连接一个有界队列。播放状态由一个后台线程按固定间隔读取一次、只推送变化的字段，
+    所以无论打开多少个页面，服务端读取状态的开销都一样；没有连接时该线程退出。
+    下载进度和时间轴事件在发生时直接推送。消费太慢的连接丢弃积压，改为推送一次完整状态。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._sequence = 0
+        self._thread = None
+        self._last_state = {}
+
+    def subscribe(self):
+        client_queue = queue.Queue(maxsize=SSE_CLIENT_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.add(client_queue)
+            if self._thread is None or not self._thread.is_alive():
+                self._last_state = {}
+                self._thread = threading.Thread(target=self._state_publisher, daemon=True)
+                self._thread.start()
+        return client_queue
+
+    def unsubscribe(self, client_queue):
+        with self._lock:
+            self._subscribers.discard(client_queue)
+
+    @property
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def publish(self, event, data):
+        """推送事件给所有连接（没有连接时立即返回）"""
+        with self._lock:
+            if not self._subscribers:
+                return
+            self._sequence += 1
+            item = (self._sequence, event, data)
+            for client_queue in self._subscribers:
+                try:
+                    client_queue.put_nowait(item)
+                except queue.Full:
+                    # 丢弃积压，客户端收到resync后用完整状态覆盖本地状态
+                    while not client_queue.empty():
+                        try:
+                            client_queue.get_nowait()
+                        except queue.Empty:
+                            break
+                    client_queue.put_nowait((self._sequence, "resync", None))
+
+    def _state_publisher(self):
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    self._thread = None
+                    return
+            try:
+                snapshot = build_status_snapshot()
+                delta = {
+                    key: value for key, value in snapshot.items()
+                    if key not in self._last_state or self._last_state[key] != value
+                }
+                if delta:
+                    self._last_state = snapshot
+                    self.publish("state", delta)
+            except Exception as e:
+                app.logger.error(f"[EVENTS] 读取播放状态失败: {str(e)}", exc_info=True)
+            time.sleep(SSE_STATE_INTERVAL)
+
+
+event_bus = EventBus()
+
+
 def add_to_timeline(action, description, details=None):
     """添加事件到时间轴"""
     global timeline_events
@@ -285,6 +684,7 @@ def add_to_timeline(action, description, details=None):
     with timeline_lock:
         timeline_events.append(event)
         save_timeline()
+    event_bus.publish("timeline", event)
     
     operation_logger.debug(f"[时间轴] 添加事件: {action} - {description}")
 
@@ -372,83 +772,242 @@ def get_status_with_timeline():
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
-def get_file_duration(file_path):
-    """使用多种方法获取文件时长，作为MPV无法返回时长时的备用方法"""
+METADATA_WORKERS = 2          # 同时运行的ffprobe进程数
+METADATA_PROBE_TIMEOUT = 10   # 单个文件探测超时（秒）
+
+
+def probe_media_file(file_path):
+    """用一次ffprobe调用读取音频元数据，取不到时长时再从ffmpeg输出中解析
+
+    Returns:
+        dict: duration（取不到为0）、codec、bit_rate、sample_rate、channels
+    """
+    metadata = {"duration": 0, "codec": None, "bit_rate": None, "sample_rate": None, "channels": None}
     try:
-        # 检查文件是否存在
-        if not os.path.exists(file_path):
-            operation_logger.debug(f"[文件时长] 文件不存在: {file_path}")
-            return 0
-        
-        import subprocess
-        
-        # 方法1: 尝试使用ffprobe获取format时长
-        try:
-            cmd = [
-                'ffprobe',
-                '-v', 'error',
-                '-show_entries', 'format=duration',
-                '-of', 'default=noprint_wrappers=1:nokey=1',
-                file_path
-            ]
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=5)
-            if result.returncode == 0:
-                output = result.stdout.strip()
-                if output and output != "N/A":
-                    try:
-                        duration = float(output)
-                        operation_logger.debug(f"[文件时长] 使用ffprobe(format)获取到时长: {duration}秒")
-                        return duration
-                    except ValueError:
-                        pass
-        except Exception as e:
-            operation_logger.debug(f"[文件时长] ffprobe(format)尝试失败: {e}")
+        cmd = [
+            'ffprobe',
+            '-v', 'error',
+            '-select_streams', 'a:0',
+            '-show_entries', 'format=duration,bit_rate:stream=codec_name,sample_rate,channels,duration,bit_rate',
+            '-of', 'json',
+            file_path
+        ]
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=METADATA_PROBE_TIMEOUT)
+        if result.returncode == 0 and result.stdout.strip():
+            data = json.loads(result.stdout)
+            fmt = data.get("format", {})
+            stream = (data.get("streams") or [{}])[0]
 
-        # 方法2: 尝试使用ffprobe获取流(stream)时长
-        try:
-            cmd = [
-                'ffprobe',
-                '-v', 'error',
-                '-select_streams', 'a:0',
-                '-show_entries', 'stream=duration',
-                '-of', 'default=noprint_wrappers=1:nokey=1',
-                file_path
-            ]
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=5)
-            if result.returncode == 0:
-                output = result.stdout.strip()
-                if output and output != "N/A":
-                    try:
-                        duration = float(output)
-                        operation_logger.debug(f"[文件时长] 使用ffprobe(stream)获取到时长: {duration}秒")
-                        return duration
-                    except ValueError:
-                        pass
-        except Exception as e:
-            operation_logger.debug(f"[文件时长] ffprobe(stream)尝试失败: {e}")
+            def to_number(value, cast=float):
+                try:
+                    return cast(value) if value not in (None, "N/A") else None
+                except (TypeError, ValueError):
+                    return None
+
+            # format时长优先，其次是音频流时长
+            metadata["duration"] = to_number(fmt.get("duration")) or to_number(stream.get("duration")) or 0
+            metadata["codec"] = stream.get("codec_name")
+            metadata["bit_rate"] = to_number(fmt.get("bit_rate"), int) or to_number(stream.get("bit_rate"), int)
+            metadata["sample_rate"] = to_number(stream.get("sample_rate"), int)
+            metadata["channels"] = to_number(stream.get("channels"), int)
+    except Exception as e:
+        operation_logger.debug(f"[文件时长] ffprobe尝试失败: {e}")
 
-        # 方法3: 尝试从ffmpeg输出中解析时长
+    if metadata["duration"] <= 0:
         try:
-            cmd = ['ffmpeg', '-i', file_path]
             # ffmpeg -i 总是返回非0，因为它没有输出文件，错误输出在stderr
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=5)
-            output = result.stderr
-            import re
+            result = subprocess.run(['ffmpeg', '-i', file_path], capture_output=True, text=True,
+                                    timeout=METADATA_PROBE_TIMEOUT)
             # 寻找 "Duration: 00:00:00.00" 格式
-            match = re.search(r"Duration: (\d{2}):(\d{2}):(\d{2}\.\d+)", output)
+            match = re.search(r"Duration: (\d{2}):(\d{2}):(\d{2}\.\d+)", result.stderr)
             if match:
                 hours, minutes, seconds = map(float, match.groups())
-                duration = hours * 3600 + minutes * 60 + seconds
-                operation_logger.debug(f"[文件时长] 使用ffmpeg解析获取到时长: {duration}秒")
-                return duration
+                metadata["duration"] = hours * 3600 + minutes * 60 + seconds
         except Exception as e:
             operation_logger.debug(f"[文件时长] ffmpeg解析尝试失败: {e}")
-            
-        operation_logger.warning(f"[文件时长] 所有方法均无法获取文件时长: {file_path}")
+    return metadata
+
+
+class MediaMetadataCache:
+    """音频元数据缓存
+
+    按 (路径, 大小, 修改时间) 缓存时长、编码、码率、采样率和声道数，保存在曲库数据库中并在内存中保留一份，
+    文件变化后自动失效。新缓存的文件在有界的后台池中探测（每个任务就是一个ffprobe子进程），
+    播放时直接读取结果，不再在切歌路径上等待ffprobe。
+    """
+
+    def __init__(self, db_path, workers):
+        self._lock = threading.Lock()
+        self._entries = {}   # path -> (size, mtime, metadata)
+        self._pending = {}   # path -> Future
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="metadata")
+        self._conn = None
+        try:
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            with self._conn:
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS media_metadata ("
+                    "path TEXT PRIMARY KEY, size INTEGER, mtime REAL, duration REAL, codec TEXT, "
+                    "bit_rate INTEGER, sample_rate INTEGER, channels INTEGER, probed_at REAL)"
+                )
+            for row in self._conn.execute(
+                    "SELECT path, size, mtime, duration, codec, bit_rate, sample_rate, channels FROM media_metadata"):
+                path, size, mtime, duration, codec, bit_rate, sample_rate, channels = row
+                self._entries[path] = (size, mtime, {
+                    "duration": duration, "codec": codec, "bit_rate": bit_rate,
+                    "sample_rate": sample_rate, "channels": channels
+                })
+        except sqlite3.Error as e:
+            # 数据库不可用时只在内存中缓存
+            app.logger.error(f"[METADATA] 打开元数据缓存失败: {str(e)}")
+            self._conn = None
+
+    def lookup(self, file_path):
+        """返回与当前文件大小、修改时间一致的元数据，没有时返回None"""
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        with self._lock:
+            entry = self._entries.get(file_path)
+        if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime:
+            return entry[2]
+        return None
+
+    def schedule(self, file_path):
+        """在后台探测文件（已有有效缓存或正在探测时不重复提交）
+
+        Returns:
+            Future 或 None
+        """
+        if self.lookup(file_path) is not None:
+            return None
+        with self._lock:
+            future = self._pending.get(file_path)
+            if future is None:
+                future = self._executor.submit(self._probe, file_path)
+                self._pending[file_path] = future
+        return future
+
+    def get(self, file_path, timeout=METADATA_PROBE_TIMEOUT * 2):
+        """读取元数据，缓存未命中时等待探测完成"""
+        metadata = self.lookup(file_path)
+        if metadata is not None:
+            return metadata
+        future = self.schedule(file_path)
+        if future is None:
+            return self.lookup(file_path)
+        try:
+            return future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            return None
+
+    def scan_directory(self, directory):
+        """为目录中还没有有效缓存的文件安排后台探测
+
+        Returns:
+            int: 新提交的探测任务数
+        """
+        if not os.path.isdir(directory):
+            return 0
+        submitted = 0
+        for entry in os.scandir(directory):
+            if entry.is_file() and not entry.name.endswith(PARTIAL_SUFFIX) and self.schedule(entry.path) is not None:
+                submitted += 1
+        if submitted:
+            app.logger.info(f"[METADATA] 已安排 {submitted} 个文件的后台元数据探测")
+        return submitted
+
+    def status(self):
+        with self._lock:
+            return {"entries": len(self._entries), "pending": len(self._pending), "workers": METADATA_WORKERS}
+
+    def _probe(self, file_path):
+        try:
+            stat = os.stat(file_path)
+            started = time.time()
+            metadata = probe_media_file(file_path)
+            operation_logger.debug(f"[METADATA] 探测完成: {file_path}, 时长 {metadata['duration']}秒, "
+                                   f"耗时 {time.time() - started:.2f}秒")
+            with self._lock:
+                self._entries[file_path] = (stat.st_size, stat.st_mtime, metadata)
+                if self._conn is not None:
+                    with self._conn:
+                        self._conn.execute(
+                            "INSERT OR REPLACE INTO media_metadata "
+                            "(path, size, mtime, duration, codec, bit_rate, sample_rate, channels, probed_at) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            (file_path, stat.st_size, stat.st_mtime, metadata["duration"], metadata["codec"],
+                             metadata["bit_rate"], metadata["sample_rate"], metadata["channels"], time.time())
+                        )
+            return metadata
+        except OSError as e:
+            operation_logger.debug(f"[METADATA] 文件不可读: {file_path}, {e}")
+            return None
+        except Exception as e:
+            app.logger.error(f"[METADATA] 探测元数据出错: {file_path}, {str(e)}", exc_info=True)
+            return None
+        finally:
+            with self._lock:
+                self._pending.pop(file_path, None)
+
+
+media_metadata = MediaMetadataCache(LIBRARY_DB_PATH, METADATA_WORKERS)
+
+
+def get_file_duration(file_path):
+    """获取文件时长，作为MPV无法返回时长时的备用方法（只读取元数据缓存，不等待探测）
+
+    切歌路径上调用，缓存未命中时只安排后台探测并返回0，由调用方回退到mpv的duration属性，
+    之后由播放监控根据mpv上报的时长补上。
+    """
+    if not os.path.exists(file_path):
+        operation_logger.debug(f"[文件时长] 文件不存在: {file_path}")
         return 0
-    except Exception as e:
-        operation_logger.error(f"[文件时长] 获取文件时长发生未预期异常: {e}", exc_info=True)
+    metadata = media_metadata.lookup(file_path)
+    if metadata is None:
+        media_metadata.schedule(file_path)
         return 0
+    return metadata["duration"] or 0
+
+
+def cached_track_duration(filename):
+    """不等待探测，直接读取缓存目录中曲目的时长
+
+    Returns:
+        float: 已知时长（探测过但取不到时为0），尚未探测时返回None
+    """
+    metadata = media_metadata.lookup(os.path.join(LOCAL_DIR, filename))
+    return metadata["duration"] if metadata is not None else None
+
+def _mpv_property_default(property_name):
+    """获取属性失败时，为不同属性返回合理的默认值"""
+    if property_name == "filename":
+        return ""
+    elif property_name == "volume":
+        return 100  # 默认音量100%
+    elif property_name in ["time-pos", "duration"]:
+        return 0  # 默认播放位置和持续时间为0
+    elif property_name in ["pause", "eof-reached", "idle-active"]:
+        return False  # 默认非暂停、未到文件末尾、非空闲
+    return None
+
+def _parse_property_response(property_name, response, message):
+    """把一条get_property响应转换为 (值, 消息)，与get_mpv_property的返回约定一致"""
+    if response is None:
+        operation_logger.warning(f"[MPV属性] 获取属性 {property_name} 失败: {message}")
+        return _mpv_property_default(property_name), f"{message} (returning default value for {property_name})"
+    
+    if response.get("error") == "success":
+        data = response.get("data")
+        operation_logger.debug(f"[MPV属性] 成功获取属性 {property_name}: {data}")
+        # 特殊处理filename属性，确保返回字符串类型
+        if property_name == "filename" and data is None:
+            return "", "Success"
+        return data, "Success"
+    
+    operation_logger.debug(f"[MPV属性] MPV属性错误 {property_name}: {response.get('error')}")
+    return _mpv_property_default(property_name), f"MPV error: {response.get('error')}"
 
 def get_mpv_property(property_name):
     """获取MPV属性值"""
@@ -459,256 +1018,725 @@ def get_mpv_property(property_name):
         extra = f" ({MPV_RUNTIME_ERROR})" if MPV_RUNTIME_ERROR else ""
         error_msg = f"MPV Socket not found at {MPV_SOCKET_PATH}. Is MPV running?{extra}"
         operation_logger.debug(f"[MPV属性] {error_msg}")
-        # 为不同属性返回合理的默认值
-        if property_name == "filename":
-            return "", error_msg
-        elif property_name == "volume":
-            return 100, error_msg  # 默认音量100%
-        elif property_name in ["time-pos", "duration"]:
-            return 0, error_msg  # 默认播放位置和持续时间为0
-        elif property_name in ["pause", "eof-reached", "idle-active"]:
-            return False, error_msg  # 默认非暂停、未到文件末尾、非空闲
-        return None, error_msg
-    
-    # 构建JSON命令
-    json_command = json.dumps({"command": ["get_property", property_name]})
-    operation_logger.debug(f"[MPV属性] 构建的JSON命令: {json_command}")
-    
-    # 使用socat发送命令并获取输出
-    import subprocess
+        return _mpv_property_default(property_name), error_msg
+    
     try:
-        operation_logger.debug(f"[MPV属性] 执行subprocess命令获取属性")
-        result = subprocess.run(
-            ['socat', '-t', '1', '-', f'UNIX-CONNECT:{MPV_SOCKET_PATH}'],
-            input=json_command,
-            text=True,
-            capture_output=True,
-            timeout=2  # 添加超时限制
-        )
-        
-        operation_logger.debug(f"[MPV属性] subprocess返回码: {result.returncode}")
-        operation_logger.debug(f"[MPV属性] 标准输出: '{result.stdout.strip()}'")
-        operation_logger.debug(f"[MPV属性] 标准错误: '{result.stderr.strip()}'")
-        
-        if result.returncode == 0:
-            response_text = result.stdout.strip()
-            if response_text:
-                operation_logger.debug(f"[MPV属性] 收到响应文本: {response_text}")
-                try:
-                    response = json.loads(response_text)
-                    operation_logger.debug(f"[MPV属性] 解析后的响应: {response}")
-                    
-                    if 'data' in response:
-                        operation_logger.debug(f"[MPV属性] 成功获取属性 {property_name}: {response['data']}")
-                        # 特殊处理filename属性，确保返回字符串类型
-                        if property_name == "filename" and response['data'] is None:
-                            operation_logger.debug(f"[MPV属性] filename属性为None，返回空字符串")
-                            return "", "Success"
-                        return response['data'], "Success"
-                    elif 'error' in response:
-                        operation_logger.warning(f"[MPV属性] MPV属性错误 {property_name}: {response['error']}")
-                        # 对于不同属性返回合理的默认值
-                        if property_name == "filename":
-                            operation_logger.debug(f"[MPV属性] filename属性出错，返回空字符串")
-                            return "", "MPV error but returning empty string for filename"
-                        elif property_name == "volume":
-                            return 100, f"MPV error but returning default volume"
-                        elif property_name in ["time-pos", "duration"]:
-                            return 0, f"MPV error but returning default value for {property_name}"
-                        elif property_name in ["pause", "eof-reached", "idle-active"]:
-                            return False, f"MPV error but returning default value for {property_name}"
-                        return None, f"MPV error: {response['error']}"
-                    else:
-                        operation_logger.warning(f"[MPV属性] 响应中既没有data也没有error字段: {response}")
-                        if property_name == "filename":
-                            return "", "No data or error but returning empty string for filename"
-                        elif property_name == "volume":
-                            return 100, f"No data or error but returning default volume"
-                        elif property_name in ["time-pos", "duration"]:
-                            return 0, f"No data or error but returning default value for {property_name}"
-                        elif property_name in ["pause", "eof-reached", "idle-active"]:
-                            return False, f"No data or error but returning default value for {property_name}"
-                        return None, "Response contains neither data nor error"
-                except json.JSONDecodeError:
-                    operation_logger.error(f"[MPV属性] 解析MPV响应失败: {response_text}")
-                    # 对于不同属性返回合理的默认值
-                    if property_name == "filename":
-                        return "", "Failed to parse but returning empty string for filename"
-                    elif property_name == "volume":
-                        return 100, f"Failed to parse but returning default volume"
-                    elif property_name in ["time-pos", "duration"]:
-                        return 0, f"Failed to parse but returning default value for {property_name}"
-                    elif property_name in ["pause", "eof-reached", "idle-active"]:
-                        return False, f"Failed to parse but returning default value for {property_name}"
-                    return None, "Failed to parse MPV response"
-            else:
-                operation_logger.debug(f"[MPV属性] 从MPV收到空响应，属性: {property_name}")
-                # 对于不同属性返回合理的默认值
-                if property_name == "filename":
-                    # 特殊处理：如果收到空响应，尝试从path属性获取
-                    try:
-                        path, path_msg = get_mpv_property("path")
-                        if path and isinstance(path, str) and path.strip():
-                            filename_from_path = os.path.basename(path)
-                            operation_logger.debug(f"[MPV属性] 从path获取filename: {filename_from_path}")
-                            return filename_from_path, "Empty response but got filename from path"
-                    except Exception as e:
-                        operation_logger.debug(f"[MPV属性] 从path获取filename失败: {e}")
-                    # 如果从path获取失败，返回空字符串
-                    return "", "Empty response but returning empty string for filename"
-                elif property_name == "volume":
-                    return 100, f"Empty response but returning default volume"
-                elif property_name in ["time-pos", "duration"]:
-                    return 0, f"Empty response but returning default value for {property_name}"
-                elif property_name in ["pause", "eof-reached", "idle-active"]:
-                    return False, f"Empty response but returning default value for {property_name}"
-                return None, "Empty response from MPV"
-        else:
-            operation_logger.warning(f"[MPV属性] 获取属性 {property_name} 失败, 返回码: {result.returncode}, 错误输出: {result.stderr}")
-            # 对于不同属性返回合理的默认值
-            if property_name == "filename":
-                # 特殊处理：如果命令执行失败，尝试从path属性获取
-                try:
-                    path, path_msg = get_mpv_property("path")
-                    if path and isinstance(path, str) and path.strip():
-                        filename_from_path = os.path.basename(path)
-                        operation_logger.debug(f"[MPV属性] 从path获取filename: {filename_from_path}")
-                        return filename_from_path, "Command failed but got filename from path"
-                except Exception as e:
-                    operation_logger.debug(f"[MPV属性] 从path获取filename失败: {e}")
-                # 如果从path获取失败，返回空字符串
-                return "", "Command failed but returning empty string for filename"
-            elif property_name == "volume":
-                return 100, f"Command failed but returning default volume"
-            elif property_name in ["time-pos", "duration"]:
-                return 0, f"Command failed but returning default value for {property_name}"
-            elif property_name in ["pause", "eof-reached", "idle-active"]:
-                return False, f"Command failed but returning default value for {property_name}"
-            return None, f"Command failed with return code {result.returncode}"
-    except subprocess.TimeoutExpired:
-        operation_logger.error(f"[MPV属性] 获取MPV属性 {property_name} 超时")
-        # 对于不同属性返回合理的默认值
-        if property_name == "filename":
-            # 特殊处理：如果超时，尝试从path属性获取
-            try:
-                path, path_msg = get_mpv_property("path")
-                if path and isinstance(path, str) and path.strip():
-                    filename_from_path = os.path.basename(path)
-                    operation_logger.debug(f"[MPV属性] 从path获取filename: {filename_from_path}")
-                    return filename_from_path, "Timeout but got filename from path"
-            except Exception as e:
-                operation_logger.debug(f"[MPV属性] 从path获取filename失败: {e}")
-            # 如果从path获取失败，返回空字符串
-            return "", "Timeout but returning empty string for filename"
-        elif property_name == "volume":
-            return 100, f"Timeout but returning default volume"
-        elif property_name in ["time-pos", "duration"]:
-            return 0, f"Timeout but returning default value for {property_name}"
-        elif property_name in ["pause", "eof-reached", "idle-active"]:
-            return False, f"Timeout but returning default value for {property_name}"
-        return None, "Timeout getting MPV property"
+        response, message = mpv_ipc.request(["get_property", property_name])
     except Exception as e:
         operation_logger.error(f"[MPV属性] 获取MPV属性 {property_name} 异常: {str(e)}", exc_info=True)
-        # 对于不同属性返回合理的默认值
-        if property_name == "filename":
-            # 特殊处理：如果发生异常，尝试从path属性获取
-            try:
-                path, path_msg = get_mpv_property("path")
-                if path and isinstance(path, str) and path.strip():
-                    filename_from_path = os.path.basename(path)
-                    operation_logger.debug(f"[MPV属性] 从path获取filename: {filename_from_path}")
-                    return filename_from_path, "Exception but got filename from path"
-            except Exception as e:
-                operation_logger.debug(f"[MPV属性] 从path获取filename失败: {e}")
-            # 如果从path获取失败，返回空字符串
-            return "", "Exception but returning empty string for filename"
-        elif property_name == "volume":
-            return 100, f"Exception but returning default volume"
-        elif property_name in ["time-pos", "duration"]:
-            return 0, f"Exception but returning default value for {property_name}"
-        elif property_name in ["pause", "eof-reached", "idle-active"]:
-            return False, f"Exception but returning default value for {property_name}"
-        return None, str(e)
-
-def get_audio_files():
-    """获取本地缓存目录中的音频文件列表"""
-    if not os.path.exists(LOCAL_DIR):
-        return []
+        response, message = None, str(e)
     
-    audio_extensions = ('.mp3', '.flac', '.ogg', '.aac', '.m4a', '.wav', '.mp4', '.webm')
-    files = []
-    for file in os.listdir(LOCAL_DIR):
-        if file.lower().endswith(audio_extensions):
-            files.append(file)
-    return sorted(files)
-
-def rclone_sync(filename=None):
-    """同步NAS文件到本地缓存（一次只缓存一个文件，已缓存的文件不再重复缓存）
+    value, result_msg = _parse_property_response(property_name, response, message)
     
-    Args:
-        filename: 要缓存的文件名，如果为None则列出文件但不缓存
-        
+    # 特殊处理：通信失败时尝试从path属性获取filename
+    if property_name == "filename" and response is None:
+        try:
+            path, _ = get_mpv_property("path")
+            if path and isinstance(path, str) and path.strip():
+                filename_from_path = os.path.basename(path)
+                operation_logger.debug(f"[MPV属性] 从path获取filename: {filename_from_path}")
+                return filename_from_path, f"{message} but got filename from path"
+        except Exception as e:
+            operation_logger.debug(f"[MPV属性] 从path获取filename失败: {e}")
+    
+    return value, result_msg
+
+def get_mpv_properties(property_names):
+    """一次往返批量获取多个MPV属性
+
+    所有get_property请求在同一连接上一次性写出，再按request_id收集响应。
+
     Returns:
-        tuple: (是否成功, 消息)
+        tuple: ({属性名: 值}, {属性名: 消息})，单个属性的值和消息与get_mpv_property的约定一致
     """
-    app.logger.debug(f"[RCLONE] 开始同步，目标文件: {filename}")
+    property_names = list(dict.fromkeys(property_names))
+    operation_logger.debug(f"[MPV属性] 批量获取属性: {property_names}")
+    values = {}
+    messages = {}
+    
+    if not os.path.exists(MPV_SOCKET_PATH):
+        extra = f" ({MPV_RUNTIME_ERROR})" if MPV_RUNTIME_ERROR else ""
+        error_msg = f"MPV Socket not found at {MPV_SOCKET_PATH}. Is MPV running?{extra}"
+        for property_name in property_names:
+            values[property_name] = _mpv_property_default(property_name)
+            messages[property_name] = error_msg
+        return values, messages
+    
     try:
-        # 确保本地缓存目录存在
-        os.makedirs(LOCAL_DIR, exist_ok=True)
-        
-        # 如果指定了文件名
-        if filename:
-            # 检查文件是否已经在本地缓存中
-            local_file_path = os.path.join(LOCAL_DIR, filename)
-            if os.path.exists(local_file_path):
-                app.logger.debug(f"[RCLONE] 文件已存在于缓存中: {filename}")
-                return True, f"文件 '{filename}' 已存在于缓存中，不需要重新下载"
-            
-            # 使用rclone_copy_file复制单个文件
-            app.logger.debug(f"[RCLONE] 开始缓存文件: {filename}")
-            success, message = rclone_copy_file(filename, local_file_path)
-            if success:
-                app.logger.debug(f"[RCLONE] 文件缓存成功: {filename}")
-                return True, f"文件 '{filename}' 缓存成功"
-            else:
-                app.logger.error(f"[RCLONE] 文件缓存失败: {filename}, 错误: {message}")
-                return False, f"文件 '{filename}' 缓存失败: {message}"
-        else:
-            # 如果没有指定文件名，返回文件列表但不缓存
-            app.logger.debug("[RCLONE] 未指定文件名，返回NAS文件列表")
-            files, message = rclone_list_files()
-            if files is not None:
-                return True, f"NAS中有 {len(files)} 个文件可用"
-            else:
-                return False, message
+        responses, message = mpv_ipc.request_many([["get_property", name] for name in property_names])
     except Exception as e:
-        app.logger.error(f"[RCLONE] 同步过程中发生异常: {str(e)}", exc_info=True)
-        return False, f"同步异常: {str(e)}"
+        operation_logger.error(f"[MPV属性] 批量获取MPV属性异常: {str(e)}", exc_info=True)
+        responses, message = [None] * len(property_names), str(e)
+    
+    for property_name, response in zip(property_names, responses):
+        values[property_name], messages[property_name] = _parse_property_response(
+            property_name, response, message)
+    
+    # filename为空时回退到path（path也在本批次中时直接复用）
+    if "filename" in values and not values["filename"]:
+        path = values.get("path")
+        if path is None and responses[property_names.index("filename")] is None:
+            path, _ = get_mpv_property("path")
+        if path and isinstance(path, str) and path.strip():
+            values["filename"] = os.path.basename(path)
+    
+    return values, messages
 
-def rclone_list_files():
-    """列出NAS上的音频文件（不下载）"""
-    app.logger.info("[RCLONE] 开始获取NAS文件列表")
-    try:
-        rclone_remote = "synology:download/bilibili/push"
-        app.logger.debug(f"[RCLONE] 使用远程路径: {rclone_remote}")
-        
-        # 使用rclone lsjson获取文件列表 - 使用参数列表避免shell注入风险
-        cmd_args = [
-            'rclone', 'lsjson', rclone_remote,
-            '--include', '*.mp4',
-            '--include', '*.mp3',
-            '--include', '*.flac',
-            '--include', '*.ogg',
-            '--include', '*.aac',
-            '--include', '*.m4a',
-            '--include', '*.wav',
-            '--include', '*.webm'
-        ]
-        app.logger.debug(f"[RCLONE] 执行命令: {' '.join(cmd_args)}")
-        
-        import subprocess
+# MPV进程守护配置
+MPV_SUPERVISOR_ENABLED = os.environ.get('MPV_SUPERVISOR_ENABLED', 'true').lower() == 'true'
+MPV_STANDBY_ENABLED = os.environ.get('MPV_STANDBY_ENABLED', 'false').lower() == 'true'
+MPV_HEALTH_CHECK_INTERVAL = 5.0   # 健康检查间隔（秒）
+MPV_HANG_THRESHOLD = 2            # 连续多少次ping无响应判定为卡死
+MPV_RESTART_BACKOFF_MAX = 30.0    # 重启退避的最大间隔（秒）
+MPV_STABLE_RESET_SECONDS = 60.0   # 稳定运行多久后清零失败计数
+MPV_BASE_ARGS = [
+    "--no-video",
+    "--cache=yes",
+    "--cache-secs=60",
+    "--idle=yes",  # 保持mpv运行状态
+    "--force-window=no",  # 不强制创建窗口
+    "--really-quiet",  # 减少输出噪音
+    "--af=silencedetect=noise=-30dB:d=3.5",  # 添加静音检测滤镜: -30dB, 3.5秒
+]
+
+# 无缝切歌：预先把下一首追加到mpv播放列表
+GAPLESS_PRELOAD_ENABLED = os.environ.get('GAPLESS_PRELOAD_ENABLED', 'false').lower() == 'true'
+if GAPLESS_PRELOAD_ENABLED:
+    MPV_BASE_ARGS.append("--prefetch-playlist=yes")  # 当前曲目快结束时提前打开播放列表中的下一项
+
+
+class MPVSupervisor:
+    """MPV进程守护
+
+    统一负责mpv子进程的启动、回收和重启：
+    - 进程退出或IPC连接断开时立即检查，按指数退避重启
+    - 定期通过IPC ping（读取pid属性）检测卡死，卡死时强制结束后重启
+    - 可选保持一个空闲的备用mpv（监听 socket.standby），故障时把备用socket改名为主socket直接接管，
+      省去冷启动时间
+    已由外部脚本启动且能正常响应的mpv会被直接接管监控。
+    """
+
+    def __init__(self, socket_path, standby=False):
+        self.socket_path = socket_path
+        self.standby_socket_path = f"{socket_path}.standby"
+        self.standby_enabled = standby
+        self.process = None          # 自己启动的主mpv进程
+        self.standby_process = None  # 备用mpv进程
+        self.mpv_pid = None          # 最近一次ping到的mpv pid（包括外部启动的mpv）
+        self._lock = threading.RLock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._running = False
+        self._failures = 0
+        self._healthy_since = None
+        self._expected_exit_until = 0  # 主动quit后的宽限期截止时间
+        self.restart_count = 0
+
+    def start(self):
+        """启动守护线程"""
+        if self._running:
+            return
+        self._running = True
+        mpv_ipc.add_event_handler(self._on_ipc_event)
+        self._wakeup.set()  # 启动后立即做一次检查
+        self._thread = threading.Thread(target=self._watch_loop, daemon=True)
+        self._thread.start()
+        app.logger.info(f"[MPV_SUPERVISOR] 进程守护已启动 (备用进程: {self.standby_enabled})")
+
+    def expect_exit(self, window=10.0):
+        """声明即将主动退出mpv（例如/mpv/stop发送quit）
+
+        宽限期内检测到的退出按正常退出处理：不计入连续失败、不退避，
+        不论mpv是否由守护进程自己启动。
+        """
+        self._expected_exit_until = time.time() + window
+        self._wakeup.set()
+
+    def _on_ipc_event(self, event):
+        # IPC断开通常意味着mpv退出，立即唤醒守护线程检查
+        if event.get("event") == "ipc-disconnected":
+            self._wakeup.set()
+
+    def ping(self, timeout=2.0):
+        """通过IPC确认mpv仍能响应"""
+        if not os.path.exists(self.socket_path):
+            return False
+        response, _ = mpv_ipc.request(["get_property", "pid"], timeout=timeout)
+        if response is None or response.get("error") != "success":
+            return False
+        self.mpv_pid = response.get("data")
+        return True
+
+    def ensure_running(self):
+        """确保mpv可用，不可用时立即重启
+
+        Returns:
+            tuple: (是否成功, 消息)
+        """
+        if self.ping():
+            return True, "MPV is running"
+        with self._lock:
+            # 可能已被守护线程重启，拿到锁后再确认一次
+            if self.ping():
+                return True, "MPV is running"
+            return self.restart("ensure_running")
+
+    def restart(self, reason="manual"):
+        """重启mpv：优先接管备用进程，否则冷启动
+
+        Returns:
+            tuple: (是否成功, 消息)
+        """
+        with self._lock:
+            app.logger.warning(f"[MPV_SUPERVISOR] 重启MPV，原因: {reason}")
+            self._terminate_main()
+            started = time.time()
+
+            if self._promote_standby():
+                method = "standby"
+            else:
+                self.process = self._spawn(self.socket_path)
+                method = "cold"
+                if self.process is None:
+                    return False, "Failed to start mpv"
+
+            self.restart_count += 1
+            self._healthy_since = None
+            elapsed_ms = (time.time() - started) * 1000
+            app.logger.info(f"[MPV_SUPERVISOR] MPV已重启 (方式: {method}, 耗时: {elapsed_ms:.0f}ms)")
+            add_to_timeline("mpv_restart", f"MPV已重启 ({method})", {"reason": reason, "elapsed_ms": round(elapsed_ms)})
+
+        mpv_ipc.ensure_connection()
+        if self.standby_enabled:
+            threading.Thread(target=self._prepare_standby, daemon=True).start()
+        return True, f"MPV restarted ({method})"
+
+    def status(self):
+        with self._lock:
+            return {
+                "enabled": self._running,
+                "pid": self.process.pid if self.process and self.process.poll() is None else self.mpv_pid,
+                "managed": self.process is not None and self.process.poll() is None,
+                "standby_ready": self.standby_process is not None and self.standby_process.poll() is None,
+                "restart_count": self.restart_count,
+                "consecutive_failures": self._failures,
+            }
+
+    def _spawn(self, socket_path, timeout=5.0):
+        """启动一个空闲mpv并等待socket就绪"""
+        os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        try:
+            process = subprocess.Popen(
+                ["mpv", f"--input-ipc-server={socket_path}"] + MPV_BASE_ARGS,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL
+            )
+        except OSError as e:
+            app.logger.error(f"[MPV_SUPERVISOR] 启动mpv失败: {e}")
+            return None
+
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if os.path.exists(socket_path):
+                try:
+                    os.chmod(socket_path, 0o666)
+                except OSError:
+                    pass
+                return process
+            if process.poll() is not None:
+                app.logger.error(f"[MPV_SUPERVISOR] mpv启动后立即退出，返回码: {process.returncode}")
+                return None
+            time.sleep(0.02)
+
+        app.logger.error(f"[MPV_SUPERVISOR] 等待mpv socket超时: {socket_path}")
+        process.kill()
+        process.wait()
+        return None
+
+    def _prepare_standby(self):
+        with self._lock:
+            if self.standby_process is not None and self.standby_process.poll() is None:
+                return
+            self.standby_process = self._spawn(self.standby_socket_path)
+            if self.standby_process is not None:
+                app.logger.info(f"[MPV_SUPERVISOR] 备用MPV已就绪 (PID {self.standby_process.pid})")
+
+    def _promote_standby(self):
+        standby = self.standby_process
+        if standby is None or standby.poll() is not None or not os.path.exists(self.standby_socket_path):
+            return False
+        # 已绑定的unix socket改名后仍然有效，新连接通过主路径即可连上备用进程
+        os.replace(self.standby_socket_path, self.socket_path)
+        self.process = standby
+        self.standby_process = None
+        return True
+
+    def _terminate_main(self):
+        """结束并回收当前主进程（包括卡死的外部mpv）"""
+        process = self.process
+        if process is not None and process.poll() is None:
+            process.kill()
+        if process is not None:
+            process.wait()
+        elif self.mpv_pid:
+            try:
+                os.kill(self.mpv_pid, 9)
+            except OSError:
+                pass
+        self.process = None
+        self.mpv_pid = None
+        mpv_ipc.close()
+        if os.path.exists(self.socket_path):
+            try:
+                os.remove(self.socket_path)
+            except OSError:
+                pass
+
+    def _watch_loop(self):
+        if self.standby_enabled:
+            self._prepare_standby()
+        missed_pings = 0
+        while self._running:
+            self._wakeup.wait(MPV_HEALTH_CHECK_INTERVAL)
+            self._wakeup.clear()
+            try:
+                exited = self.process is not None and self.process.poll() is not None
+                expected = time.time() < self._expected_exit_until
+                clean_exit = (exited and self.process.returncode == 0) or expected
+                if exited:
+                    app.logger.warning(f"[MPV_SUPERVISOR] MPV进程已退出，返回码: {self.process.returncode}")
+
+                if not exited and self.ping():
+                    missed_pings = 0
+                    now = time.time()
+                    if expected:
+                        # quit尚未生效，稍后再检查
+                        self._wakeup.set()
+                        time.sleep(0.1)
+                        continue
+                    if self._healthy_since is None:
+                        self._healthy_since = now
+                    elif now - self._healthy_since >= MPV_STABLE_RESET_SECONDS:
+                        self._failures = 0
+                    continue
+
+                missed_pings += 1
+                # socket仍存在时给一次宽限，区分短暂阻塞和真正卡死
+                if not expected and not exited and os.path.exists(self.socket_path) and missed_pings < MPV_HANG_THRESHOLD:
+                    continue
+
+                # 首次启动或正常退出（例如/mpv/stop发送的quit）直接拉起空闲进程，不计入失败
+                first_start = self.restart_count == 0 and self._healthy_since is None
+                if not clean_exit and not first_start:
+                    if self._failures > 0:
+                        delay = min(0.5 * (2 ** (self._failures - 1)), MPV_RESTART_BACKOFF_MAX)
+                        app.logger.info(f"[MPV_SUPERVISOR] 第{self._failures}次连续失败，{delay:.1f}秒后重启")
+                        time.sleep(delay)
+                    self._failures += 1
+                missed_pings = 0
+                self._expected_exit_until = 0
+                if first_start:
+                    reason = "start"
+                elif clean_exit:
+                    reason = "quit"
+                else:
+                    reason = "exited" if exited else "unresponsive"
+                self.restart(reason)
+            except Exception as e:
+                app.logger.error(f"[MPV_SUPERVISOR] 健康检查出错: {str(e)}", exc_info=True)
+
+
+mpv_supervisor = MPVSupervisor(MPV_SOCKET_PATH, standby=MPV_STANDBY_ENABLED)
+
+
+def load_file_with_recovery(local_path):
+    """用loadfile替换当前播放文件，失败时通过进程守护重启mpv后重试一次
+
+    Returns:
+        tuple: (是否成功, 消息, 方式 "loadfile" 或 "restart")
+    """
+    # loadfile replace会清空mpv播放列表，之前追加的预加载项随之失效
+    gapless_preloader.invalidate()
+    success, message = send_mpv_command(["loadfile", local_path, "replace"])
+    if success:
+        return True, message, "loadfile"
+    
+    app.logger.warning(f"loadfile命令失败，通过MPV进程守护重启后重试: {message}")
+    restarted, restart_msg = mpv_supervisor.ensure_running()
+    if not restarted:
+        return False, restart_msg, "restart"
+    success, message = send_mpv_command(["loadfile", local_path, "replace"])
+    return success, message, "restart"
+
+
+class GaplessPreloader:
+    """无缝切歌预加载
+
+    当前曲目开始播放后，在后台预测下一首（与next_track相同的顺序规则），确保文件已在本地缓存，
+    再通过 loadfile append 追加到mpv播放列表中当前曲目之后，配合 --prefetch-playlist：
+    - 自然播放结束时mpv直接衔接下一项，没有间隙
+    - 手动切下一首时只需一个 playlist-next，不再有NAS列表/拷贝等磁盘和网络操作
+    预加载结果与预测时的当前曲目绑定，曲目变化后会重新预测。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._scheduled_for = None  # 等待后台预加载的当前曲目
+        self.base_file = None       # 预加载时对应的当前曲目
+        self.preloaded_file = None  # 已追加到mpv播放列表的下一首
+        self.preloaded_path = None
+        self.hits = 0               # 通过预加载完成的切歌次数
+
+    def schedule(self, current_file):
+        """为当前曲目安排后台预加载下一首（立即返回）"""
+        if not GAPLESS_PRELOAD_ENABLED or not current_file:
+            return
+        with self._lock:
+            self._scheduled_for = current_file
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._worker, daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+
+    def invalidate(self):
+        """丢弃预加载结果（mpv播放列表已被替换或清空）"""
+        with self._lock:
+            self.base_file = None
+            self.preloaded_file = None
+            self.preloaded_path = None
+
+    def take(self, current_file):
+        """尝试用预加载项切到下一首
+
+        Returns:
+            tuple: (下一首文件名, 本地路径)，预加载不可用时返回 (None, None)
+        """
+        with self._lock:
+            if not self.preloaded_file or self.base_file != current_file:
+                return None, None
+            next_file, next_path = self.preloaded_file, self.preloaded_path
+            self.base_file = self.preloaded_file = self.preloaded_path = None
+
+        values, _ = get_mpv_properties(["filename", "playlist-pos", "playlist-count"])
+        if values["filename"] == os.path.basename(next_path):
+            # mpv已自然衔接到预加载项（监控线程还没来得及同步）
+            self.hits += 1
+            return next_file, next_path
+        playlist_pos, playlist_count = values["playlist-pos"], values["playlist-count"]
+        if playlist_pos is None or playlist_count is None or playlist_pos + 1 >= playlist_count:
+            return None, None
+        success, message = send_mpv_command(["playlist-next", "force"])
+        if not success:
+            app.logger.warning(f"[GAPLESS] playlist-next失败，回退到完整加载: {message}")
+            return None, None
+        self.hits += 1
+        return next_file, next_path
+
+    def on_file_changed(self, filename_mpv):
+        """监控线程发现mpv播放文件变化时调用，识别自然衔接到预加载项的情况
+
+        Returns:
+            bool: 是否为衔接到预加载项
+        """
+        global current_playing_file, next_playing_file
+        with self._lock:
+            if not self.preloaded_path or filename_mpv != os.path.basename(self.preloaded_path):
+                return False
+            previous_file, next_file = self.base_file, self.preloaded_file
+            self.base_file = self.preloaded_file = self.preloaded_path = None
+        self.hits += 1
+
+        current_playing_file = next_file
+        next_playing_file = next_file
+        with state_lock:
+            self_recorded_state["playing"] = True
+            self_recorded_state["paused"] = False
+            self_recorded_state["current_file"] = next_file
+            self_recorded_state["position"] = 0
+            self_recorded_state["progress"] = 0
+            self_recorded_state["duration"] = 0
+            self_recorded_state["last_update_time"] = time.time()
+        app.logger.info(f"[GAPLESS] 已无缝衔接到下一首: {next_file}")
+        add_to_timeline(
+            "next_track",
+            f"无缝衔接下一首: {next_file}",
+            {"previous_file": previous_file or "未知文件", "next_file": next_file, "source": "preload"}
+        )
+        notify_track_started(next_file)
+        return True
+
+    def status(self):
+        with self._lock:
+            return {
+                "enabled": GAPLESS_PRELOAD_ENABLED,
+                "current_file": self.base_file,
+                "preloaded_file": self.preloaded_file,
+                "pending": self._scheduled_for,
+                "hits": self.hits,
+            }
+
+    def _predict_next(self, current_file):
+        next_file = get_playback_order().neighbor(current_file, 1)
+        return next_file if next_file != current_file else None
+
+    def _preload(self, current_file):
+        next_file = self._predict_next(current_file)
+        if not next_file:
+            return
+        success, local_path, message, _ = get_file_from_cache_or_nas(next_file, priority=DOWNLOAD_PRIORITY_PREFETCH)
+        if not success:
+            app.logger.warning(f"[GAPLESS] 预加载下一首失败: {next_file}, {message}")
+            return
+
+        with self._lock:
+            # 拷贝期间曲目已变化，放弃本次结果
+            if self._scheduled_for is not None and self._scheduled_for != current_file:
+                return
+            with state_lock:
+                if self_recorded_state["current_file"] != current_file:
+                    return
+            # playlist-clear 保留正在播放的项，只清掉之前追加的内容
+            send_mpv_command(["playlist-clear"])
+            success, message = send_mpv_command(["loadfile", local_path, "append"])
+            if not success:
+                app.logger.warning(f"[GAPLESS] 追加到播放列表失败: {message}")
+                return
+            self.base_file = current_file
+            self.preloaded_file = next_file
+            self.preloaded_path = local_path
+        app.logger.info(f"[GAPLESS] 已预加载下一首: {next_file}")
+
+    def _worker(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            with self._lock:
+                current_file, self._scheduled_for = self._scheduled_for, None
+            if not current_file:
+                continue
+            try:
+                self._preload(current_file)
+            except Exception as e:
+                app.logger.error(f"[GAPLESS] 预加载出错: {str(e)}", exc_info=True)
+
+
+gapless_preloader = GaplessPreloader()
+
+
+def _enable_playlist_prefetch():
+    """外部启动的mpv可能没有带 --prefetch-playlist，连接后在运行时打开"""
+    if GAPLESS_PRELOAD_ENABLED:
+        send_mpv_command(["set_property", "prefetch-playlist", True])
+
+
+mpv_ipc.add_connect_handler(_enable_playlist_prefetch)
+
+AUDIO_EXTENSIONS = ('.mp3', '.flac', '.ogg', '.aac', '.m4a', '.wav', '.mp4', '.webm')
+CACHE_INDEX_REVALIDATE_INTERVAL = 1.0  # 两次检查缓存目录是否被外部修改的最小间隔（秒）
+
+
+class CacheDirectoryIndex:
+    """缓存目录的内存索引：文件名 -> (大小, 修改时间)
+
+    启动后第一次使用时用os.scandir扫描一次，之后由下载、淘汰、清理等写入方直接更新，
+    总大小随增删增量维护。其他进程对目录的增删（会改变目录的修改时间）通过定期stat目录发现，
+    发现变化时重新扫描。下载中的.part临时文件不计入。
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._files = {}
+        self._total_size = 0
+        self._dir_mtime = None
+        self._checked_at = 0
+        self._audio_files = None  # 排序后的音频文件列表，目录变化时失效
+        self.stats = {"scans": 0}
+
+    def _revalidate(self):
+        """调用方持有锁"""
+        now = time.monotonic()
+        if self._dir_mtime is not None and now - self._checked_at < CACHE_INDEX_REVALIDATE_INTERVAL:
+            return
+        self._checked_at = now
+        try:
+            dir_mtime = os.stat(self.directory).st_mtime_ns
+        except OSError:
+            dir_mtime = -1
+        if dir_mtime != self._dir_mtime:
+            self._scan()
+            self._dir_mtime = dir_mtime
+
+    def _scan(self):
+        files = {}
+        if os.path.isdir(self.directory):
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(PARTIAL_SUFFIX):
+                    continue
+                try:
+                    if entry.is_file():
+                        stat = entry.stat()
+                        files[entry.name] = (stat.st_size, stat.st_mtime)
+                except OSError:
+                    continue
+        self._files = files
+        self._total_size = sum(size for size, _ in files.values())
+        self._audio_files = None
+        self.stats["scans"] += 1
+
+    def add(self, name):
+        """文件写入缓存目录后调用"""
+        try:
+            stat = os.stat(os.path.join(self.directory, name))
+        except OSError:
+            return self.discard(name)
+        with self._lock:
+            old = self._files.get(name)
+            self._total_size += stat.st_size - (old[0] if old else 0)
+            self._files[name] = (stat.st_size, stat.st_mtime)
+            self._audio_files = None
+
+    def discard(self, name):
+        """文件从缓存目录删除后调用"""
+        with self._lock:
+            old = self._files.pop(name, None)
+            if old:
+                self._total_size -= old[0]
+                self._audio_files = None
+
+    def invalidate(self):
+        """批量修改目录后调用，下次访问时重新扫描"""
+        with self._lock:
+            self._dir_mtime = None
+
+    def contains(self, name):
+        with self._lock:
+            self._revalidate()
+            return name in self._files
+
+    def get(self, name):
+        """返回(大小, 修改时间)，未缓存时返回None"""
+        with self._lock:
+            self._revalidate()
+            return self._files.get(name)
+
+    def names(self):
+        with self._lock:
+            self._revalidate()
+            return list(self._files)
+
+    def audio_files(self):
+        """排序后的音频文件名列表"""
+        with self._lock:
+            self._revalidate()
+            if self._audio_files is None:
+                self._audio_files = sorted(
+                    name for name in self._files if name.lower().endswith(AUDIO_EXTENSIONS)
+                )
+            return list(self._audio_files)
+
+    def snapshot(self):
+        """返回({文件名: (大小, 修改时间)}, 总大小)"""
+        with self._lock:
+            self._revalidate()
+            return dict(self._files), self._total_size
+
+    def status(self):
+        with self._lock:
+            return {"file_count": len(self._files), "total_size": self._total_size, **self.stats}
+
+
+cache_index = CacheDirectoryIndex(LOCAL_DIR)
+
+
+def get_audio_files():
+    """获取本地缓存目录中的音频文件列表"""
+    return cache_index.audio_files()
+
+def rclone_sync(filename=None):
+    """同步NAS文件到本地缓存（一次只缓存一个文件，已缓存的文件不再重复缓存）
+    
+    Args:
+        filename: 要缓存的文件名，如果为None则列出文件但不缓存
+        
+    Returns:
+        tuple: (是否成功, 消息)
+    """
+    app.logger.debug(f"[RCLONE] 开始同步，目标文件: {filename}")
+    try:
+        # 确保本地缓存目录存在
+        os.makedirs(LOCAL_DIR, exist_ok=True)
+        
+        # 如果指定了文件名
+        if filename:
+            # 检查文件是否已经在本地缓存中
+            if cache_index.contains(filename):
+                app.logger.debug(f"[RCLONE] 文件已存在于缓存中: {filename}")
+                return True, f"文件 '{filename}' 已存在于缓存中，不需要重新下载"
+            
+            # 使用rclone_copy_file复制单个文件
+            app.logger.debug(f"[RCLONE] 开始缓存文件: {filename}")
+            success, message = download_manager.fetch(filename, DOWNLOAD_PRIORITY_PREFETCH)
+            if success:
+                app.logger.debug(f"[RCLONE] 文件缓存成功: {filename}")
+                return True, f"文件 '{filename}' 缓存成功"
+            else:
+                app.logger.error(f"[RCLONE] 文件缓存失败: {filename}, 错误: {message}")
+                return False, f"文件 '{filename}' 缓存失败: {message}"
+        else:
+            # 如果没有指定文件名，返回文件列表但不缓存
+            app.logger.debug("[RCLONE] 未指定文件名，刷新并返回NAS文件列表")
+            files, message = nas_catalog.refresh()
+            if files is not None:
+                return True, f"NAS中有 {len(files)} 个文件可用"
+            else:
+                return False, message
+    except Exception as e:
+        app.logger.error(f"[RCLONE] 同步过程中发生异常: {str(e)}", exc_info=True)
+        return False, f"同步异常: {str(e)}"
+
+RCLONE_LIST_TIMEOUT = 60  # rclone lsjson 超时时间（秒）
+
+
+def fetch_nas_file_list():
+    """通过rclone lsjson列出NAS上的音频文件名（不下载），直接访问NAS，请求处理中请使用rclone_list_files"""
+    entries, message = fetch_nas_entries()
+    return [entry["name"] for entry in entries], message
+
+
+def fetch_nas_entries():
+    """通过rclone lsjson列出NAS上的音频文件及其大小、修改时间
+
+    Returns:
+        tuple: ([{"name", "size", "mod_time"}, ...], 消息)
+    """
+    app.logger.info("[RCLONE] 开始获取NAS文件列表")
+    try:
+        rclone_remote = RCLONE_REMOTE
+        app.logger.debug(f"[RCLONE] 使用远程路径: {rclone_remote}")
+        
+        # 使用rclone lsjson获取文件列表 - 使用参数列表避免shell注入风险
+        cmd_args = [
+            'rclone', 'lsjson', rclone_remote,
+            '--include', '*.mp4',
+            '--include', '*.mp3',
+            '--include', '*.flac',
+            '--include', '*.ogg',
+            '--include', '*.aac',
+            '--include', '*.m4a',
+            '--include', '*.wav',
+            '--include', '*.webm'
+        ]
+        app.logger.debug(f"[RCLONE] 执行命令: {' '.join(cmd_args)}")
+        
+        import subprocess
         start_time = time.time()
-        result = subprocess.run(cmd_args, capture_output=True, text=True)
+        result = subprocess.run(cmd_args, capture_output=True, text=True, timeout=RCLONE_LIST_TIMEOUT)
         execution_time = time.time() - start_time
         
         app.logger.debug(f"[RCLONE] 命令执行完成，返回码: {result.returncode}，执行时间: {execution_time:.2f}秒")
@@ -745,7 +1773,11 @@ def rclone_list_files():
                 for item in files_data:
                     if not item.get('IsDir', False):
                         if 'Name' in item:
-                            file_list.append(item['Name'])
+                            file_list.append({
+                                "name": item['Name'],
+                                "size": item.get('Size', -1),
+                                "mod_time": item.get('ModTime', "")
+                            })
                         else:
                             app.logger.warning(f"[RCLONE] 文件项缺少'Name'字段: {item}")
                 
@@ -781,323 +1813,1842 @@ def rclone_list_files():
         app.logger.error(f"[RCLONE] 获取文件列表时发生未预期异常: {str(e)}", exc_info=True)
         return [], f"Exception during rclone operation: {str(e)}"
 
-def rclone_copy_file(remote_path, local_path, task_id=None):
-    """从NAS复制单个文件到本地，支持进度跟踪"""
-    app.logger.info(f"[RCLONE] 开始复制文件: 远程={remote_path} -> 本地={local_path}, 任务ID={task_id}")
-    
-    # 检查本地文件是否已存在
-    if os.path.exists(local_path):
-        app.logger.info(f"[RCLONE] 文件已存在于本地: {local_path}，跳过复制")
-        if task_id:
-            with download_lock:
-                if task_id in download_progress:
-                    download_progress[task_id]['status'] = 'completed'
-                    download_progress[task_id]['current_size'] = download_progress[task_id].get('total_size', 0)
-        return True, "File already exists locally"
-    
-    try:
-        rclone_remote = "synology:download/bilibili/push"
-        remote_file = f"{rclone_remote}/{remote_path}"
-        app.logger.debug(f"[RCLONE] 构建远程文件路径: {remote_file}")
-        
-        # 如果有任务ID，先获取文件大小
-        total_size = 0
-        if task_id:
-            try:
-                import subprocess
-                # 使用参数列表而不是shell命令，避免空格问题
-                size_result = subprocess.run(
-                    ['rclone', 'size', remote_file, '--json'],
-                    capture_output=True,
-                    text=True,
-                    timeout=10
-                )
-                if size_result.returncode == 0:
-                    size_data = json.loads(size_result.stdout)
-                    total_size = size_data.get('bytes', 0)
-                    app.logger.debug(f"[RCLONE] 获取到文件大小: {total_size} 字节")
-                    
-                    # 初始化进度信息
-                    with download_lock:
-                        download_progress[task_id] = {
-                            'filename': remote_path,
-                            'total_size': total_size,
-                            'current_size': 0,
-                            'status': 'downloading',
-                            'error': None,
-                            'start_time': time.time()
-                        }
-            except Exception as e:
-                app.logger.warning(f"[RCLONE] 获取文件大小失败: {str(e)}")
-        
-        # 确保本地目录存在
-        os.makedirs(os.path.dirname(local_path), exist_ok=True)
-        app.logger.debug(f"[RCLONE] 确保本地目录存在: {os.path.dirname(local_path)}")
-        
-        import subprocess
-        # 使用参数列表而不是shell命令，这样可以正确处理包含空格的文件名
-        cmd_args = ['rclone', 'copyto', remote_file, local_path]
-        app.logger.debug(f"[RCLONE] 执行命令: {' '.join(cmd_args)}")
-        
-        # 在后台线程中执行下载，同时监控进度
-        download_complete = threading.Event()
-        download_error = [None]  # 使用列表来存储错误，以便在线程中修改
-        
-        def download_worker():
+
+class LibraryIndex:
+    """持久化的曲库索引（SQLite）
+
+    保存NAS文件的名称、大小、修改时间和本地缓存状态。每次重新扫描只把差异（新增、删除、
+    大小或修改时间变化）写入数据库，重启后直接从索引加载目录。
+    单个连接在锁保护下跨线程共享。
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS tracks ("
+                "name TEXT PRIMARY KEY, size INTEGER, mod_time TEXT, "
+                "cached INTEGER NOT NULL DEFAULT 0, first_seen REAL, updated_at REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_tracks_cached ON tracks(cached)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def apply_scan(self, entries):
+        """把一次完整的NAS列表与索引做差异合并
+
+        Args:
+            entries: fetch_nas_entries 返回的文件列表
+
+        Returns:
+            dict: 新增、删除、变化的数量
+        """
+        now = time.time()
+        cached_names = set(cache_index.names())
+        scanned = {entry["name"]: entry for entry in entries}
+        with self._lock, self._conn:
+            existing = {
+                name: (size, mod_time, cached)
+                for name, size, mod_time, cached in self._conn.execute(
+                    "SELECT name, size, mod_time, cached FROM tracks")
+            }
+            added = [name for name in scanned if name not in existing]
+            removed = [name for name in existing if name not in scanned]
+            changed = [
+                name for name, entry in scanned.items()
+                if name in existing and existing[name][:2] != (entry["size"], entry["mod_time"])
+            ]
+            recached = [
+                name for name in scanned
+                if name in existing and bool(existing[name][2]) != (name in cached_names)
+            ]
+
+            self._conn.executemany(
+                "INSERT INTO tracks (name, size, mod_time, cached, first_seen, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [(name, scanned[name]["size"], scanned[name]["mod_time"], int(name in cached_names), now, now)
+                 for name in added]
+            )
+            self._conn.executemany("DELETE FROM tracks WHERE name = ?", [(name,) for name in removed])
+            self._conn.executemany(
+                "UPDATE tracks SET size = ?, mod_time = ?, updated_at = ? WHERE name = ?",
+                [(scanned[name]["size"], scanned[name]["mod_time"], now, name) for name in changed]
+            )
+            self._conn.executemany(
+                "UPDATE tracks SET cached = ? WHERE name = ?",
+                [(int(name in cached_names), name) for name in recached]
+            )
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('last_scan', ?)", (str(now),))
+        return {"added": len(added), "removed": len(removed), "changed": len(changed)}
+
+    def all_names(self):
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT name FROM tracks ORDER BY name")]
+
+    def last_scan(self):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'last_scan'").fetchone()
+        return float(row[0]) if row else None
+
+    def random_track(self, cached_only=False):
+        """从索引中随机选一首，cached_only时只选本地已缓存的"""
+        sql = "SELECT name FROM tracks WHERE cached = 1 ORDER BY RANDOM() LIMIT 1" if cached_only \
+            else "SELECT name FROM tracks ORDER BY RANDOM() LIMIT 1"
+        with self._lock:
+            row = self._conn.execute(sql).fetchone()
+        return row[0] if row else None
+
+    def get_size(self, name):
+        """索引中记录的文件大小，未收录时返回None"""
+        with self._lock:
+            row = self._conn.execute("SELECT size FROM tracks WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def set_cached(self, name, cached):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE tracks SET cached = ? WHERE name = ?", (int(cached), name))
+
+    def clear_cached(self):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE tracks SET cached = 0 WHERE cached = 1")
+
+    def status(self):
+        with self._lock:
+            total, cached = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(cached), 0) FROM tracks").fetchone()
+        return {"db_path": self.db_path, "tracks": total, "cached": cached, "last_scan": self.last_scan()}
+
+
+try:
+    library_index = LibraryIndex(LIBRARY_DB_PATH)
+except sqlite3.Error as e:
+    # 索引不可用时目录缓存仍可只在内存中工作
+    library_index = None
+    app.logger.error(f"[LIBRARY] 打开曲库索引失败: {str(e)}")
+
+
+NAS_CATALOG_TTL = float(os.environ.get('NAS_CATALOG_TTL', 300))  # 文件目录缓存有效期（秒）
+NAS_CATALOG_RETRY_INTERVAL = 30.0  # 刷新失败后至少间隔多久再重试（秒）
+NAS_CATALOG_COLD_WAIT = 15.0       # 启动后还没有任何目录数据时，请求最多等待首次加载多久（秒）
+NAS_CATALOG_HISTORY = 50           # 保留多少个版本的增删记录，用于 /files?since= 增量查询
+
+
+class NASCatalog:
+    """NAS文件目录缓存
+
+    在内存中保存最近一次rclone lsjson的结果，请求直接读取缓存：
+    - 超过TTL后仍先返回旧数据，同时在后台线程刷新（stale-while-revalidate）
+    - 同一时间最多只有一个刷新在运行
+    - 刷新失败时保留旧数据，按重试间隔再试
+    启动时先从持久化的曲库索引加载上次的目录；只有在还没有任何数据时请求才会短暂等待首次加载。
+    """
+
+    def __init__(self, ttl, index=None):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._loaded = threading.Event()
+        self._refreshing = False
+        self.files = []
+        self.message = "Catalog not loaded"
+        self.fetched_at = None     # 最近一次成功刷新的时间
+        self.last_attempt = 0      # 最近一次尝试刷新的时间
+        self.last_error = None
+        # 文件列表内容变化时递增；首次加载时以启动时间为起点，保证重启后版本号不会与之前的重复
+        self.version = 0
+        self._changes = deque(maxlen=NAS_CATALOG_HISTORY)  # [(新版本号, 新增文件, 删除文件)]
+        self.index = index
+        self.last_diff = None      # 最近一次扫描与索引的差异
+        self._load_from_index()
+
+    def _load_from_index(self):
+        if self.index is None:
+            return
+        try:
+            files = self.index.all_names()
+        except sqlite3.Error as e:
+            app.logger.error(f"[CATALOG] 从曲库索引加载失败: {str(e)}")
+            return
+        if files:
+            self.files = files
+            self.message = "Success"
+            # 沿用上次扫描时间，重启后仍按TTL判断是否需要刷新
+            self.fetched_at = self.index.last_scan()
+            self.version = int(time.time())
+            self._loaded.set()
+            app.logger.info(f"[CATALOG] 已从曲库索引加载 {len(files)} 个文件")
+
+    def get(self):
+        """返回 (文件列表, 消息)，与原rclone_list_files一致；文件列表为共享对象，调用方不要修改"""
+        if not self._loaded.is_set():
+            self.refresh_async()
+            self._loaded.wait(NAS_CATALOG_COLD_WAIT)
+        elif self.is_stale():
+            self.refresh_async()
+        with self._lock:
+            return self.files, self.message
+
+    @property
+    def loaded(self):
+        return self._loaded.is_set()
+
+    def is_stale(self):
+        now = time.time()
+        with self._lock:
+            if self.fetched_at is not None and now - self.fetched_at < self.ttl:
+                return False
+            return now - self.last_attempt >= NAS_CATALOG_RETRY_INTERVAL
+
+    def refresh_async(self):
+        """在后台线程刷新目录，已有刷新在运行时直接返回"""
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, daemon=True).start()
+
+    def refresh(self):
+        """同步刷新目录（用于手动同步），已有刷新在运行时等待其完成
+
+        Returns:
+            tuple: (文件列表, 消息)
+        """
+        with self._lock:
+            already_running = self._refreshing
+            self._refreshing = True
+        if not already_running:
+            self._refresh()
+        else:
+            while True:
+                with self._lock:
+                    if not self._refreshing:
+                        break
+                time.sleep(0.1)
+        with self._lock:
+            return self.files, self.message
+
+    def _record_change(self, files):
+        """在锁内调用：递增版本号并记录与旧列表的差异"""
+        if self.version == 0:
+            self.version = int(time.time())
+        else:
+            self.version += 1
+            old_set, new_set = set(self.files), set(files)
+            self._changes.append((self.version, sorted(new_set - old_set), sorted(old_set - new_set)))
+
+    def changes_since(self, version):
+        """返回从指定版本到当前版本的增删差异
+
+        Returns:
+            tuple: (新增文件, 删除文件)，历史记录已不包含该版本时返回 None
+        """
+        with self._lock:
+            if version == self.version:
+                return [], []
+            if version > self.version or not self._changes or self._changes[0][0] > version + 1:
+                return None
+            added, removed = set(), set()
+            for change_version, change_added, change_removed in self._changes:
+                if change_version <= version:
+                    continue
+                for name in change_added:
+                    if name in removed:
+                        removed.discard(name)
+                    else:
+                        added.add(name)
+                for name in change_removed:
+                    if name in added:
+                        added.discard(name)
+                    else:
+                        removed.add(name)
+            return sorted(added), sorted(removed)
+
+    def status(self):
+        with self._lock:
+            return {
+                "file_count": len(self.files),
+                "ttl": self.ttl,
+                "age": round(time.time() - self.fetched_at, 1) if self.fetched_at else None,
+                "refreshing": self._refreshing,
+                "version": self.version,
+                "last_error": self.last_error,
+                "last_diff": self.last_diff,
+                "library": self.index.status() if self.index is not None else None,
+            }
+
+    def _refresh(self):
+        with self._lock:
+            self.last_attempt = time.time()
+        try:
+            entries, message = fetch_nas_entries()
+            # 按名称排序，与从索引加载时的顺序一致
+            files = sorted(entry["name"] for entry in entries)
+            if message == "Success" and self.index is not None:
+                try:
+                    self.last_diff = self.index.apply_scan(entries)
+                    app.logger.info(f"[LIBRARY] 曲库索引已更新: {self.last_diff}")
+                except sqlite3.Error as e:
+                    app.logger.error(f"[LIBRARY] 更新曲库索引失败: {str(e)}")
+            with self._lock:
+                if message == "Success":
+                    if files != self.files:
+                        self._record_change(files)
+                    self.files = files
+                    self.message = message
+                    self.fetched_at = time.time()
+                    self.last_error = None
+                else:
+                    self.last_error = message
+                    # 没有可用旧数据时把错误返回给调用方
+                    if self.fetched_at is None:
+                        self.message = message
+            if message != "Success":
+                app.logger.warning(f"[CATALOG] 刷新NAS文件目录失败，继续使用旧数据: {message}")
+            else:
+                app.logger.info(f"[CATALOG] NAS文件目录已刷新，共 {len(files)} 个文件")
+        except Exception as e:
+            app.logger.error(f"[CATALOG] 刷新NAS文件目录出错: {str(e)}", exc_info=True)
+            with self._lock:
+                self.last_error = str(e)
+        finally:
+            with self._lock:
+                self._refreshing = False
+            self._loaded.set()
+
+
+nas_catalog = NASCatalog(NAS_CATALOG_TTL, library_index)
+
+
+def rclone_list_files():
+    """列出NAS上的音频文件（读取目录缓存，不阻塞在NAS上）"""
+    return nas_catalog.get()
+
+
+SEARCH_MIN_SIMILARITY = 0.5   # 三元组重合比例达到多少视为模糊匹配（容忍拼写错误）
+SEARCH_CACHE_SIZE = 256       # 缓存最近多少个查询的排序结果
+_SEARCH_STRIP_RE = re.compile(r"[\W_]+")
+
+
+def _normalize_search_text(text):
+    """小写并去掉空白、标点和下划线"""
+    return _SEARCH_STRIP_RE.sub("", text.lower())
+
+
+def _trigrams(text):
+    if len(text) < 3:
+        return {text} if text else set()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class SearchIndex:
+    """文件名搜索索引
+
+    目录版本变化后重建一次：
+    - 文件名（去掉扩展名、标点并小写）、拼音全拼和拼音首字母分别生成三元组，建立倒排索引
+    - 文件名中的单个字符和首字母的二元组另建索引，用于1-2个字符的短查询
+    查询时用倒排列表统计每个文件命中的查询三元组数量作为候选和模糊相似度，再结合子串/前缀匹配打分排序。
+    最近的查询结果按目录版本缓存。拼音索引需要安装pypinyin。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._building = False
+        self.version = None
+        self.files = []
+        self.keys = []            # 每个文件的 (文件名, 拼音全拼, 拼音首字母)
+        self.grams = {}           # 三元组 -> 文件序号列表
+        self.chars = {}           # 文件名中的字符 -> 文件序号列表
+        self.initial_pairs = {}   # 首字母二元组 -> 文件序号列表
+        self._cache = OrderedDict()
+        self.build_time = 0
+
+    def ensure_current(self, files, version):
+        """目录版本变化时重建索引：尚无索引时同步构建，否则在后台重建并继续使用旧索引"""
+        if self.version == version:
+            return
+        if self.version is None:
+            self._build(files, version)
+            return
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+        threading.Thread(target=self._build, args=(files, version), daemon=True).start()
+
+    def _build(self, files, version):
+        started = time.time()
+        keys = []
+        grams, chars, initial_pairs = {}, {}, {}
+        try:
+            for file_id, filename in enumerate(files):
+                title = os.path.splitext(filename)[0]
+                name_key = _normalize_search_text(title)
+                if PINYIN_AVAILABLE:
+                    full_key = _normalize_search_text("".join(lazy_pinyin(title)))
+                    initials_key = _normalize_search_text("".join(lazy_pinyin(title, style=Style.FIRST_LETTER)))
+                else:
+                    full_key = initials_key = ""
+                keys.append((name_key, full_key, initials_key))
+
+                for gram in _trigrams(name_key) | _trigrams(full_key) | _trigrams(initials_key):
+                    grams.setdefault(gram, []).append(file_id)
+                for char in set(name_key):
+                    chars.setdefault(char, []).append(file_id)
+                for pair in {initials_key[i:i + 2] for i in range(len(initials_key) - 1)}:
+                    initial_pairs.setdefault(pair, []).append(file_id)
+        finally:
+            with self._lock:
+                self._building = False
+
+        with self._lock:
+            self.files = list(files)
+            self.keys = keys
+            self.grams = grams
+            self.chars = chars
+            self.initial_pairs = initial_pairs
+            self.version = version
+            self._cache.clear()
+            self.build_time = time.time() - started
+        app.logger.info(f"[SEARCH] 搜索索引已重建，{len(files)} 个文件，耗时 {self.build_time:.2f}秒 (拼音: {PINYIN_AVAILABLE})")
+
+    def search(self, query):
+        """返回按相关度排序的文件名列表"""
+        query_key = _normalize_search_text(query)
+        if not query_key:
+            return sorted(self.files)
+
+        with self._lock:
+            cache_key = (self.version, query_key)
+            if cache_key in self._cache:
+                self._cache.move_to_end(cache_key)
+                return self._cache[cache_key]
+            files, keys = self.files, self.keys
+            candidates = self._candidates(query_key)
+
+        scored = []
+        for file_id, overlap in candidates.items():
+            score = self._score(query_key, overlap, keys[file_id])
+            if score > 0:
+                scored.append((-score, files[file_id]))
+        scored.sort()
+        results = [filename for _, filename in scored]
+
+        with self._lock:
+            self._cache[cache_key] = results
+            if len(self._cache) > SEARCH_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return results
+
+    def _candidates(self, query_key):
+        """返回 {文件序号: 命中的查询三元组比例}"""
+        if len(query_key) < 3:
+            # 短查询：文件名中同时包含这些字符，或首字母包含该二元组
+            postings = [self.chars.get(char, []) for char in set(query_key)]
+            postings.sort(key=len)
+            candidates = set(postings[0])
+            for posting in postings[1:]:
+                candidates.intersection_update(posting)
+            if len(query_key) == 2:
+                candidates.update(self.initial_pairs.get(query_key, []))
+            return dict.fromkeys(candidates, 0.0)
+
+        # Counter.update在C层逐个计数，比逐个候选计算三元组集合快得多
+        query_grams = _trigrams(query_key)
+        counts = Counter()
+        for gram in query_grams:
+            posting = self.grams.get(gram)
+            if posting:
+                counts.update(posting)
+        need = len(query_grams) * SEARCH_MIN_SIMILARITY
+        return {file_id: hits / len(query_grams) for file_id, hits in counts.items() if hits >= need}
+
+    @staticmethod
+    def _score(query_key, overlap, keys):
+        """子串命中优先（文件名 > 拼音全拼 > 首字母，前缀额外加分），否则按三元组重合比例打分"""
+        for weight, key in zip((3, 2, 1), keys):
+            if key and query_key in key:
+                return 1000 + weight * 10 + (100 if key.startswith(query_key) else 0) - min(len(key), 99) / 100
+        return overlap * 500
+
+    def status(self):
+        with self._lock:
+            return {
+                "version": self.version,
+                "file_count": len(self.files),
+                "trigrams": len(self.grams),
+                "pinyin": PINYIN_AVAILABLE,
+                "building": self._building,
+                "build_time": round(self.build_time, 3),
+                "cached_queries": len(self._cache),
+            }
+
+
+search_index = SearchIndex()
+
+
+class PlaybackOrder:
+    """播放顺序：有序文件列表加上 文件名->位置 的字典，上一首/下一首查找为O(1)"""
+
+    def __init__(self, files, version=None):
+        self.files = files
+        self.version = version
+        self.positions = {name: position for position, name in enumerate(files)}
+
+    def __len__(self):
+        return len(self.files)
+
+    def __contains__(self, name):
+        return name in self.positions
+
+    def neighbor(self, name, step=1):
+        """返回相对name偏移step的文件（循环），name不在列表中时返回None"""
+        position = self.positions.get(name)
+        if position is None or not self.files:
+            return None
+        return self.files[(position + step) % len(self.files)]
+
+
+_playback_order = PlaybackOrder([])
+_playback_order_lock = threading.Lock()
+
+
+def get_playback_order(blocking=True):
+    """获取当前目录对应的播放顺序，只在目录版本变化时重建；NAS目录不可用时按本地缓存文件构建
+
+    下一首、上一首、预加载、自动缓存和状态接口共用同一个结构，保证顺序一致。
+    blocking为False时（状态轮询）目录尚未加载也不等待，直接返回上次的结果。
+    """
+    global _playback_order
+    if not blocking and not nas_catalog.loaded:
+        return _playback_order
+    files, _ = rclone_list_files()
+    if not files:
+        return PlaybackOrder(get_audio_files())
+    version = nas_catalog.version
+    with _playback_order_lock:
+        rebuilt = _playback_order.version != version
+        if rebuilt:
+            _playback_order = PlaybackOrder(files, version)
+        order = _playback_order
+    if rebuilt:
+        # 播放顺序变化后旧的预缓存窗口可能已不是接下来要播放的文件
+        prefetch_scheduler.order_changed(version)
+    return order
+
+RCLONE_STATS_INTERVAL = "500ms"      # rclone输出传输统计的间隔
+DOWNLOAD_PROGRESS_RETENTION = 600    # 下载完成或失败后进度记录保留的时间（秒）
+
+PARTIAL_SUFFIX = ".part"  # 下载中的临时文件后缀，下载完成并校验大小后才重命名为正式文件名
+
+_copy_file_locks = {}  # 本地路径 -> 锁，同一文件同时只有一个下载写入临时文件
+_copy_file_locks_guard = threading.Lock()
+
+
+def get_remote_file_size(remote_path):
+    """通过rclone size获取NAS上文件的大小，失败时返回None"""
+    try:
+        result = subprocess.run(
+            ['rclone', 'size', f"{RCLONE_REMOTE}/{remote_path}", '--json'],
+            capture_output=True,
+            text=True,
+            timeout=10
+        )
+        if result.returncode == 0:
+            return json.loads(result.stdout).get('bytes')
+        app.logger.warning(f"[RCLONE] 获取文件大小失败: {remote_path}, {result.stderr.strip()}")
+    except (OSError, subprocess.SubprocessError, ValueError) as e:
+        app.logger.warning(f"[RCLONE] 获取文件大小失败: {remote_path}, {str(e)}")
+    return None
+
+
+def _update_download_progress(task_id, **fields):
+    if not task_id:
+        return
+    if fields.get('status') in ('completed', 'error'):
+        fields['finished_at'] = time.time()
+    with download_lock:
+        if task_id not in download_progress:
+            return
+        download_progress[task_id].update(fields)
+        progress = dict(download_progress[task_id], task_id=task_id)
+    event_bus.publish("download", progress)
+
+
+def prune_download_progress():
+    """删除完成或失败超过保留时间的下载进度记录"""
+    cutoff = time.time() - DOWNLOAD_PROGRESS_RETENTION
+    with download_lock:
+        expired = [
+            task_id for task_id, info in download_progress.items()
+            if info.get('finished_at') is not None and info['finished_at'] < cutoff
+        ]
+        for task_id in expired:
+            del download_progress[task_id]
+    return len(expired)
+
+
+def rclone_copy_file(remote_path, local_path, task_id=None):
+    """从NAS复制单个文件到本地，支持进度跟踪
+
+    先写入 <本地路径>.part，下载完成且大小与NAS上一致后再原子重命名为正式文件，
+    因此缓存目录中的正式文件总是完整的。中断后留下的.part文件会在下次下载时从已有字节处续传。
+    """
+    app.logger.info(f"[RCLONE] 开始复制文件: 远程={remote_path} -> 本地={local_path}, 任务ID={task_id}")
+    
+    with _copy_file_locks_guard:
+        file_lock = _copy_file_locks.setdefault(local_path, threading.Lock())
+    
+    with file_lock:
+        # 检查本地文件是否已存在（也可能是等待锁期间被另一个下载完成）
+        if os.path.exists(local_path):
+            app.logger.info(f"[RCLONE] 文件已存在于本地: {local_path}，跳过复制")
+            cache_index.add(os.path.basename(local_path))
+            _update_download_progress(
+                task_id, status='completed', current_size=os.path.getsize(local_path)
+            )
+            return True, "File already exists locally"
+        return _copy_file_to_partial(remote_path, local_path, task_id)
+
+
+def _copy_file_to_partial(remote_path, local_path, task_id):
+    partial_path = local_path + PARTIAL_SUFFIX
+    try:
+        remote_file = f"{RCLONE_REMOTE}/{remote_path}"
+        app.logger.debug(f"[RCLONE] 构建远程文件路径: {remote_file}")
+        
+        # 远程文件大小用于进度显示、续传判断和完成后的校验；优先用曲库索引中lsjson得到的大小，省去一次rclone size
+        total_size = library_index.get_size(remote_path) if library_index is not None else None
+        size_from_index = total_size is not None
+        if total_size is None:
+            total_size = get_remote_file_size(remote_path)
+        app.logger.debug(f"[RCLONE] 获取到文件大小: {total_size} 字节")
+        
+        # 确保本地目录存在
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        app.logger.debug(f"[RCLONE] 确保本地目录存在: {os.path.dirname(local_path)}")
+        
+        # 已有的临时文件从其末尾续传；不知道远程大小或临时文件比远程文件还大时无法确认可续传，重新下载
+        offset = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+        if offset and (total_size is None or offset > total_size):
+            app.logger.warning(f"[RCLONE] 临时文件无法续传，重新下载: {partial_path} ({offset} 字节)")
+            offset = 0
+        elif offset:
+            app.logger.info(f"[RCLONE] 从 {offset}/{total_size} 字节处续传: {remote_path}")
+        
+        if task_id:
+            with download_lock:
+                # 下载管理器可能已为该任务创建了共享的进度记录，原地更新
+                download_progress.setdefault(task_id, {}).update({
+                    'filename': remote_path,
+                    'total_size': total_size or 0,
+                    'current_size': offset,
+                    'resumed_from': offset,
+                    'speed': 0,
+                    'eta': None,
+                    'status': 'downloading',
+                    'error': None,
+                    'start_time': time.time()
+                })
+        
+        # rclone cat 支持 --offset，临时文件以追加方式写入即可续传；
+        # 传输统计以JSON日志写到stderr，进度、速度、剩余时间都从中读取
+        cmd_args = ['rclone', 'cat', remote_file, '--use-json-log',
+                    '--stats', RCLONE_STATS_INTERVAL, '--stats-log-level', 'NOTICE']
+        if offset:
+            cmd_args += ['--offset', str(offset)]
+        app.logger.debug(f"[RCLONE] 执行命令: {' '.join(cmd_args)}")
+        
+        start_time = time.time()
+        error_lines = []
+        with open(partial_path, 'ab' if offset else 'wb') as partial_file:
+            process = subprocess.Popen(cmd_args, stdout=partial_file, stderr=subprocess.PIPE)
+            for raw_line in process.stderr:
+                line = raw_line.decode('utf-8', errors='replace').strip()
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    entry = {"msg": line}
+                stats = entry.get("stats") if isinstance(entry, dict) else None
+                if stats:
+                    _update_download_progress(
+                        task_id,
+                        current_size=offset + stats.get('bytes', 0),
+                        speed=stats.get('speed', 0),
+                        eta=stats.get('eta')
+                    )
+                elif line:
+                    error_lines.append(entry.get("msg", line) if isinstance(entry, dict) else line)
+            returncode = process.wait()
+        execution_time = time.time() - start_time
+        stderr = "\n".join(error_lines)
+        
+        app.logger.debug(f"[RCLONE] 命令执行完成，返回码: {returncode}，执行时间: {execution_time:.2f}秒")
+        
+        if stderr:
+            app.logger.warning(f"[RCLONE] 命令有错误输出: {stderr}")
+        
+        if returncode != 0:
+            # 保留临时文件，下次从已下载的部分续传
+            error_msg = stderr or f"Command failed with exit code {returncode}"
+            app.logger.error(f"[RCLONE] 文件复制失败: {remote_path}, 错误: {error_msg}")
+            _update_download_progress(task_id, status='error', error=error_msg)
+            return False, error_msg
+        
+        file_size = os.path.getsize(partial_path)
+        if total_size is not None and file_size != total_size and size_from_index:
+            # 曲库索引中的大小可能已过期（远程文件被替换），以NAS上的实际大小为准
+            total_size = get_remote_file_size(remote_path)
+        if total_size is not None and file_size != total_size:
+            error_msg = f"Size mismatch: expected {total_size} bytes, got {file_size}"
+            app.logger.error(f"[RCLONE] 文件大小校验失败: {remote_path}, {error_msg}")
+            if file_size > total_size:
+                # 内容已不可信（远程文件可能已变化），删除后下次重新下载
+                os.remove(partial_path)
+            _update_download_progress(task_id, status='error', error=error_msg)
+            return False, error_msg
+        
+        os.replace(partial_path, local_path)
+        cache_index.add(os.path.basename(local_path))
+        app.logger.info(f"[RCLONE] 文件复制成功: {remote_path} -> {local_path}, 文件大小: {file_size} 字节")
+        _update_download_progress(
+            task_id, status='completed', current_size=file_size, total_size=file_size, eta=0
+        )
+        
+        # 同步曲库缓存状态，并在后台探测新文件的元数据（需要纯音频化的文件处理完再探测）
+        if library_index is not None:
+            library_index.set_cached(remote_path, True)
+        if audio_extractor.schedule(os.path.basename(local_path)) is None:
+            media_metadata.schedule(local_path)
+        cache_manager.enforce_async()
+        return True, f"File copied successfully"
+            
+    except Exception as e:
+        app.logger.error(f"[RCLONE] 复制文件时发生未预期错误: {remote_path}, 错误: {str(e)}", exc_info=True)
+        _update_download_progress(task_id, status='error', error=str(e))
+        return False, f"Unexpected error: {str(e)}"
+
+
+DOWNLOAD_WORKERS = int(os.environ.get('DOWNLOAD_WORKERS', 2))  # 同时进行的NAS下载数上限
+
+# 下载优先级，数值越小越优先
+DOWNLOAD_PRIORITY_PLAYBACK = 0  # 用户发起的播放（切歌、点播、边下边播）
+DOWNLOAD_PRIORITY_PREFETCH = 1  # 预加载、前瞻预缓存、手动缓存单个文件
+DOWNLOAD_PRIORITY_BULK = 2      # 构建播放列表等批量缓存
+
+
+class DownloadManager:
+    """NAS文件下载的统一入口
+
+    - 同一文件的并发请求合并为一次下载，所有调用方等待同一个结果
+    - 固定数量的下载线程按优先级从队列取任务；排队中的任务被更高优先级的请求合并时提升优先级
+    - 下载线程多于一个时保留一个只给播放请求使用，后台缓存再多也不会让切歌排队
+    """
+
+    def __init__(self, workers):
+        self.workers = max(1, workers)
+        self._background_slots = max(1, self.workers - 1)
+        self._condition = threading.Condition()
+        self._queue = []          # 堆: (优先级, 序号, 任务)
+        self._jobs = {}           # 文件名 -> 排队中或下载中的任务
+        self._sequence = 0
+        self._threads = []
+        self._active = 0
+        self._active_background = 0
+        self.stats = {"requests": 0, "joined": 0, "promoted": 0, "completed": 0, "failed": 0}
+
+    def fetch(self, filename, priority=DOWNLOAD_PRIORITY_PLAYBACK, task_id=None):
+        """下载文件到缓存目录并等待完成
+
+        Returns:
+            tuple: (是否成功, 消息)
+        """
+        with self._condition:
+            self.stats["requests"] += 1
+            job = self._jobs.get(filename)
+            if job is None:
+                job = {
+                    "filename": filename,
+                    "priority": priority,
+                    "started": False,
+                    "done": threading.Event(),
+                    "result": None,
+                    "task_ids": [],
+                    # 同一文件的所有任务ID共用同一个进度记录
+                    "progress": {
+                        'filename': filename,
+                        'total_size': 0,
+                        'current_size': 0,
+                        'speed': 0,
+                        'eta': None,
+                        'status': 'queued',
+                        'error': None,
+                        'start_time': time.time()
+                    },
+                }
+                self._jobs[filename] = job
+                self._push(job)
+                # 下载始终按任务自己的进度键更新进度记录，之后合并进来的任务ID（包括下载开始后才加入的）
+                # 都指向同一个记录，因此都能看到实时进度
+                job["progress_key"] = f"download-{self._sequence}"
+                with download_lock:
+                    download_progress[job["progress_key"]] = job["progress"]
+                self._ensure_workers()
+            else:
+                self.stats["joined"] += 1
+                app.logger.info(f"[DOWNLOAD] 合并到已有的下载任务: {filename}")
+                if priority < job["priority"] and not job["started"]:
+                    job["priority"] = priority
+                    self.stats["promoted"] += 1
+                    self._push(job)
+            if task_id:
+                prune_download_progress()
+                job["task_ids"].append(task_id)
+                with download_lock:
+                    download_progress[task_id] = job["progress"]
+            self._condition.notify_all()
+
+        job["done"].wait()
+        return job["result"]
+
+    def status(self):
+        with self._condition:
+            queued, seen = [], set()
+            for priority, _, job in sorted(self._queue, key=lambda item: item[:2]):
+                if job["started"] or priority != job["priority"] or job["filename"] in seen:
+                    continue
+                seen.add(job["filename"])
+                queued.append({"filename": job["filename"], "priority": priority})
+            return {
+                "workers": self.workers,
+                "active": self._active,
+                "active_background": self._active_background,
+                "queued": queued,
+                **self.stats
+            }
+
+    def _push(self, job):
+        # 提升优先级时重复入队，旧的条目出队时按优先级不一致丢弃
+        self._sequence += 1
+        heapq.heappush(self._queue, (job["priority"], self._sequence, job))
+
+    def _ensure_workers(self):
+        if len(self._threads) < self.workers:
+            for _ in range(self.workers - len(self._threads)):
+                thread = threading.Thread(target=self._worker, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _next_job(self):
+        """取出下一个可执行的任务（调用方持有锁），没有时返回None"""
+        while self._queue:
+            priority, _, job = self._queue[0]
+            if job["started"] or priority != job["priority"]:
+                heapq.heappop(self._queue)
+                continue
+            if priority > DOWNLOAD_PRIORITY_PLAYBACK and self._active_background >= self._background_slots:
+                return None
+            heapq.heappop(self._queue)
+            return job
+        return None
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                job = self._next_job()
+                while job is None:
+                    self._condition.wait()
+                    job = self._next_job()
+                job["started"] = True
+                background = job["priority"] > DOWNLOAD_PRIORITY_PLAYBACK
+                self._active += 1
+                if background:
+                    self._active_background += 1
+
+            filename = job["filename"]
+            try:
+                result = rclone_copy_file(filename, os.path.join(LOCAL_DIR, filename), job["progress_key"])
+            except Exception as e:
+                app.logger.error(f"[DOWNLOAD] 下载任务异常: {filename}, {str(e)}", exc_info=True)
+                result = (False, str(e))
+
+            with download_lock:
+                if result[0]:
+                    job["progress"].update(status='completed', finished_at=time.time())
+                else:
+                    job["progress"].update(status='error', error=result[1], finished_at=time.time())
+            with self._condition:
+                self._active -= 1
+                if background:
+                    self._active_background -= 1
+                self.stats["completed" if result[0] else "failed"] += 1
+                del self._jobs[filename]
+                job["result"] = result
+                job["done"].set()
+                self._condition.notify_all()
+
+
+download_manager = DownloadManager(DOWNLOAD_WORKERS)
+
+
+CACHE_QUOTA_MB = int(os.environ.get('CACHE_QUOTA_MB', 2048))        # 缓存目录最大占用
+CACHE_MIN_FREE_MB = int(os.environ.get('CACHE_MIN_FREE_MB', 500))     # 磁盘至少保留的剩余空间
+CACHE_EVICTION_POLICY = os.environ.get('CACHE_EVICTION_POLICY', 'lru').lower()  # lru 或 lfu
+CACHE_PROTECT_RECENT_SECONDS = 120  # 最近写入的文件（可能仍在下载或即将播放）不淘汰
+
+
+class CacheManager:
+    """本地缓存目录的容量管理
+
+    超出容量配额或磁盘剩余空间低于水位线时按策略淘汰文件：
+    - lru: 最久未访问的先淘汰
+    - lfu: 访问次数最少的先淘汰，次数相同时按最久未访问
+    访问记录（播放时的命中/未命中）保存在曲库数据库中。当前播放、预加载、下一首以及正在下载的文件不会被淘汰。
+    """
+
+    POLICIES = {
+        "lru": lambda usage: (usage["last_access"],),
+        "lfu": lambda usage: (usage["hits"], usage["last_access"]),
+    }
+
+    def __init__(self, cache_dir, db_path, quota_bytes, min_free_bytes, policy):
+        self.cache_dir = cache_dir
+        self.quota_bytes = quota_bytes
+        self.min_free_bytes = min_free_bytes
+        self.policy = policy if policy in self.POLICIES else "lru"
+        self._lock = threading.Lock()
+        self._usage = {}  # 文件名 -> {"hits", "last_access"}
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "evicted_bytes": 0}
+        self._conn = None
+        try:
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            with self._conn:
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS cache_usage (name TEXT PRIMARY KEY, hits INTEGER, last_access REAL)"
+                )
+            for name, hits, last_access in self._conn.execute("SELECT name, hits, last_access FROM cache_usage"):
+                self._usage[name] = {"hits": hits, "last_access": last_access}
+        except sqlite3.Error as e:
+            app.logger.error(f"[CACHE] 打开访问记录失败，仅在内存中记录: {str(e)}")
+            self._conn = None
+
+    def record_access(self, name, hit):
+        """记录一次播放时的缓存访问"""
+        now = time.time()
+        with self._lock:
+            self.stats["hits" if hit else "misses"] += 1
+            usage = self._usage.setdefault(name, {"hits": 0, "last_access": now})
+            usage["hits"] += 1
+            usage["last_access"] = now
+            if self._conn is not None:
+                with self._conn:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO cache_usage (name, hits, last_access) VALUES (?, ?, ?)",
+                        (name, usage["hits"], usage["last_access"])
+                    )
+
+    def protected_files(self):
+        """不允许淘汰的文件名"""
+        protected = set()
+        with state_lock:
+            protected.add(self_recorded_state["current_file"])
+        protected.add(current_playing_file)
+        protected.add(gapless_preloader.preloaded_file)
+        protected.update(prefetch_scheduler.window_files)
+        current = self_recorded_state["current_file"] or current_playing_file
+        if current:
+            protected.add(get_playback_order(blocking=False).neighbor(current, 1))
+        with download_lock:
+            protected.update(
+                os.path.basename(item.get('filename') or "")
+                for item in download_progress.values() if item.get('status') == 'downloading'
+            )
+        protected.discard(None)
+        protected.discard("")
+        return protected
+
+    def enforce(self):
+        """检查容量和剩余空间，必要时淘汰文件
+
+        Returns:
+            tuple: (淘汰的文件数, 释放的字节数)
+        """
+        if not os.path.isdir(self.cache_dir):
+            return 0, 0
+        with self._lock:
+            entries, total = cache_index.snapshot()
+            free = shutil.disk_usage(self.cache_dir).free
+            need = max(total - self.quota_bytes, self.min_free_bytes - free, 0)
+            if need <= 0:
+                return 0, 0
+
+            protected = self.protected_files()
+            now = time.time()
+            candidates = []
+            for name, (size, mtime) in entries.items():
+                if name in protected or now - mtime < CACHE_PROTECT_RECENT_SECONDS:
+                    continue
+                # 没有访问记录的文件按修改时间当作最后访问时间
+                usage = self._usage.get(name, {"hits": 0, "last_access": mtime})
+                candidates.append((self.POLICIES[self.policy](usage), name, os.path.join(self.cache_dir, name), size))
+            candidates.sort()
+
+            evicted, freed = 0, 0
+            for _, name, path, size in candidates:
+                if freed >= need:
+                    break
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    app.logger.warning(f"[CACHE] 淘汰文件失败: {name}, {e}")
+                    continue
+                cache_index.discard(name)
+                evicted += 1
+                freed += size
+                if library_index is not None:
+                    library_index.set_cached(name, False)
+                app.logger.info(f"[CACHE] 已淘汰缓存文件 ({self.policy}): {name}, {round(size / (1024 * 1024), 2)} MB")
+
+            self.stats["evictions"] += evicted
+            self.stats["evicted_bytes"] += freed
+            if freed < need:
+                app.logger.warning(f"[CACHE] 可淘汰的文件不足，仍需释放 {round((need - freed) / (1024 * 1024), 2)} MB")
+            return evicted, freed
+
+    def enforce_async(self):
+        threading.Thread(target=self.enforce, daemon=True).start()
+
+    def status(self):
+        with self._lock:
+            stats = dict(self.stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else None
+        stats.update({
+            "policy": self.policy,
+            "quota_mb": round(self.quota_bytes / (1024 * 1024), 2),
+            "min_free_mb": round(self.min_free_bytes / (1024 * 1024), 2),
+        })
+        return stats
+
+
+cache_manager = CacheManager(
+    LOCAL_DIR, LIBRARY_DB_PATH, CACHE_QUOTA_MB * 1024 * 1024, CACHE_MIN_FREE_MB * 1024 * 1024, CACHE_EVICTION_POLICY
+)
+
+
+AUDIO_EXTRACT_MODE = os.environ.get('AUDIO_EXTRACT_MODE', 'off').lower()  # off、remux（只抽出音频流）或 opus（转码）
+AUDIO_EXTRACT_BITRATE = os.environ.get('AUDIO_EXTRACT_BITRATE', '96k')      # opus模式的目标码率
+AUDIO_EXTRACT_WORKERS = 1        # 同时运行的ffmpeg进程数
+AUDIO_EXTRACT_TIMEOUT = 600      # 单个文件处理超时（秒）
+AUDIO_EXTRACT_CONTAINERS = {'.mp4': 'mp4', '.webm': 'webm'}  # 扩展名 -> 输出封装格式（文件名保持不变）
+
+
+class AudioExtractor:
+    """缓存目录中视频文件的纯音频化
+
+    mpv以 --no-video 运行，缓存完整的视频文件只会浪费空间和解码CPU。文件进入缓存目录后在有界的后台池中
+    （nice降低优先级）用ffmpeg去掉视频流：remux模式直接复制音频流，opus模式转码为Opus。
+    输出保持原文件名和封装格式，写入临时文件后原子替换原文件；正在被mpv播放或预加载的文件推迟到切歌后处理。
+    处理结果（含节省的字节数）记录在曲库数据库中，同一文件不会重复处理。
+    """
+
+    def __init__(self, db_path, mode, bitrate, workers):
+        self.mode = mode if mode in ('remux', 'opus') else 'off'
+        self.bitrate = bitrate
+        self._lock = threading.Lock()
+        self._records = {}   # 文件名 -> {"status", "original_size", "new_size"}
+        self._pending = {}   # 文件名 -> Future
+        self._deferred = set()
+        self._executor = None
+        self._conn = None
+        if self.mode == 'off':
+            return
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="extract")
+        try:
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            with self._conn:
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS audio_extract ("
+                    "name TEXT PRIMARY KEY, status TEXT, mode TEXT, original_size INTEGER, new_size INTEGER, "
+                    "processed_at REAL)"
+                )
+            for name, status, original_size, new_size in self._conn.execute(
+                    "SELECT name, status, original_size, new_size FROM audio_extract"):
+                self._records[name] = {"status": status, "original_size": original_size, "new_size": new_size}
+        except sqlite3.Error as e:
+            app.logger.error(f"[EXTRACT] 打开处理记录失败: {str(e)}")
+            self._conn = None
+
+    @property
+    def enabled(self):
+        return self.mode != 'off'
+
+    def schedule(self, name):
+        """文件进入缓存目录后调用，需要处理时提交到后台池
+
+        Returns:
+            Future 或 None（不需要处理或已在处理）
+        """
+        if not self.enabled or os.path.splitext(name)[1].lower() not in AUDIO_EXTRACT_CONTAINERS:
+            return None
+        entry = cache_index.get(name)
+        if entry is None or self._already_processed(name, entry[0]):
+            return None
+        with self._lock:
+            if name in self._pending:
+                return None
+            self._deferred.discard(name)
+            future = self._executor.submit(self._process, name)
+            self._pending[name] = future
+        return future
+
+    def retry_deferred(self):
+        """切歌后重新提交之前因正在播放而推迟的文件"""
+        with self._lock:
+            deferred, self._deferred = self._deferred, set()
+        for name in deferred:
+            self.schedule(name)
+
+    def scan(self):
+        """为缓存目录中尚未处理的视频文件安排处理"""
+        if not self.enabled:
+            return 0
+        self._remove_stale_temp_files()
+        submitted = sum(1 for name in cache_index.names() if self.schedule(name) is not None)
+        if submitted:
+            app.logger.info(f"[EXTRACT] 已安排 {submitted} 个视频文件的纯音频化")
+        return submitted
+
+    def _remove_stale_temp_files(self):
+        """删除上次运行中断（崩溃、超时被杀）遗留的临时输出文件
+
+        这些文件以 .part 结尾，不在缓存索引中，也不受缓存淘汰管理，不清理会一直占用空间。
+        """
+        suffix = '.extract' + PARTIAL_SUFFIX
+        try:
+            entries = list(os.scandir(LOCAL_DIR))
+        except OSError as e:
+            app.logger.error(f"[EXTRACT] 扫描临时文件失败: {str(e)}")
+            return
+        for entry in entries:
+            if not entry.name.endswith(suffix):
+                continue
+            with self._lock:
+                if entry.name[:-len(suffix)] in self._pending:
+                    continue
+            try:
+                os.remove(entry.path)
+                app.logger.info(f"[EXTRACT] 已删除遗留临时文件: {entry.name}")
+            except OSError as e:
+                app.logger.warning(f"[EXTRACT] 删除遗留临时文件失败 {entry.name}: {str(e)}")
+
+    def status(self):
+        with self._lock:
+            counts = Counter(record["status"] for record in self._records.values())
+            saved = sum(
+                record["original_size"] - record["new_size"]
+                for record in self._records.values() if record["status"] == 'done'
+            )
+            return {
+                "mode": self.mode,
+                "bitrate": self.bitrate if self.mode == 'opus' else None,
+                "pending": len(self._pending),
+                "deferred": len(self._deferred),
+                "processed": dict(counts),
+                "bytes_saved": saved,
+                "saved_mb": round(saved / (1024 * 1024), 2),
+            }
+
+    def _already_processed(self, name, size):
+        with self._lock:
+            record = self._records.get(name)
+        if record is None:
+            return False
+        # 处理成功的记录对应处理后的大小；其他结果对应原文件大小（文件被淘汰后重新下载时需要重新处理）
+        return size == (record["new_size"] if record["status"] == 'done' else record["original_size"])
+
+    def _in_use(self, name):
+        """mpv正在播放或已预加载的文件"""
+        with state_lock:
+            current = self_recorded_state["current_file"]
+        return name in (current, current_playing_file, gapless_preloader.preloaded_file)
+
+    def _has_video(self, path):
+        result = subprocess.run(
+            ['ffprobe', '-v', 'error', '-select_streams', 'v', '-show_entries', 'stream=index', '-of', 'csv=p=0', path],
+            capture_output=True, text=True, timeout=METADATA_PROBE_TIMEOUT
+        )
+        return result.returncode == 0 and bool(result.stdout.strip())
+
+    def _record(self, name, status, original_size, new_size):
+        record = {"status": status, "original_size": original_size, "new_size": new_size}
+        with self._lock:
+            self._records[name] = record
+            if self._conn is not None:
+                with self._conn:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO audio_extract "
+                        "(name, status, mode, original_size, new_size, processed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                        (name, status, self.mode, original_size, new_size, time.time())
+                    )
+
+    def _process(self, name):
+        path = os.path.join(LOCAL_DIR, name)
+        temp_path = path + '.extract' + PARTIAL_SUFFIX
+        try:
+            if self._in_use(name):
+                with self._lock:
+                    self._deferred.add(name)
+                return None
+            original_size = os.path.getsize(path)
+            if not self._has_video(path):
+                self._record(name, 'no_video', original_size, original_size)
+                return None
+
+            if self.mode == 'opus':
+                codec_args = ['-c:a', 'libopus', '-b:a', self.bitrate]
+            else:
+                codec_args = ['-c:a', 'copy']
+            container = AUDIO_EXTRACT_CONTAINERS[os.path.splitext(name)[1].lower()]
+            cmd = ['ffmpeg', '-nostdin', '-v', 'error', '-y', '-i', path, '-map', '0:a:0', '-vn', *codec_args]
+            if container == 'mp4':
+                cmd += ['-movflags', '+faststart']
+            cmd += ['-f', container, temp_path]
+            if shutil.which('nice'):
+                cmd = ['nice', '-n', '10'] + cmd
+
+            started = time.time()
+            result = subprocess.run(cmd, capture_output=True, text=True, timeout=AUDIO_EXTRACT_TIMEOUT)
+            if result.returncode != 0 or not os.path.exists(temp_path):
+                app.logger.warning(f"[EXTRACT] ffmpeg处理失败，保留原文件: {name}, {result.stderr.strip()[-300:]}")
+                self._record(name, 'failed', original_size, original_size)
+                return None
+
+            new_size = os.path.getsize(temp_path)
+            if new_size >= original_size:
+                self._record(name, 'no_gain', original_size, original_size)
+                return None
+            # 处理期间文件可能已被淘汰或重新下载，或者开始播放
+            if self._in_use(name) or not os.path.exists(path) or os.path.getsize(path) != original_size:
+                with self._lock:
+                    self._deferred.add(name)
+                return None
+
+            os.replace(temp_path, path)
+            cache_index.add(name)
+            media_metadata.schedule(path)
+            self._record(name, 'done', original_size, new_size)
+            app.logger.info(f"[EXTRACT] 已纯音频化 ({self.mode}): {name}, "
+                            f"{round(original_size / (1024 * 1024), 2)} MB -> {round(new_size / (1024 * 1024), 2)} MB, "
+                            f"耗时 {time.time() - started:.1f}秒")
+            return new_size
+        except OSError as e:
+            operation_logger.debug(f"[EXTRACT] 文件不可读: {name}, {e}")
+            return None
+        except subprocess.TimeoutExpired:
+            app.logger.warning(f"[EXTRACT] 处理超时，保留原文件: {name}")
+            return None
+        except Exception as e:
+            app.logger.error(f"[EXTRACT] 纯音频化出错: {name}, {str(e)}", exc_info=True)
+            return None
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            with self._lock:
+                self._pending.pop(name, None)
+
+
+audio_extractor = AudioExtractor(LIBRARY_DB_PATH, AUDIO_EXTRACT_MODE, AUDIO_EXTRACT_BITRATE, AUDIO_EXTRACT_WORKERS)
+
+
+PREFETCH_WINDOW = int(os.environ.get('PREFETCH_WINDOW', 3))  # 预先缓存接下来多少首，0为关闭
+
+
+class PrefetchScheduler:
+    """前瞻预缓存调度
+
+    曲目变化时立即按共享的播放顺序计算接下来PREFETCH_WINDOW首，依次下载尚未缓存的文件：
+    - 有前台下载（切歌时当前曲目还在拉取）时暂停，等前台下载完成再继续
+    - 曲目或播放顺序变化后，旧窗口中排队的预缓存立即作废，按新窗口重新开始（已在下载的单个文件会下载完）
+    窗口内的文件不会被缓存容量管理淘汰。
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self._condition = threading.Condition()
+        self._thread = None
+        self._generation = 0      # 每次曲目变化递增，用于作废旧窗口
+        self._current_file = None
+        self._order_version = None  # 当前窗口基于的播放顺序版本
+        self._foreground = 0      # 正在进行的前台下载数
+        self.window_files = []    # 当前窗口内的文件
+        self.stats = {"prefetched": 0, "already_cached": 0, "failed": 0, "cancelled": 0}
+
+    def notify(self, current_file, force=False):
+        """曲目变化时调用（立即返回）；force为True时即使曲目未变也重新检查窗口"""
+        if self.window <= 0 or not current_file:
+            return
+        with self._condition:
+            if current_file == self._current_file and not force:
+                return
+            self._current_file = current_file
+            self._generation += 1
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._worker, daemon=True)
+                self._thread.start()
+            self._condition.notify_all()
+
+    def order_changed(self, version):
+        """播放顺序重建后调用：窗口基于旧版本时按当前曲目重新计算"""
+        with self._condition:
+            current_file = self._current_file
+            stale = current_file is not None and self._order_version != version
+        if stale:
+            app.logger.info(f"[PREFETCH] 播放顺序已变化，重新计算预缓存窗口")
+            self.notify(current_file, force=True)
+
+    def foreground_started(self):
+        with self._condition:
+            self._foreground += 1
+
+    def foreground_finished(self):
+        with self._condition:
+            self._foreground -= 1
+            self._condition.notify_all()
+
+    def status(self):
+        with self._condition:
+            return {
+                "window": self.window,
+                "current_file": self._current_file,
+                "window_files": list(self.window_files),
+                "foreground_downloads": self._foreground,
+                **self.stats
+            }
+
+    def _wait_for_turn(self, generation):
+        """等待前台下载完成；窗口作废时返回False"""
+        with self._condition:
+            while self._foreground > 0 and generation == self._generation:
+                self._condition.wait()
+            return generation == self._generation
+
+    def _worker(self):
+        processed_generation = 0
+        while True:
+            with self._condition:
+                while self._generation == processed_generation:
+                    self._condition.wait()
+                generation, current_file = self._generation, self._current_file
+
+            processed_generation = generation
             try:
-                start_time = time.time()
-                # 不使用shell=True，直接传递参数列表
-                result = subprocess.run(cmd_args, capture_output=True, text=True)
-                execution_time = time.time() - start_time
-                
-                app.logger.debug(f"[RCLONE] 命令执行完成，返回码: {result.returncode}，执行时间: {execution_time:.2f}秒")
-                
-                if result.stderr.strip():
-                    app.logger.warning(f"[RCLONE] 命令有错误输出: {result.stderr.strip()}")
-                
-                if result.returncode == 0:
-                    # 验证文件是否真的被复制成功
-                    if os.path.exists(local_path):
-                        file_size = os.path.getsize(local_path)
-                        app.logger.info(f"[RCLONE] 文件复制成功: {remote_path} -> {local_path}, 文件大小: {file_size} 字节")
-                        
-                        if task_id:
-                            with download_lock:
-                                if task_id in download_progress:
-                                    download_progress[task_id]['status'] = 'completed'
-                                    download_progress[task_id]['current_size'] = file_size
-                                    download_progress[task_id]['total_size'] = file_size
+                order = get_playback_order()
+                window = []
+                for step in range(1, self.window + 1):
+                    name = order.neighbor(current_file, step)
+                    if name is None or name == current_file or name in window:
+                        break
+                    window.append(name)
+                with self._condition:
+                    self.window_files = window
+                    self._order_version = order.version
+
+                for name in window:
+                    if cache_index.contains(name):
+                        self.stats["already_cached"] += 1
+                        continue
+                    if not self._wait_for_turn(generation):
+                        self.stats["cancelled"] += 1
+                        app.logger.info(f"[PREFETCH] 曲目已变化，取消旧窗口的预缓存")
+                        break
+                    app.logger.info(f"[PREFETCH] 预缓存: {name}")
+                    success, message = download_manager.fetch(name, DOWNLOAD_PRIORITY_PREFETCH)
+                    if success:
+                        self.stats["prefetched"] += 1
                     else:
-                        app.logger.error(f"[RCLONE] 文件复制命令成功执行，但目标文件不存在: {local_path}")
-                        download_error[0] = "Command succeeded but file not found"
-                        if task_id:
-                            with download_lock:
-                                if task_id in download_progress:
-                                    download_progress[task_id]['status'] = 'error'
-                                    download_progress[task_id]['error'] = download_error[0]
-                else:
-                    error_msg = result.stderr.strip() or f"Command failed with exit code {result.returncode}"
-                    app.logger.error(f"[RCLONE] 文件复制失败: {remote_path}, 错误: {error_msg}")
-                    download_error[0] = error_msg
-                    if task_id:
-                        with download_lock:
-                            if task_id in download_progress:
-                                download_progress[task_id]['status'] = 'error'
-                                download_progress[task_id]['error'] = error_msg
+                        self.stats["failed"] += 1
+                        app.logger.warning(f"[PREFETCH] 预缓存失败: {name}, {message}")
             except Exception as e:
-                app.logger.error(f"[RCLONE] 下载线程异常: {str(e)}", exc_info=True)
-                download_error[0] = str(e)
-                if task_id:
-                    with download_lock:
-                        if task_id in download_progress:
-                            download_progress[task_id]['status'] = 'error'
-                            download_progress[task_id]['error'] = str(e)
-            finally:
-                download_complete.set()
-        
-        # 启动下载线程
-        download_thread = threading.Thread(target=download_worker, daemon=True)
-        download_thread.start()
-        
-        # 如果有任务ID，监控下载进度
-        if task_id and total_size > 0:
-            while not download_complete.is_set():
-                if os.path.exists(local_path):
-                    current_size = os.path.getsize(local_path)
-                    with download_lock:
-                        if task_id in download_progress:
-                            download_progress[task_id]['current_size'] = current_size
-                time.sleep(0.5)  # 每0.5秒检查一次
-        
-        # 等待下载完成
-        download_complete.wait()
-        
-        if download_error[0]:
-            return False, download_error[0]
-        else:
-            return True, f"File copied successfully"
-            
-    except subprocess.SubprocessError as e:
-        app.logger.error(f"[RCLONE] 执行复制命令时出错: {remote_path}, 错误: {str(e)}", exc_info=True)
-        if task_id:
-            with download_lock:
-                if task_id in download_progress:
-                    download_progress[task_id]['status'] = 'error'
-                    download_progress[task_id]['error'] = str(e)
-        return False, f"Subprocess error: {str(e)}"
-    except Exception as e:
-        app.logger.error(f"[RCLONE] 复制文件时发生未预期错误: {remote_path}, 错误: {str(e)}", exc_info=True)
-        if task_id:
-            with download_lock:
-                if task_id in download_progress:
-                    download_progress[task_id]['status'] = 'error'
-                    download_progress[task_id]['error'] = str(e)
-        return False, f"Unexpected error: {str(e)}"
+                app.logger.error(f"[PREFETCH] 预缓存出错: {str(e)}", exc_info=True)
+
+
+prefetch_scheduler = PrefetchScheduler(PREFETCH_WINDOW)
+
+
+def notify_track_started(filename):
+    """曲目开始播放后触发下一首预加载和前瞻预缓存"""
+    gapless_preloader.schedule(filename)
+    prefetch_scheduler.notify(filename)
+    audio_extractor.retry_deferred()
 
 
-def get_file_from_cache_or_nas(filename, task_id=None):
-    """从缓存获取文件，如果不存在则从NAS拉取"""
+def get_file_from_cache_or_nas(filename, task_id=None, priority=DOWNLOAD_PRIORITY_PLAYBACK):
+    """从缓存获取文件，如果不存在则通过下载管理器从NAS拉取"""
     local_file_path = os.path.join(LOCAL_DIR, filename)
     
     # 检查本地是否已存在
-    if os.path.exists(local_file_path):
+    # 只统计真正的播放请求，预缓存/预加载不计入访问热度
+    is_playback = priority == DOWNLOAD_PRIORITY_PLAYBACK
+    if cache_index.contains(filename):
+        if is_playback:
+            cache_manager.record_access(filename, hit=True)
         return True, local_file_path, "File exists in cache", None
     
-    # 从NAS拉取文件
-    success, message = rclone_copy_file(filename, local_file_path, task_id)
+    # 从NAS拉取文件，播放请求期间暂停后台预缓存，把带宽让给前台
+    if not is_playback:
+        success, message = download_manager.fetch(filename, priority, task_id)
+    else:
+        cache_manager.record_access(filename, hit=False)
+        prefetch_scheduler.foreground_started()
+        try:
+            success, message = download_manager.fetch(filename, priority, task_id)
+        finally:
+            prefetch_scheduler.foreground_finished()
     if success:
         return True, local_file_path, "File copied from NAS", task_id
     else:
         return False, None, f"Failed to get file from NAS: {message}", task_id
 
+PROGRESSIVE_PLAYBACK_ENABLED = os.environ.get('PROGRESSIVE_PLAYBACK_ENABLED', 'false').lower() == 'true'
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class StreamRelay:
+    """边下边播的本地HTTP中转
+
+    未缓存的曲目不再等整个文件下载完：后台开始完整缓存的同时，mpv直接加载 /stream/<文件名>。
+    中转按HTTP Range请求工作，文件已完整缓存时读本地文件，否则用 rclone cat --offset/--count
+    从NAS读取请求的范围，因此首次出声时间与文件大小无关，mp4等需要跳到文件末尾读索引的格式也能播放。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._downloading = set()  # 正在后台完整缓存的文件
+        self._sizes = {}           # 文件名 -> 远程文件大小
+
+    def start(self, filename, task_id=None):
+        """开始后台缓存并返回供mpv加载的中转URL"""
+        if not self.is_allowed(filename):
+            # 不在NAS目录和缓存中的名字不触发下载（中转路由对它们返回404）
+            app.logger.warning(f"[STREAM] 拒绝缓存未知文件: {filename}")
+            return self.url(filename)
+        with self._lock:
+            already_downloading = filename in self._downloading
+            self._downloading.add(filename)
+        if not already_downloading:
+            threading.Thread(target=self._download, args=(filename, task_id), daemon=True).start()
+        return self.url(filename)
+
+    def url(self, filename):
+        """供mpv加载的中转URL（mpv的filename属性会还原百分号编码，仍是原文件名）"""
+        return f"http://127.0.0.1:{API_PORT}/stream/{urllib.parse.quote(filename)}"
+
+    def is_allowed(self, filename):
+        """只允许中转NAS目录或缓存目录中的文件名，拒绝带路径分隔符的名字以及 . 和 ..
+
+        文件名中间出现的..（例如 "演唱会...mp4"）是合法的，目录/缓存成员检查已足以防止路径穿越。
+        """
+        if not filename or filename in ('.', '..') or '/' in filename or '\\' in filename:
+            return False
+        return filename in get_playback_order(blocking=False) or cache_index.contains(filename)
+
+    def is_complete(self, filename):
+        with self._lock:
+            downloading = filename in self._downloading
+        return not downloading and cache_index.contains(filename)
+
+    def remote_size(self, filename):
+        """远程文件大小，优先读曲库索引，没有时用rclone size查询；取不到时返回None"""
+        if self.is_complete(filename):
+            return os.path.getsize(os.path.join(LOCAL_DIR, filename))
+        with self._lock:
+            if filename in self._sizes:
+                return self._sizes[filename]
+        size = library_index.get_size(filename) if library_index is not None else None
+        if size is None or size < 0:
+            size = get_remote_file_size(filename)
+        if size is not None:
+            with self._lock:
+                self._sizes[filename] = size
+        return size
+
+    def iter_range(self, filename, start, length):
+        """按范围读取文件内容的生成器，length为None时读到文件末尾"""
+        if self.is_complete(filename):
+            with open(os.path.join(LOCAL_DIR, filename), 'rb') as f:
+                f.seek(start)
+                remaining = length
+                while remaining is None or remaining > 0:
+                    chunk = f.read(STREAM_CHUNK_SIZE if remaining is None else min(STREAM_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    if remaining is not None:
+                        remaining -= len(chunk)
+                    yield chunk
+            return
+
+        cmd = ['rclone', 'cat', f"{RCLONE_REMOTE}/{filename}", '--offset', str(start)]
+        if length is not None:
+            cmd += ['--count', str(length)]
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        try:
+            while True:
+                chunk = process.stdout.read(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            # mpv跳转或断开时会提前关闭连接，结束对应的rclone进程
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+
+    def _download(self, filename, task_id):
+        try:
+            success, _, message, _ = get_file_from_cache_or_nas(filename, task_id)
+            if success:
+                app.logger.info(f"[STREAM] 边下边播的文件已完整缓存: {filename}")
+            else:
+                app.logger.warning(f"[STREAM] 后台缓存失败，继续从NAS中转播放: {filename}, {message}")
+        finally:
+            with self._lock:
+                self._downloading.discard(filename)
+
+
+stream_relay = StreamRelay()
+
+
+def get_playback_source(filename, task_id=None):
+    """获取供loadfile使用的播放地址，返回值与get_file_from_cache_or_nas相同
+
+    已缓存时为本地路径；启用边下边播且未缓存时立即返回本地中转URL，同时在后台完整缓存。
+    """
+    if PROGRESSIVE_PLAYBACK_ENABLED and not stream_relay.is_complete(filename):
+        return True, stream_relay.start(filename, task_id), "File streaming from NAS while caching", task_id
+    return get_file_from_cache_or_nas(filename, task_id)
+
+
+def auto_cache_once():
+    """执行一次自动缓存检查：缓存当前播放文件的下一首（启用前瞻预缓存时交给预缓存调度重新检查整个窗口）"""
+    # 获取当前播放的文件信息，以确定下一首需要缓存的文件
+    current_file = None
+    try:
+        # 获取当前播放文件的名称
+        current_filename, filename_msg = get_mpv_property("filename")
+        if current_filename and isinstance(current_filename, str):
+            current_file = os.path.basename(current_filename)
+            app.logger.info(f"[AUTO_CACHE] 当前播放文件: {current_file}")
+        elif not current_filename:
+            app.logger.debug(f"[AUTO_CACHE] 获取filename失败: {filename_msg}")
+    except Exception as e:
+        app.logger.warning(f"[AUTO_CACHE] 获取当前播放文件信息失败: {str(e)}")
+
+    if current_file and prefetch_scheduler.window > 0:
+        # 曲目变化时预缓存调度已立即处理，这里只作为兜底，补上失败或目录变化后缺失的文件
+        prefetch_scheduler.notify(current_file, force=True)
+    elif current_file:
+        # 与下一首共用同一个播放顺序，O(1)查找
+        order = get_playback_order()
+        app.logger.debug(f"[AUTO_CACHE] 播放顺序长度: {len(order)}")
+
+        if len(order) > 0:
+            next_file = order.neighbor(current_file, 1)
+            if next_file is None:
+                app.logger.warning(f"[AUTO_CACHE] 当前播放文件 {current_file} 不在NAS文件列表中")
+            else:
+                app.logger.info(f"[AUTO_CACHE] 下一首文件: {next_file}")
+
+                # 检查下一首文件是否已缓存
+                local_file_path = os.path.join(LOCAL_DIR, next_file)
+                if not cache_index.contains(next_file):
+                    app.logger.info(f"[AUTO_CACHE] 开始缓存下一首文件: {next_file} -> {local_file_path}")
+                    success, msg = download_manager.fetch(next_file, DOWNLOAD_PRIORITY_PREFETCH)
+                    if success:
+                        app.logger.info(f"[AUTO_CACHE] 下一首文件缓存成功: {next_file}")
+                    else:
+                        app.logger.error(f"[AUTO_CACHE] 下一首文件缓存失败: {next_file}, 错误: {msg}")
+                else:
+                    app.logger.info(f"[AUTO_CACHE] 下一首文件已存在于缓存中: {next_file}")
+
+
 def auto_cache_worker():
     """自动缓存工作线程 - 只缓存下一首文件"""
     global auto_cache_running
     app.logger.info("[AUTO_CACHE] 自动缓存线程已启动 (只缓存下一首模式)")
     
-    # 检查间隔时间（秒）
-    check_interval = 600  # 10分钟
-    
     while auto_cache_running:
         try:
-            # 获取当前播放的文件信息，以确定下一首需要缓存的文件
-            current_file = None
-            try:
-                # 获取当前播放文件的名称
-                current_filename, filename_msg = get_mpv_property("filename")
-                if current_filename and isinstance(current_filename, str):
-                    current_file = os.path.basename(current_filename)
-                    app.logger.info(f"[AUTO_CACHE] 当前播放文件: {current_file}")
-                elif not current_filename:
-                    app.logger.debug(f"[AUTO_CACHE] 获取filename失败: {filename_msg}")
-            except Exception as e:
-                app.logger.warning(f"[AUTO_CACHE] 获取当前播放文件信息失败: {str(e)}")
-            
-            if current_file:
-                # 获取NAS文件列表
-                files, message = rclone_list_files()
-                app.logger.debug(f"[AUTO_CACHE] 获取NAS文件列表结果: 长度={len(files) if files else 0}, 消息={message}")
-                
-                if files is not None and len(files) > 0:
-                    # 排序文件列表，假设是按字母顺序或时间顺序
-                    sorted_files = sorted(files)
-                    app.logger.debug(f"[AUTO_CACHE] 排序后的文件列表: {sorted_files}")
-                    
-                    # 找到当前文件在列表中的位置
-                    try:
-                        current_index = sorted_files.index(current_file)
-                        app.logger.debug(f"[AUTO_CACHE] 当前文件索引: {current_index}")
-                        
-                        # 确定下一首文件（循环播放）
-                        if current_index < len(sorted_files) - 1:
-                            next_file = sorted_files[current_index + 1]
-                        else:
-                            # 到列表末尾了，下一首是第一个文件
-                            next_file = sorted_files[0]
-                        
-                        app.logger.info(f"[AUTO_CACHE] 下一首文件: {next_file}")
-                        
-                        # 检查下一首文件是否已缓存
-                        local_file_path = os.path.join(LOCAL_DIR, next_file)
-                        if not os.path.exists(local_file_path):
-                            app.logger.info(f"[AUTO_CACHE] 开始缓存下一首文件: {next_file} -> {local_file_path}")
-                            success, msg = rclone_copy_file(next_file, local_file_path)
-                            if success:
-                                app.logger.info(f"[AUTO_CACHE] 下一首文件缓存成功: {next_file}")
-                            else:
-                                app.logger.error(f"[AUTO_CACHE] 下一首文件缓存失败: {next_file}, 错误: {msg}")
-                        else:
-                            app.logger.info(f"[AUTO_CACHE] 下一首文件已存在于缓存中: {next_file}")
-                    except ValueError:
-                        app.logger.warning(f"[AUTO_CACHE] 当前播放文件 {current_file} 不在NAS文件列表中")
+            auto_cache_once()
             
             # 每10分钟检查一次，而不是30分钟，以便及时缓存下一首
             app.logger.debug("[AUTO_CACHE] 检查完成，等待下一次执行 (10分钟)")
-            time.sleep(600)  # 10分钟
+            time.sleep(AUTO_CACHE_INTERVAL)
         except Exception as e:
             app.logger.error(f"[AUTO_CACHE] 自动缓存出错: {str(e)}", exc_info=True)
             # 出错后仍然继续，避免线程退出
-            time.sleep(600)  # 出错后也等待10分钟
+            time.sleep(AUTO_CACHE_INTERVAL)  # 出错后也等待10分钟
+
+
+async def auto_cache_task():
+    """自动缓存协程 - 在线程池中执行缓存检查，间隔期间不占用线程，停止时直接取消"""
+    app.logger.info("[AUTO_CACHE] 自动缓存协程已启动 (只缓存下一首模式)")
+    
+    while auto_cache_running:
+        try:
+            await control_loop.run_blocking(auto_cache_once)
+            app.logger.debug("[AUTO_CACHE] 检查完成，等待下一次执行 (10分钟)")
+        except Exception as e:
+            app.logger.error(f"[AUTO_CACHE] 自动缓存出错: {str(e)}", exc_info=True)
+        await asyncio.sleep(AUTO_CACHE_INTERVAL)
+
+
+class FadeEngine:
+    """音量渐变引擎
+
+    同一时间只有一个渐变在运行：启动新的渐变（例如快速切歌时的淡入）会先取消正在进行的渐变。
+    每一步按绝对时间点调度，避免sleep误差累积；音量通过常驻IPC连接设置，并在state_lock下同步到
+    self_recorded_state。控制循环运行时渐变作为名为fade的协程任务执行，否则在独立线程中执行。
+    每次渐变结束后记录计时精度报告。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cancel_event = None   # 线程模式下当前渐变的取消标记
+        self.last_report = None     # 最近一次渐变的计时报告
+
+    def start(self, start_volume, end_volume, duration, steps, label="fade"):
+        """启动渐变（立即返回），会取消正在进行的渐变"""
+        self.cancel()
+        if control_loop.running:
+            control_loop.spawn("fade", self._ramp_async, start_volume, end_volume, duration, steps, label)
+            return
+        cancel_event = threading.Event()
+        with self._lock:
+            self._cancel_event = cancel_event
+        threading.Thread(
+            target=self._ramp_thread,
+            args=(start_volume, end_volume, duration, steps, label, cancel_event),
+            daemon=True
+        ).start()
+
+    def cancel(self):
+        """取消正在进行的渐变，音量停在当前值"""
+        with self._lock:
+            cancel_event, self._cancel_event = self._cancel_event, None
+        if cancel_event is not None:
+            cancel_event.set()
+        if control_loop.running:
+            control_loop.cancel("fade")
+
+    def _apply_step(self, start_volume, end_volume, steps, i):
+        volume = int(start_volume + (end_volume - start_volume) * i / steps)
+        send_mpv_command(["set", "volume", str(volume)])
+        with state_lock:
+            self_recorded_state["volume"] = volume
+
+    def _ramp_thread(self, start_volume, end_volume, duration, steps, label, cancel_event):
+        started = time.monotonic()
+        lateness = []
+        cancelled = False
+        try:
+            for i in range(steps + 1):
+                scheduled = started + duration * i / steps
+                if cancel_event.wait(max(0.0, scheduled - time.monotonic())):
+                    cancelled = True
+                    break
+                lateness.append(time.monotonic() - scheduled)
+                self._apply_step(start_volume, end_volume, steps, i)
+        except Exception as e:
+            app.logger.error(f"[FADE] {label} 执行失败: {str(e)}", exc_info=True)
+        finally:
+            with self._lock:
+                if self._cancel_event is cancel_event:
+                    self._cancel_event = None
+            self._report(label, start_volume, end_volume, duration, steps, started, lateness, cancelled)
+
+    async def _ramp_async(self, start_volume, end_volume, duration, steps, label):
+        started = time.monotonic()
+        lateness = []
+        cancelled = False
+        try:
+            for i in range(steps + 1):
+                scheduled = started + duration * i / steps
+                await asyncio.sleep(max(0.0, scheduled - time.monotonic()))
+                lateness.append(time.monotonic() - scheduled)
+                await control_loop.run_blocking(self._apply_step, start_volume, end_volume, steps, i)
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            self._report(label, start_volume, end_volume, duration, steps, started, lateness, cancelled)
+
+    def _report(self, label, start_volume, end_volume, duration, steps, started, lateness, cancelled):
+        actual = time.monotonic() - started
+        report = {
+            "label": label,
+            "from_volume": start_volume,
+            "to_volume": end_volume,
+            "planned_duration": duration,
+            "actual_duration": round(actual, 3),
+            "steps": steps + 1,
+            "completed_steps": len(lateness),
+            "avg_lateness_ms": round(sum(lateness) / len(lateness) * 1000, 2) if lateness else 0,
+            "max_lateness_ms": round(max(lateness) * 1000, 2) if lateness else 0,
+            "cancelled": cancelled,
+            "finished_at": datetime.now().isoformat()
+        }
+        self.last_report = report
+        if cancelled:
+            app.logger.info(f"[FADE] {label} 已取消，完成 {len(lateness)}/{steps + 1} 步")
+        else:
+            app.logger.info(f"[FADE] {label} 完成，计划 {duration}秒，实际 {actual:.3f}秒，"
+                            f"平均延迟 {report['avg_lateness_ms']}ms，最大延迟 {report['max_lateness_ms']}ms")
+
+
+fade_engine = FadeEngine()
 
 
 def fade_in(duration=3.0, target_volume=100):
-    """音量淡入效果
+    """音量淡入效果（立即返回，由渐变引擎执行）
     
     Args:
         duration: 淡入持续时间（秒），默认3秒
         target_volume: 目标音量（0-100），默认100
     """
-    try:
-        app.logger.info(f"[FADE_IN] 开始淡入效果，持续时间: {duration}秒，目标音量: {target_volume}")
-        
-        # 设置初始音量为0
-        send_mpv_command(["set", "volume", "0"])
-        
-        # 计算步进参数
-        steps = 30  # 总步数
-        step_duration = duration / steps  # 每步的时间间隔
-        volume_step = target_volume / steps  # 每步的音量增量
-        
-        # 逐步增加音量
-        for i in range(steps + 1):
-            current_volume = int(volume_step * i)
-            send_mpv_command(["set", "volume", str(current_volume)])
-            
-            # 更新自己记录的状态
-            global self_recorded_state
-            self_recorded_state["volume"] = current_volume
-            
-            if i < steps:
-                time.sleep(step_duration)
-        
-        app.logger.info(f"[FADE_IN] 淡入效果完成，当前音量: {target_volume}")
-    except Exception as e:
-        app.logger.error(f"[FADE_IN] 淡入效果失败: {str(e)}", exc_info=True)
+    app.logger.info(f"[FADE_IN] 开始淡入效果，持续时间: {duration}秒，目标音量: {target_volume}")
+    fade_engine.start(0, target_volume, duration, 30, "fade_in")
 
 
 def fade_out(duration=2.0):
-    """音量淡出效果
+    """音量淡出效果（立即返回，由渐变引擎执行）
     
     Args:
         duration: 淡出持续时间（秒），默认2秒
     """
-    try:
-        # 获取当前音量
-        current_volume, _ = get_mpv_property("volume")
-        if current_volume is None:
-            current_volume = 100
-        
-        app.logger.info(f"[FADE_OUT] 开始淡出效果，持续时间: {duration}秒，起始音量: {current_volume}")
-        
-        # 计算步进参数
-        steps = 20  # 总步数
-        step_duration = duration / steps  # 每步的时间间隔
-        volume_step = current_volume / steps  # 每步的音量减量
-        
-        # 逐步降低音量
-        for i in range(steps + 1):
-            new_volume = int(current_volume - (volume_step * i))
-            send_mpv_command(["set", "volume", str(new_volume)])
-            
-            # 更新自己记录的状态
-            global self_recorded_state
-            self_recorded_state["volume"] = new_volume
+    # 获取当前音量
+    current_volume, _ = get_mpv_property("volume")
+    current_volume = float(current_volume) if current_volume is not None else 100
+    
+    app.logger.info(f"[FADE_OUT] 开始淡出效果，持续时间: {duration}秒，起始音量: {current_volume}")
+    fade_engine.start(current_volume, 0, duration, 20, "fade_out")
+
+
+COMMAND_COALESCE_WINDOW = float(os.environ.get('COMMAND_COALESCE_WINDOW', 0.08))  # 合并窗口（秒）
+
+
+class CommandCoalescer:
+    """合并短时间内的同类控制请求
+
+    拖动音量/进度条时前端会连续发出大量请求。同一类请求在窗口期内只由第一个请求（leader）
+    等待窗口结束后执行一次，目标值取窗口内最后到达的值；被合并的请求等待同一次执行完成，
+    拿到相同的结果返回。
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self._lock = threading.Lock()
+        self._batches = {}
+        self.stats = {}  # 各类请求的 {"requests": 收到的请求数, "dispatched": 实际执行次数}
+
+    def submit(self, key, value, apply_func, error_result=lambda e: (False, str(e))):
+        """提交请求并等待合并后的执行结果
+
+        Args:
+            key: 请求类型，例如 "volume"、"seek"
+            value: 本次请求的目标值
+            apply_func: 执行函数，参数为最终目标值
+            error_result: apply_func抛出异常时，根据异常生成交给所有被合并请求的结果
+
+        Returns:
+            tuple: (apply_func的返回值, 最终目标值)
+        """
+        with self._lock:
+            stats = self.stats.setdefault(key, {"requests": 0, "dispatched": 0})
+            stats["requests"] += 1
+            batch = self._batches.get(key)
+            is_leader = batch is None
+            if is_leader:
+                batch = {"value": value, "count": 0, "done": threading.Event(), "result": None}
+                self._batches[key] = batch
+            batch["value"] = value
+            batch["count"] += 1
+
+        if not is_leader:
+            batch["done"].wait()
+            return batch["result"], batch["final_value"]
+
+        if self.window > 0:
+            time.sleep(self.window)
+        with self._lock:
+            # 之后到达的请求开始新的一批
+            del self._batches[key]
+            batch["final_value"] = batch["value"]
+            stats["dispatched"] += 1
+        if batch["count"] > 1:
+            app.logger.info(f"[COALESCE] {key} 合并了 {batch['count']} 个请求，最终值: {batch['final_value']}")
+        try:
+            batch["result"] = apply_func(batch["final_value"])
+        except Exception as e:
+            # 不能让被合并的请求拿到None，否则它们在解包结果时全部出错
+            app.logger.error(f"[COALESCE] {key} 执行失败: {str(e)}", exc_info=True)
+            batch["result"] = error_result(e)
+        finally:
+            batch["done"].set()
+        return batch["result"], batch["final_value"]
+
+
+command_coalescer = CommandCoalescer(COMMAND_COALESCE_WINDOW)
+
+
+TIMER_PRECISION = 0.1  # 计时精度（秒），100毫秒
+
+
+def advance_recorded_position(delta):
+    """按流逝的时间推进自己记录的播放位置
+
+    Returns:
+        bool: 当前是否处于播放中（未暂停）
+    """
+    # 防止delta过大（例如线程暂停过久）
+    if delta > 1.0:
+        delta = 1.0
+    
+    # 检查播放状态
+    with state_lock:
+        is_playing = self_recorded_state["playing"]
+        is_paused = self_recorded_state["paused"]
+        current_position = self_recorded_state["position"]
+        current_duration = self_recorded_state["duration"]
+        
+        # 只有当正在播放且未暂停时，才更新播放位置
+        if is_playing and not is_paused:
+            # 增加播放位置（基于实际流逝的时间）
+            new_position = current_position + delta
             
-            if i < steps:
-                time.sleep(step_duration)
+            # 检查是否达到文件时长
+            if current_duration > 0 and new_position >= current_duration:
+                # 达到文件时长，不再增加，也不重置，等待监控线程处理切换
+                new_position = current_duration
+                
+                # 更新播放状态
+                self_recorded_state["position"] = new_position
+                self_recorded_state["progress"] = 100.0
+            else:
+                # 更新播放位置
+                self_recorded_state["position"] = new_position
+                
+                # 计算并更新播放进度百分比
+                if current_duration > 0:
+                    new_progress = (new_position / current_duration) * 100
+                    self_recorded_state["progress"] = round(new_progress, 3)
         
-        app.logger.info(f"[FADE_OUT] 淡出效果完成，当前音量: 0")
-    except Exception as e:
-        app.logger.error(f"[FADE_OUT] 淡出效果失败: {str(e)}", exc_info=True)
+        return is_playing and not is_paused
 
 
 def timer_worker():
     """精确计时线程，每100毫秒更新一次播放位置"""
-    global timer_thread_running, self_recorded_state
+    global timer_thread_running
     app.logger.info("[TIMER_WORKER] 精确计时线程已启动")
     
-    # 计时精度（秒）
-    timer_precision = 0.1  # 100毫秒
     last_time = time.time()
     
     while timer_thread_running:
@@ -1107,51 +3658,41 @@ def timer_worker():
             delta = current_time - last_time
             last_time = current_time
             
-            # 防止delta过大（例如线程暂停过久）
-            if delta > 1.0:
-                delta = 1.0
-            
-            # 检查播放状态
-            with state_lock:
-                is_playing = self_recorded_state["playing"]
-                is_paused = self_recorded_state["paused"]
-                current_position = self_recorded_state["position"]
-                current_duration = self_recorded_state["duration"]
-                
-                # 只有当正在播放且未暂停时，才更新播放位置
-                if is_playing and not is_paused:
-                    # 增加播放位置（基于实际流逝的时间）
-                    new_position = current_position + delta
-                    
-                    # 检查是否达到文件时长
-                    if current_duration > 0 and new_position >= current_duration:
-                        # 达到文件时长，不再增加，也不重置，等待监控线程处理切换
-                        new_position = current_duration
-                        
-                        # 更新播放状态
-                        self_recorded_state["position"] = new_position
-                        self_recorded_state["progress"] = 100.0
-                    else:
-                        # 更新播放位置
-                        self_recorded_state["position"] = new_position
-                        
-                        # 计算并更新播放进度百分比
-                        if current_duration > 0:
-                            new_progress = (new_position / current_duration) * 100
-                            self_recorded_state["progress"] = round(new_progress, 3)
+            advance_recorded_position(delta)
             
             # 等待100毫秒
-            time.sleep(timer_precision)
+            time.sleep(TIMER_PRECISION)
         except Exception as e:
             app.logger.error(f"[TIMER_WORKER] 计时线程出错: {str(e)}", exc_info=True)
             # 出错后继续执行，避免线程退出
-            time.sleep(timer_precision)
+            time.sleep(TIMER_PRECISION)
             # 更新时间，避免出错后delta过大
             last_time = time.time()
     
     app.logger.info("[TIMER_WORKER] 精确计时线程已停止")
 
 
+TIMER_IDLE_INTERVAL = 0.5  # 协程模式下暂停/停止时的检查间隔（秒）
+
+
+async def timer_task():
+    """精确计时协程，播放时每100毫秒更新一次播放位置，暂停时降低唤醒频率"""
+    app.logger.info("[TIMER_WORKER] 精确计时协程已启动")
+    last_time = time.time()
+    
+    while timer_thread_running:
+        current_time = time.time()
+        try:
+            is_playing = advance_recorded_position(current_time - last_time)
+        except Exception as e:
+            app.logger.error(f"[TIMER_WORKER] 计时协程出错: {str(e)}", exc_info=True)
+            is_playing = False
+        last_time = current_time
+        await asyncio.sleep(TIMER_PRECISION if is_playing else TIMER_IDLE_INTERVAL)
+    
+    app.logger.info("[TIMER_WORKER] 精确计时协程已停止")
+
+
 def playback_monitor_worker():
     """播放结束监控工作线程 - 检测播放结束并自动播放下一首"""
     global playback_monitor_running, current_playing_file, self_recorded_state, continuous_play_start_time
@@ -1202,9 +3743,19 @@ def playback_monitor_worker():
             try:
                 # --- 主动同步MPV状态到缓存 ---
                 # 批量获取关键属性，减少socket连接次数
+                if 'check_count' not in last_status:
+                    last_status['check_count'] = 0
+                last_status['check_count'] += 1
+                
+                property_names = ["pause", "volume", "filename", "eof-reached", "af-metadata"]
+                if self_recorded_state["duration"] <= 0 or last_status['check_count'] % 20 == 0: # 每10秒
+                    property_names.append("duration")
+                if last_status['check_count'] % 20 == 0:
+                    property_names.append("playlist")
+                values, messages = get_mpv_properties(property_names)
                 
                 # 1. 播放状态
-                paused, error_msg = get_mpv_property("pause")
+                paused, error_msg = values["pause"], messages["pause"]
                 
                 # 2. 更新状态
                 with state_lock:
@@ -1215,13 +3766,13 @@ def playback_monitor_worker():
                         self_recorded_state["playing"] = not paused
                 
                 # 2. 音量
-                volume, _ = get_mpv_property("volume")
+                volume = values["volume"]
                 if volume is not None:
                     with state_lock:
                         self_recorded_state["volume"] = volume
                 
                 # 3. 文件名和路径
-                filename_mpv, _ = get_mpv_property("filename") 
+                filename_mpv = values["filename"]
                 if filename_mpv:
                      # 确保filename是字符串
                     filename_mpv = str(filename_mpv)
@@ -1231,6 +3782,9 @@ def playback_monitor_worker():
                             
                          # 更新全局变量
                          current_playing_file = filename_mpv
+                         # 自然衔接到预加载项时改用目录中的文件名并预加载再下一首
+                         if gapless_preloader.on_file_changed(filename_mpv):
+                             filename_mpv = self_recorded_state["current_file"]
                          if filename_mpv != last_status['playing_file']:
                              app.logger.info(f"[PLAYBACK_MONITOR] 播放文件变更(MPV Sync): {last_status['playing_file']} -> {filename_mpv}")
                              last_status['playing_file'] = filename_mpv
@@ -1241,15 +3795,11 @@ def playback_monitor_worker():
                              
                              # 记录到时间轴
                              add_to_timeline("play", f"开始播放: {filename_mpv}", {"current_file": filename_mpv})
+                             prefetch_scheduler.notify(filename_mpv)
 
                 # 4. 时长 check
-                if 'check_count' not in last_status:
-                    last_status['check_count'] = 0
-                last_status['check_count'] += 1
-                
-                current_dur = self_recorded_state["duration"]
-                if current_dur <= 0 or last_status['check_count'] % 20 == 0: # 每10秒
-                    duration, _ = get_mpv_property("duration")
+                if "duration" in values:
+                    duration = values["duration"]
                     if duration and duration > 0:
                         with state_lock:
                             self_recorded_state["duration"] = float(duration)
@@ -1259,8 +3809,14 @@ def playback_monitor_worker():
                 if 'zero_duration_count' not in last_status:
                     last_status['zero_duration_count'] = 0
                 
-                # 获取当前duration
+                # 获取当前duration，mpv还没给出时先用元数据缓存中的时长
                 current_duration_check = self_recorded_state["duration"]
+                if filename and not current_duration_check:
+                    cached_duration = cached_track_duration(filename)
+                    if cached_duration:
+                        with state_lock:
+                            self_recorded_state["duration"] = cached_duration
+                        current_duration_check = cached_duration
                 
                 # 如果有播放文件且duration为0或空
                 if filename and (current_duration_check is None or current_duration_check == 0 or current_duration_check == ''):
@@ -1282,20 +3838,22 @@ def playback_monitor_worker():
                 # 移除了进度百分比更新逻辑，因为现在由timer_worker函数负责更新播放位置和进度百分比
 
                 # 5. 播放列表 (每10秒)
-                if last_status['check_count'] % 20 == 0:
-                    playlist, _ = get_mpv_property("playlist")
+                if "playlist" in values:
+                    playlist = values["playlist"]
                     with state_lock:
                         self_recorded_state["playlist"] = playlist if playlist else []
                 # ---------------------------
 
                 # 获取 eof-reached 状态 (是否播放结束)
-                eof_reached, _ = get_mpv_property("eof-reached")
+                eof_reached = values["eof-reached"]
+                af_metadata = values["af-metadata"]
                 idle_active = False 
                 
             except Exception as e:
                 app.logger.debug(f"[PLAYBACK_MONITOR] 更新状态时出错: {str(e)}")
                 # 继续执行，使用默认值
                 eof_reached = False
+                af_metadata = None
                 idle_active = False
                 # 计时由专门的timer_worker线程处理，这里不需要更新位置
             
@@ -1404,8 +3962,7 @@ def playback_monitor_worker():
             
             # 检查静音检测
             try:
-                # 获取音频过滤器元数据
-                af_metadata, _ = get_mpv_property("af-metadata")
+                # 音频过滤器元数据已在上面的批量请求中获取
                 if af_metadata and isinstance(af_metadata, dict):
                     # 检查是否有静音检测信息
                     # silencedetect output format: lavfi.silencedetect.silence_start
@@ -1475,9 +4032,238 @@ def playback_monitor_worker():
             
             time.sleep(check_interval)
         except Exception as e:
-            app.logger.error(f"[PLAYBACK_MONITOR] 播放监控出错: {str(e)}", exc_info=True)
-            # 出错后仍然继续，避免线程退出
-            time.sleep(check_interval)
+            app.logger.error(f"[PLAYBACK_MONITOR] 播放监控出错: {str(e)}", exc_info=True)
+            # 出错后仍然继续，避免线程退出
+            time.sleep(check_interval)
+
+# 事件模式下订阅的属性，observe id 即列表下标+1
+MPV_OBSERVED_PROPERTIES = ["pause", "volume", "filename", "duration", "idle-active", "af-metadata"]
+ZERO_DURATION_SKIP_DELAY = 3.0  # 文件加载后时长持续为0多少秒后自动跳过
+
+
+def _queue_mpv_event(event):
+    """IPC读取线程中的事件回调，只负责转交给事件监控线程"""
+    if playback_monitor_running and PLAYBACK_MONITOR_MODE == 'event':
+        mpv_event_queue.put(event)
+
+
+def _subscribe_mpv_properties():
+    """在（重新）连接后订阅属性变化，mpv的observe_property按连接生效，重连后需重新订阅"""
+    if not (playback_monitor_running and PLAYBACK_MONITOR_MODE == 'event'):
+        return
+    for observe_id, property_name in enumerate(MPV_OBSERVED_PROPERTIES, start=1):
+        # 先取消同id的旧订阅，避免监控重启后收到重复事件
+        send_mpv_command(["unobserve_property", observe_id])
+        success, message = send_mpv_command(["observe_property", observe_id, property_name])
+        if not success:
+            app.logger.warning(f"[PLAYBACK_MONITOR] 订阅属性 {property_name} 失败: {message}")
+    mpv_event_queue.put({"event": "ipc-connected"})
+    app.logger.info(f"[PLAYBACK_MONITOR] 已订阅MPV属性变化: {MPV_OBSERVED_PROPERTIES}")
+
+
+mpv_ipc.add_event_handler(_queue_mpv_event)
+mpv_ipc.add_connect_handler(_subscribe_mpv_properties)
+
+
+def _monitor_advance_track(reason):
+    """事件监控线程中切换下一首（next_track需要应用上下文）"""
+    app.logger.info(f"[PLAYBACK_MONITOR] {reason}，自动播放下一首")
+    with state_lock:
+        self_recorded_state["position"] = 0
+        self_recorded_state["duration"] = 0
+        self_recorded_state["progress"] = 0
+        self_recorded_state["last_update_time"] = time.time()
+    with app.app_context():
+        next_track()
+
+
+def _reset_track_progress(now):
+    """清零当前曲目的时长和进度"""
+    with state_lock:
+        self_recorded_state["duration"] = 0
+        self_recorded_state["position"] = 0
+        self_recorded_state["progress"] = 0
+        self_recorded_state["last_update_time"] = now
+
+
+def playback_monitor_event_worker():
+    """事件驱动的播放监控线程 - 阻塞等待mpv推送的事件，只在状态变化或定时任务到期时唤醒"""
+    global current_playing_file, continuous_play_start_time
+    app.logger.info("[PLAYBACK_MONITOR] 播放监控线程已启动 (事件模式)")
+
+    # 清掉模式切换前残留的事件，然后确保已连接并订阅
+    while not mpv_event_queue.empty():
+        mpv_event_queue.get_nowait()
+    if mpv_ipc.connected:
+        _subscribe_mpv_properties()
+    else:
+        mpv_ipc.ensure_connection()
+
+    pending_auto_next = False      # 收到end-file(eof)后，等待mpv进入空闲再切换下一首
+    zero_duration_deadline = None  # 文件加载后时长仍为0的跳过时间点
+
+    while playback_monitor_running:
+        # 计算最近的定时任务，没有时无限期阻塞
+        deadlines = [d for d in (zero_duration_deadline,) if d is not None]
+        with state_lock:
+            is_playing = self_recorded_state["playing"] and not self_recorded_state["paused"]
+        if is_playing and continuous_play_start_time is not None:
+            deadlines.append(continuous_play_start_time + AUTO_PAUSE_DURATION)
+        timeout = max(0.0, min(deadlines) - time.time()) if deadlines else None
+
+        try:
+            event = mpv_event_queue.get(timeout=timeout)
+        except queue.Empty:
+            event = None
+
+        if not playback_monitor_running:
+            break
+
+        try:
+            now = time.time()
+            name = event.get("event") if event else None
+
+            if name == "property-change":
+                prop = event.get("name")
+                value = event.get("data")
+                if prop == "pause" and value is not None:
+                    with state_lock:
+                        self_recorded_state["paused"] = bool(value)
+                        self_recorded_state["playing"] = not value
+                elif prop == "volume" and value is not None:
+                    with state_lock:
+                        self_recorded_state["volume"] = value
+                elif prop == "duration":
+                    if value and value > 0:
+                        zero_duration_deadline = None
+                        with state_lock:
+                            self_recorded_state["duration"] = float(value)
+                    elif value is None:
+                        # 切换文件时mpv先把duration置空，清掉上一首的时长，避免file-loaded沿用
+                        _reset_track_progress(now)
+                elif prop == "filename" and value:
+                    filename_mpv = str(value)
+                    with state_lock:
+                        changed = filename_mpv != self_recorded_state["current_file"]
+                        if changed:
+                            self_recorded_state["current_file"] = filename_mpv
+                    current_playing_file = filename_mpv
+                    # 自然衔接到预加载项时on_file_changed会同步状态、记录时间轴并预加载再下一首
+                    if changed and not gapless_preloader.on_file_changed(filename_mpv):
+                        app.logger.info(f"[PLAYBACK_MONITOR] 播放文件变更(MPV事件): {filename_mpv}")
+                        add_to_timeline("play", f"开始播放: {filename_mpv}", {"current_file": filename_mpv})
+                        prefetch_scheduler.notify(filename_mpv)
+                elif prop == "idle-active" and value and pending_auto_next:
+                    pending_auto_next = False
+                    _monitor_advance_track("end-file事件检测到播放结束")
+                elif prop == "af-metadata" and isinstance(value, dict):
+                    silence_start = value.get("lavfi.silencedetect.silence_start")
+                    with state_lock:
+                        position = self_recorded_state["position"]
+                    # 避免开始时的短暂静音导致误判
+                    if silence_start and position > 5:
+                        app.logger.info(f"[PLAYBACK_MONITOR] 检测到静音，开始时间: {silence_start}")
+                        send_mask_reminder("检测到静音，切换下一首", "silence_skip")
+                        _monitor_advance_track(f"检测到静音结束 (start: {silence_start})")
+
+            elif name == "start-file":
+                pending_auto_next = False
+                zero_duration_deadline = None
+                # 新文件开始加载（包括播放列表自然衔接），上一首的时长和进度不再有效
+                _reset_track_progress(now)
+
+            elif name == "file-loaded":
+                with state_lock:
+                    self_recorded_state["playing"] = not self_recorded_state["paused"]
+                    self_recorded_state["position"] = 0
+                    self_recorded_state["progress"] = 0
+                    self_recorded_state["last_update_time"] = now
+                    has_duration = self_recorded_state["duration"] > 0
+                if not has_duration:
+                    # 元数据缓存中有时长时直接使用，不必等mpv
+                    cached_duration = cached_track_duration(self_recorded_state["current_file"])
+                    if cached_duration:
+                        with state_lock:
+                            self_recorded_state["duration"] = cached_duration
+                    else:
+                        zero_duration_deadline = now + ZERO_DURATION_SKIP_DELAY
+
+            elif name == "end-file":
+                reason = event.get("reason")
+                if reason == "eof":
+                    # 播放列表中还有下一项时mpv会自行发出start-file，否则进入空闲
+                    pending_auto_next = True
+                    with state_lock:
+                        self_recorded_state["position"] = self_recorded_state["duration"]
+                        self_recorded_state["progress"] = 100.0
+                        self_recorded_state["last_update_time"] = now
+                elif reason == "error":
+                    _monitor_advance_track(f"文件播放出错({event.get('file_error', 'unknown')})")
+
+            elif name == "idle" and pending_auto_next:
+                pending_auto_next = False
+                _monitor_advance_track("end-file事件检测到播放结束")
+
+            elif name in ("pause", "unpause"):
+                with state_lock:
+                    self_recorded_state["paused"] = name == "pause"
+                    self_recorded_state["playing"] = name != "pause"
+
+            elif name == "seek":
+                position, msg = get_mpv_property("time-pos")
+                if msg == "Success" and position is not None:
+                    with state_lock:
+                        duration = self_recorded_state["duration"]
+                        self_recorded_state["position"] = float(position)
+                        if duration > 0:
+                            self_recorded_state["progress"] = round(float(position) / duration * 100, 3)
+                        self_recorded_state["last_update_time"] = now
+
+            elif name == "ipc-disconnected":
+                app.logger.info("[PLAYBACK_MONITOR] MPV连接已断开，等待重连")
+                pending_auto_next = False
+                zero_duration_deadline = None
+                current_playing_file = ""
+
+            # 时长持续为0则跳过
+            if zero_duration_deadline is not None and now >= zero_duration_deadline:
+                zero_duration_deadline = None
+                with state_lock:
+                    filename = self_recorded_state["current_file"]
+                    has_duration = self_recorded_state["duration"] > 0
+                if filename and not has_duration:
+                    app.logger.warning(f"[PLAYBACK_MONITOR] 检测到当前曲目duration为0或空: {filename}，自动跳到下一首")
+                    _monitor_advance_track("duration为0")
+
+            # 自动暂停功能：检测连续播放时长
+            with state_lock:
+                is_playing = self_recorded_state["playing"] and not self_recorded_state["paused"]
+                filename = self_recorded_state["current_file"]
+            if is_playing and filename:
+                if continuous_play_start_time is None:
+                    continuous_play_start_time = now
+                    app.logger.info(f"[AUTO_PAUSE] 开始记录连续播放时间")
+                elif now - continuous_play_start_time >= AUTO_PAUSE_DURATION:
+                    play_duration = now - continuous_play_start_time
+                    app.logger.warning(f"[AUTO_PAUSE] 连续播放已达{AUTO_PAUSE_DURATION/60:.1f}分钟，自动暂停")
+                    send_mask_reminder(f"已连续播放{AUTO_PAUSE_DURATION/60:.0f}分钟，自动暂停", "auto_pause")
+                    add_to_timeline(
+                        "auto_pause",
+                        f"自动暂停（连续播放{AUTO_PAUSE_DURATION/60:.0f}分钟）",
+                        {"play_duration": play_duration, "current_file": filename}
+                    )
+                    send_mpv_command(["set", "pause", "yes"])
+                    with state_lock:
+                        self_recorded_state["paused"] = True
+                        self_recorded_state["playing"] = False
+                    continuous_play_start_time = None
+            elif continuous_play_start_time is not None:
+                app.logger.info(f"[AUTO_PAUSE] 播放已暂停/停止，重置连续播放计时器")
+                continuous_play_start_time = None
+        except Exception as e:
+            app.logger.error(f"[PLAYBACK_MONITOR] 处理MPV事件出错: {str(e)}", exc_info=True)
+
+    app.logger.info("[PLAYBACK_MONITOR] 播放监控线程已停止 (事件模式)")
 
 @app.route('/cache/auto', methods=['POST'])
 @log_operation("控制自动缓存")
@@ -1496,8 +4282,11 @@ def control_auto_cache():
                 # 启动自动缓存线程
                 app.logger.info("[AUTO_CACHE] 正在启动自动缓存服务")
                 auto_cache_running = True
-                auto_cache_thread = threading.Thread(target=auto_cache_worker, daemon=True)
-                auto_cache_thread.start()
+                if control_loop.running:
+                    control_loop.spawn("auto_cache", auto_cache_task)
+                else:
+                    auto_cache_thread = threading.Thread(target=auto_cache_worker, daemon=True)
+                    auto_cache_thread.start()
                 
                 # 发送遮罩提醒
                 send_mask_reminder("自动缓存服务已启动", "auto_cache_start_success")
@@ -1515,7 +4304,9 @@ def control_auto_cache():
                 
                 app.logger.info("[AUTO_CACHE] 正在停止自动缓存服务")
                 auto_cache_running = False
-                if auto_cache_thread:
+                if control_loop.running:
+                    control_loop.cancel("auto_cache")
+                elif auto_cache_thread:
                     auto_cache_thread.join(timeout=5)  # 等待线程结束，最多5秒
                 
                 # 发送遮罩提醒
@@ -1535,7 +4326,8 @@ def control_auto_cache():
             return jsonify({
                 "status": "ok",
                 "running": auto_cache_running,
-                "thread_alive": auto_cache_thread.is_alive() if auto_cache_thread else False
+                "thread_alive": control_loop.is_active("auto_cache") if control_loop.running
+                                else (auto_cache_thread.is_alive() if auto_cache_thread else False)
             }), 200
         
         else:
@@ -1555,6 +4347,7 @@ def control_auto_cache():
 def get_download_progress(task_id):
     """获取下载进度"""
     try:
+        prune_download_progress()
         with download_lock:
             if task_id not in download_progress:
                 return jsonify({
@@ -1579,6 +4372,8 @@ def get_download_progress(task_id):
             "current_size": task_info['current_size'],
             "progress": progress,
             "download_status": task_info['status'],
+            "speed": task_info.get('speed', 0),  # 字节/秒
+            "eta": task_info.get('eta'),         # 剩余秒数，未知时为null
             "error": task_info.get('error')
         }), 200
     except Exception as e:
@@ -1706,48 +4501,73 @@ def next_track():
         
         # 如果自己记录的状态中没有文件名，尝试从MPV获取
         if not current_file:
-            current_file, _ = get_mpv_property("filename")
-            
-            # 如果获取filename失败，尝试从path属性获取
-            if not current_file:
-                path, _ = get_mpv_property("path")
-                if path:
-                    current_file = os.path.basename(path)
+            # filename为空时get_mpv_properties会回退到path属性
+            values, _ = get_mpv_properties(["filename", "path"])
+            current_file = values["filename"]
                     
             # 如果MPV返回空且我们有全局记录，使用全局记录
             if not current_file and current_playing_file:
                 current_file = current_playing_file
                 app.logger.info(f"MPV当前无文件，使用全局记录的文件计算下一首: {current_file}")
         
-        # 获取NAS上的所有音频文件列表
-        all_files, message = rclone_list_files()
-        if not all_files:
-            # 如果NAS获取失败，使用本地文件
-            all_files = get_audio_files()
+        # 下一首已预加载到mpv播放列表时直接playlist-next，跳过列表获取和文件拷贝
+        next_file, local_path = gapless_preloader.take(current_file)
+        if next_file:
+            old_file = current_playing_file
+            current_playing_file = next_file
+            next_playing_file = next_file
+            with state_lock:
+                self_recorded_state["playing"] = True
+                self_recorded_state["paused"] = False
+                self_recorded_state["current_file"] = next_file
+                self_recorded_state["position"] = 0
+                self_recorded_state["progress"] = 0
+                self_recorded_state["duration"] = 0
+                self_recorded_state["last_update_time"] = time.time()
+            send_mpv_command(["set", "pause", "no"])
+            fade_in(3.0)
+            notify_track_started(next_file)
+            add_to_timeline(
+                "next_track", 
+                f"切换到下一首: {next_file}", 
+                {
+                    "previous_file": old_file or current_file or "未知文件", 
+                    "next_file": next_file,
+                    "source": "preload"
+                }
+            )
+            return jsonify({
+                "status": "ok", 
+                "action": "next_track",
+                "next_file": next_file,
+                "source": "preload",
+                "local_path": local_path,
+                "method": "playlist-next"
+            }), 200
         
-        if not all_files:
+        # 获取播放顺序（NAS目录缓存，不可用时为本地文件）
+        order = get_playback_order()
+        
+        if not order:
             # 发送遮罩提醒
             send_mask_reminder("没有找到音频文件", "next_track_error")
             return jsonify({"status": "error", "message": "No audio files found"}), 500
         
         # 找到下一首歌曲
-        next_file = None
-        if current_file and current_file in all_files:
-            # 如果当前文件在列表中，获取下一首
-            current_index = all_files.index(current_file)
-            next_index = (current_index + 1) % len(all_files)
-            next_file = all_files[next_index]
-        else:
-            # 如果当前文件不在列表中或无法获取当前文件，随机选择一首
+        next_file = order.neighbor(current_file, 1) if current_file else None
+        if next_file is None:
+            # 如果当前文件不在列表中或无法获取当前文件（例如刚启动），随机选择一首，优先选本地已缓存的以便立即播放
             import random
-            next_file = random.choice(all_files)
+            next_file = library_index.random_track(cached_only=True) if library_index is not None else None
+            if next_file not in order:
+                next_file = random.choice(order.files)
         
         # 生成任务ID用于进度跟踪
         import uuid
         task_id = str(uuid.uuid4())
         
         # 从缓存或NAS获取文件
-        success, local_path, message, returned_task_id = get_file_from_cache_or_nas(next_file, task_id)
+        success, local_path, message, returned_task_id = get_playback_source(next_file, task_id)
         
         if not success:
             # 发送遮罩提醒
@@ -1769,7 +4589,7 @@ def next_track():
             self_recorded_state["last_update_time"] = time.time()
         
         # 播放下一首歌曲
-        success, message = send_mpv_command(["loadfile", local_path, "replace"])
+        success, load_msg, method = load_file_with_recovery(local_path)
         if success:
             # 确保播放状态 - 强制取消暂停
             # 为确保万无一失，发送两次解除暂停命令，一次使用字符串，一次使用布尔值(如果MPV支持)
@@ -1784,8 +4604,9 @@ def next_track():
                 send_mpv_command(["set", "pause", "no"])
             
             # 启动渐入效果线程
-            fade_in_thread = threading.Thread(target=fade_in, args=(3.0,), daemon=True)
-            fade_in_thread.start()
+            fade_in(3.0)
+            # 后台预加载再下一首
+            notify_track_started(next_file)
             
             # 获取并更新文件时长
             try:
@@ -1820,75 +4641,13 @@ def next_track():
                 "next_file": next_file,
                 "source": "cache" if "exists in cache" in message else "NAS",
                 "local_path": local_path,
+                "method": method,
                 "task_id": returned_task_id  # 返回任务ID供前端轮询进度
             }), 200
         
-        # 如果loadfile失败，回退到重启MPV的方式
-        app.logger.warning("loadfile命令失败，回退到重启MPV的方式")
-        
-        # 停止当前播放
-        send_mpv_command(["quit"])
-        time.sleep(0.5)  # 等待mpv退出
-        
-        # 使用mpv播放文件
-        import subprocess
-        try:
-            # 启动mpv播放指定文件
-            subprocess.Popen([
-                "mpv", 
-                "--no-video", 
-                "--input-ipc-server=/data/data/com.termux/files/usr/tmp/mpv_ctrl/socket",
-                "--cache=yes",
-                "--cache-secs=60",
-                "--pause=no",   # 强制不暂停
-                "--idle=yes",  # 保持mpv运行状态
-                "--force-window=no",  # 不强制创建窗口
-                "--really-quiet",  # 减少输出噪音
-                "--af=silencedetect=noise=-30dB:d=3.5", # 添加静音检测滤镜: -30dB, 3.5秒
-                local_path
-            ])
-            
-            # 启动渐入效果线程（延迟1秒，确保MPV已经启动）
-            def delayed_fade_in():
-                time.sleep(1.0)  # 等待MPV启动
-                fade_in(3.0)
-                
-                # 在MPV启动后更新文件时长
-                try:
-                    # 优先使用ffprobe获取准确时长
-                    duration = get_file_duration(local_path)
-                    if duration <= 0:
-                        # 如果ffprobe失败，尝试从MPV获取（可能需要重试几次）
-                        for _ in range(3):
-                            time.sleep(0.5)
-                            duration, _ = get_mpv_property("duration")
-                            if duration and duration > 0:
-                                break
-                        if duration is None:
-                            duration = 0
-                    
-                    # 更新状态
-                    self_recorded_state["duration"] = float(duration)
-                    app.logger.info(f"已更新文件时长(重启模式): {duration}秒")
-                except Exception as e:
-                    app.logger.error(f"更新文件时长失败(重启模式): {e}")
-            
-            fade_in_thread = threading.Thread(target=delayed_fade_in, daemon=True)
-            fade_in_thread.start()
-            
-            return jsonify({
-                "status": "ok", 
-                "action": "next_track",
-                "next_file": next_file,
-                "source": "cache" if "exists in cache" in message else "NAS",
-                "local_path": local_path,
-                "method": "restart",
-                "task_id": returned_task_id
-            }), 200
-        except Exception as e:
-        # 发送遮罩提醒
-            send_mask_reminder(f"播放文件失败: {str(e)}", "play_file_error")
-            return jsonify({"status": "error", "message": f"Failed to play file: {str(e)}"}), 500
+        # loadfile失败且重启MPV后重试仍失败
+        send_mask_reminder(f"播放文件失败: {load_msg}", "play_file_error")
+        return jsonify({"status": "error", "message": f"Failed to play file: {load_msg}"}), 500
     
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
@@ -1909,45 +4668,32 @@ def prev_track():
         # 发送遮罩提醒
         send_mask_reminder("正在切换到上一首歌曲", "prev_track")
         
-        # 获取当前播放的文件名
-        current_file, _ = get_mpv_property("filename")
-        
-        # 如果获取filename失败，尝试从path属性获取
-        if not current_file:
-            path, _ = get_mpv_property("path")
-            if path:
-                current_file = os.path.basename(path)
+        # 获取当前播放的文件名，filename为空时回退到path属性
+        values, _ = get_mpv_properties(["filename", "path"])
+        current_file = values["filename"]
                 
         # 如果MPV返回空且我们有全局记录，使用全局记录
         if not current_file and current_playing_file:
             current_file = current_playing_file
             app.logger.info(f"MPV当前无文件，使用全局记录的文件计算上一首: {current_file}")
         
-        # 获取NAS上的所有音频文件列表
-        all_files, message = rclone_list_files()
-        if not all_files:
-            # 如果NAS获取失败，使用本地文件
-            all_files = get_audio_files()
+        # 获取播放顺序（NAS目录缓存，不可用时为本地文件）
+        order = get_playback_order()
         
-        if not all_files:
+        if not order:
             # 发送遮罩提醒
             send_mask_reminder("没有找到音频文件", "prev_track_error")
             return jsonify({"status": "error", "message": "No audio files found"}), 500
         
         # 找到上一首歌曲
-        prev_file = None
-        if current_file and current_file in all_files:
-            # 如果当前文件在列表中，获取上一首
-            current_index = all_files.index(current_file)
-            prev_index = (current_index - 1) % len(all_files)
-            prev_file = all_files[prev_index]
-        else:
+        prev_file = order.neighbor(current_file, -1) if current_file else None
+        if prev_file is None:
             # 如果当前文件不在列表中或无法获取当前文件，随机选择一首
             import random
-            prev_file = random.choice(all_files)
+            prev_file = random.choice(order.files)
         
         # 从缓存或NAS获取文件
-        success, local_path, message, _ = get_file_from_cache_or_nas(prev_file)
+        success, local_path, message, _ = get_playback_source(prev_file)
         
         if not success:
             # 发送遮罩提醒
@@ -1966,11 +4712,12 @@ def prev_track():
         self_recorded_state["current_file"] = prev_file
         
         # 播放上一首歌曲
-        success, message = send_mpv_command(["loadfile", local_path, "replace"])
+        success, load_msg, method = load_file_with_recovery(local_path)
         if success:
             # 启动渐入效果线程
-            fade_in_thread = threading.Thread(target=fade_in, args=(3.0,), daemon=True)
-            fade_in_thread.start()
+            fade_in(3.0)
+            # 后台预加载下一首
+            notify_track_started(prev_file)
             
             # 发送遮罩提醒
             send_mask_reminder(f"成功切换到上一首歌曲: {prev_file}", "prev_track_success")
@@ -1985,60 +4732,18 @@ def prev_track():
                     "source": "cache" if "exists in cache" in message else "NAS"
                 }
             )
-            return jsonify({
-                "status": "ok", 
-                "action": "prev_track",
-                "prev_file": prev_file,
-                "source": "cache" if "exists in cache" in message else "NAS",
-                "local_path": local_path
-            }), 200
-        
-        # 如果loadfile失败，回退到重启MPV的方式
-        app.logger.warning("loadfile命令失败，回退到重启MPV的方式")
-        
-        # 停止当前播放
-        send_mpv_command(["quit"])
-        time.sleep(0.5)  # 等待mpv退出
-        
-        # 使用mpv播放文件
-        import subprocess
-        try:
-            # 启动mpv播放指定文件
-            subprocess.Popen([
-                "mpv", 
-                "--no-video", 
-                "--input-ipc-server=/data/data/com.termux/files/usr/tmp/mpv_ctrl/socket",
-                "--cache=yes",
-                "--cache-secs=60",
-                "--idle=yes",  # 保持mpv运行状态
-                "--force-window=no",  # 不强制创建窗口
-                "--really-quiet",  # 减少输出噪音
-                local_path
-            ])
-            
-            # 启动渐入效果线程（延迟1秒，确保MPV已经启动）
-            def delayed_fade_in():
-                time.sleep(1.0)  # 等待MPV启动
-                fade_in(3.0)
-            
-            fade_in_thread = threading.Thread(target=delayed_fade_in, daemon=True)
-            fade_in_thread.start()
-            
-            # 发送遮罩提醒
-            send_mask_reminder(f"成功切换到上一首歌曲: {prev_file} (重启MPV方式)", "prev_track_success")
-            
             return jsonify({
                 "status": "ok", 
                 "action": "prev_track",
                 "prev_file": prev_file,
                 "source": "cache" if "exists in cache" in message else "NAS",
                 "local_path": local_path,
-                "method": "restart"
+                "method": method
             }), 200
-        except Exception as e:
-            # 发送遮罩提醒
-            send_mask_reminder(f"切换到上一首歌曲失败: {str(e)}", "prev_track_error")
-            return jsonify({"status": "error", "message": f"Failed to play file: {str(e)}"}), 500
+        
+        # loadfile失败且重启MPV后重试仍失败
+        send_mask_reminder(f"切换到上一首歌曲失败: {load_msg}", "prev_track_error")
+        return jsonify({"status": "error", "message": f"Failed to play file: {load_msg}"}), 500
     
     except Exception as e:
         # 发送遮罩提醒
@@ -2063,6 +4768,8 @@ def stop_playback():
     # 发送遮罩提醒
     send_mask_reminder(f"正在停止播放: {file_info}", "stop_playback")
     
+    gapless_preloader.invalidate()
+    mpv_supervisor.expect_exit()
     success, message = send_mpv_command(["quit"])
     if success:
         # 发送遮罩提醒
@@ -2100,6 +4807,8 @@ def adjust_volume():
     # 发送遮罩提醒
     send_mask_reminder(f"正在调整音量: {'增加' if value > 0 else '减少'} {abs(value)}%")
     
+    # 用户手动调整音量时取消正在进行的渐变，避免被渐变覆盖
+    fade_engine.cancel()
     success, message = send_mpv_command(["add", "volume", str(value)])
     
     if success:
@@ -2135,12 +4844,19 @@ def set_volume():
     # 发送遮罩提醒
     send_mask_reminder(f"正在设置音量为: {value}%")
     
-    success, message = send_mpv_command(["set", "volume", str(value)])
+    def apply_volume(target):
+        # 用户手动设置音量时取消正在进行的渐变，避免被渐变覆盖
+        fade_engine.cancel()
+        success, message = send_mpv_command(["set", "volume", str(target)])
+        if success:
+            with state_lock:
+                self_recorded_state["volume"] = target
+        return success, message
+    
+    # 拖动滑块时的连续请求只把最后的目标值发给mpv
+    (success, message), value = command_coalescer.submit("volume", value, apply_volume)
     
     if success:
-        # 更新自己记录的状态
-        global self_recorded_state
-        self_recorded_state["volume"] = value
         # 发送遮罩提醒
         send_mask_reminder(f"音量设置成功，当前音量: {value}%")
         return jsonify({"status": "ok", "action": "set_volume", "volume": value}), 200
@@ -2148,6 +4864,24 @@ def set_volume():
     send_mask_reminder(f"音量设置失败: {message}", "volume_error")
     return jsonify({"status": "error", "message": message}), 500
 
+@app.route('/mpv/fade/status', methods=['GET'])
+@log_operation("获取音量渐变状态")
+def get_fade_status():
+    """获取最近一次音量渐变的计时报告"""
+    return jsonify({"status": "ok", "last_fade": fade_engine.last_report}), 200
+
+@app.route('/download/queue', methods=['GET'])
+@log_operation("获取下载队列")
+def get_download_queue():
+    """获取下载管理器的队列与统计"""
+    return jsonify({"status": "ok", "downloads": download_manager.status()}), 200
+
+@app.route('/mpv/coalesce/stats', methods=['GET'])
+@log_operation("获取请求合并统计")
+def get_coalesce_stats():
+    """获取音量/进度请求的合并统计"""
+    return jsonify({"status": "ok", "window": command_coalescer.window, "stats": command_coalescer.stats}), 200
+
 @app.route('/mpv/shuffle', methods=['GET'])
 @log_operation("随机播放")
 def shuffle_playlist():
@@ -2224,15 +4958,10 @@ def seek():
         # 发送遮罩提醒
         send_mask_reminder(f"正在调整播放进度到 {position} 秒", "seek")
             
-        # 发送seek命令
-        success, message = send_mpv_command(["seek", position, "absolute"])
-    
-        if success:
-            # 发送遮罩提醒
-            send_mask_reminder(f"播放进度调整成功，当前位置: {position} 秒", "seek_success")
-            
-            # 更新自己记录的状态，确保进度条停留在拖动到的位置
-            global self_recorded_state
+        def apply_seek(target):
+            success, message = send_mpv_command(["seek", str(target), "absolute"])
+            if not success:
+                return success, message, 0
             
             # 获取当前时长，用于计算进度
             duration, _ = get_mpv_property("duration")
@@ -2240,15 +4969,29 @@ def seek():
             
             # 计算进度
             if current_duration > 0:
-                current_progress = (position_float / current_duration) * 100 if position_float else 0
+                current_progress = (target / current_duration) * 100 if target else 0
                 current_progress = round(current_progress, 3)
             else:
                 current_progress = 0
             
-            # 更新自己记录的状态
-            self_recorded_state["position"] = position_float
-            self_recorded_state["progress"] = current_progress
-            self_recorded_state["last_update_time"] = time.time()  # 更新最后更新时间
+            # 更新自己记录的状态，确保进度条停留在拖动到的位置
+            with state_lock:
+                self_recorded_state["position"] = target
+                self_recorded_state["progress"] = current_progress
+                self_recorded_state["last_update_time"] = time.time()  # 更新最后更新时间
+            return success, message, current_progress
+        
+        # 拖动进度条时的连续请求只执行最后一次seek
+        (success, message, current_progress), position_float = command_coalescer.submit(
+            "seek", position_float, apply_seek, error_result=lambda e: (False, str(e), None)
+        )
+        if position_float != float(position):
+            # 本次请求被合并，返回实际执行的位置
+            position = str(position_float)
+    
+        if success:
+            # 发送遮罩提醒
+            send_mask_reminder(f"播放进度调整成功，当前位置: {position} 秒", "seek_success")
             
             return jsonify({"status": "ok", "action": "seek", "position": position, "progress": current_progress}), 200
         else:
@@ -2260,32 +5003,6 @@ def seek():
         send_mask_reminder(f"播放进度调整失败: {str(e)}", "seek_error")
         return jsonify({"status": "error", "message": str(e)}), 500
 
-def fade_in(duration=3.0):
-    """实现音量渐入效果
-    
-    Args:
-        duration: 渐入时长（秒），默认3秒
-    """
-    try:
-        # 先将音量设置为0
-        send_mpv_command(["set", "volume", "0"])
-        
-        # 计算每步的音量增量和间隔时间
-        steps = 30  # 分30步完成渐入
-        step_duration = duration / steps
-        volume_increment = 100 / steps
-        
-        # 逐渐增加音量
-        for i in range(steps + 1):
-            current_volume = int(i * volume_increment)
-            send_mpv_command(["set", "volume", str(current_volume)])
-            time.sleep(step_duration)
-        
-        app.logger.info(f"[FADE_IN] 音量渐入效果完成，时长: {duration}秒")
-    except Exception as e:
-        app.logger.error(f"[FADE_IN] 音量渐入效果失败: {str(e)}")
-
-
 def play_file(filename):
     """播放指定文件（按需从NAS拉取）"""
     # 检查当前时间是否允许播放
@@ -2301,8 +5018,8 @@ def play_file(filename):
     # 发送遮罩提醒
     send_mask_reminder(f"正在准备播放文件: {filename}", "play_file")
     
-    # 从缓存或NAS获取文件
-    success, local_path, message, _ = get_file_from_cache_or_nas(filename)
+    # 从缓存或NAS获取文件（边下边播时为本地中转URL）
+    success, local_path, message, _ = get_playback_source(filename)
     
     if not success:
         # 发送遮罩提醒
@@ -2312,8 +5029,8 @@ def play_file(filename):
     # 发送遮罩提醒
     send_mask_reminder(f"文件获取成功，正在播放: {filename}", "play_file_start")
     
-    # 首先尝试将文件添加到播放列表并播放
-    success, message = send_mpv_command(["loadfile", local_path, "replace"])
+    # 加载文件，失败时由进程守护重启MPV后重试
+    success, load_msg, method = load_file_with_recovery(local_path)
     if success:
         # 立即更新全局当前播放文件和自己记录的状态
         current_playing_file = filename
@@ -2324,8 +5041,9 @@ def play_file(filename):
         self_recorded_state["current_file"] = filename
         
         # 启动渐入效果线程
-        fade_in_thread = threading.Thread(target=fade_in, args=(3.0,), daemon=True)
-        fade_in_thread.start()
+        fade_in(3.0)
+        # 后台预加载下一首
+        notify_track_started(filename)
 
         # 获取并更新文件时长
         try:
@@ -2351,80 +5069,13 @@ def play_file(filename):
             "action": "play_file", 
             "file": filename,
             "local_path": local_path,
-            "source": "NAS" if "copied from NAS" in message else "cache",
-            "method": "loadfile"
+            "source": "cache" if "exists in cache" in message else "NAS",
+            "method": method
         }), 200
     
-    # 如果loadfile失败，回退到重启MPV的方式
-    app.logger.warning("loadfile命令失败，回退到重启MPV的方式")
-    
-    # 停止当前播放
-    send_mpv_command(["quit"])
-    time.sleep(0.5)  # 等待mpv退出
-    
-    # 使用mpv播放文件
-    import subprocess
-    try:
-        # 启动mpv播放指定文件
-        subprocess.Popen([
-            "mpv", 
-            "--no-video", 
-            "--input-ipc-server=/data/data/com.termux/files/usr/tmp/mpv_ctrl/socket",
-            "--cache=yes",
-            "--cache-secs=60",
-            "--idle=yes",  # 保持mpv运行状态
-            "--force-window=no",  # 不强制创建窗口
-            "--really-quiet",  # 减少输出噪音
-            "--af=silencedetect=noise=-30dB:d=2.5", # 添加静音检测滤镜: -30dB, 2.5秒
-            local_path
-        ])
-        
-        # 更新自己记录的状态
-        self_recorded_state["playing"] = True
-        self_recorded_state["paused"] = False
-        self_recorded_state["current_file"] = filename
-        
-        # 启动渐入效果线程（延迟1秒，确保MPV已经启动）
-        def delayed_fade_in():
-            time.sleep(1.0)  # 等待MPV启动
-            fade_in(3.0)
-            
-            # 在MPV启动后更新文件时长
-            try:
-                # 优先使用ffprobe获取准确时长
-                duration = get_file_duration(local_path)
-                if duration <= 0:
-                    # 如果ffprobe失败，尝试从MPV获取（可能需要重试几次）
-                    for _ in range(3):
-                        time.sleep(0.5)
-                        duration, _ = get_mpv_property("duration")
-                        if duration and duration > 0:
-                            break
-                    if duration is None:
-                        duration = 0
-                
-                # 更新状态
-                self_recorded_state["duration"] = float(duration)
-                app.logger.info(f"已更新文件时长(重启模式): {duration}秒")
-            except Exception as e:
-                app.logger.error(f"更新文件时长失败(重启模式): {e}")
-        
-        fade_in_thread = threading.Thread(target=delayed_fade_in, daemon=True)
-        fade_in_thread.start()
-        
-        # 发送遮罩提醒
-        send_mask_reminder(f"成功播放文件: {filename} (重启MPV方式)", "play_file_success")
-        
-        return jsonify({
-            "status": "ok", 
-            "action": "play_file", 
-            "file": filename,
-            "local_path": local_path,
-            "source": "NAS" if "copied from NAS" in message else "cache",
-            "method": "restart"
-        }), 200
-    except Exception as e:
-        return jsonify({"status": "error", "message": f"Failed to play file: {str(e)}"}), 500
+    # loadfile失败且重启MPV后重试仍失败
+    send_mask_reminder(f"播放文件失败: {load_msg}", "play_file_error")
+    return jsonify({"status": "error", "message": f"Failed to play file: {load_msg}"}), 500
 
 @app.route('/mpv/play/file/<path:filename>', methods=['GET'])
 @log_operation("播放指定文件")
@@ -2432,10 +5083,87 @@ def play_file_route(filename):
     """播放指定文件的路由处理函数"""
     return play_file(filename)
 
+LAZY_PLAYLIST_ENABLED = os.environ.get('LAZY_PLAYLIST_ENABLED', 'true').lower() == 'true'
+
+playlist_build_generation = 0  # 每次构建播放列表递增，用于中止上一次还没下载完的非懒构建
+playlist_build_lock = threading.Lock()
+playlist_load_lock = threading.Lock()  # 串行化M3U文件的写入和loadlist
+
+
+def get_lazy_playlist_entry(filename):
+    """懒构建播放列表的条目：一律使用本地中转URL
+
+    已缓存的文件由中转直接读本地文件，未缓存的播放到时才从NAS读取并缓存。不使用本地路径，
+    因为播放列表会长期保留，其中已缓存的文件之后可能被容量管理淘汰。
+    """
+    return stream_relay.url(filename)
+
+
+def playlist_entry_name(entry):
+    """从mpv播放列表条目（本地路径或中转URL）还原NAS文件名"""
+    relay_prefix = stream_relay.url("")
+    if entry.startswith(relay_prefix):
+        return urllib.parse.unquote(entry[len(relay_prefix):])
+    return os.path.basename(entry)
+
+
+def render_m3u(entries):
+    """生成M3U文本，entries为(标题, 路径或URL)列表"""
+    lines = ["#EXTM3U"]
+    for title, location in entries:
+        lines.append(f"#EXTINF:-1,{title}")
+        lines.append(location)
+    return "\n".join(lines) + "\n"
+
+
+def parse_m3u(text):
+    """解析M3U文本，返回其中的文件名列表（忽略注释和空行）"""
+    return [
+        playlist_entry_name(line.strip())
+        for line in text.splitlines()
+        if line.strip() and not line.startswith('#')
+    ]
+
+
+def load_playlist(filenames, mode="append", lazy=True):
+    """生成M3U并用一次loadlist命令加载到mpv
+
+    Args:
+        filenames: 按播放顺序排列的文件名
+        mode: loadlist模式，append 或 replace
+        lazy: 为True时所有条目都使用中转URL；否则已缓存的文件使用本地路径，未缓存的仍使用中转URL
+
+    Returns:
+        tuple: (是否成功, 消息, 加载的条目数)
+    """
+    entries = []
+    for filename in filenames:
+        if not lazy and cache_index.contains(filename):
+            entries.append((filename, os.path.join(LOCAL_DIR, filename)))
+        else:
+            # 未缓存（下载失败或已被容量管理淘汰）的文件不丢弃，播放到时由中转从NAS读取
+            entries.append((filename, get_lazy_playlist_entry(filename)))
+    if not entries:
+        return False, "No playable entries", 0
+
+    # 所有请求共用同一个M3U文件，写入和loadlist必须成对串行，否则并发的构建/导入会加载到对方的列表；
+    # 先写临时文件再替换，mpv不会读到写了一半的列表
+    with playlist_load_lock:
+        temp_path = PLAYLIST_M3U_PATH + PARTIAL_SUFFIX
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(render_m3u(entries))
+        os.replace(temp_path, PLAYLIST_M3U_PATH)
+        success, message = send_mpv_command(["loadlist", PLAYLIST_M3U_PATH, mode])
+    if success:
+        app.logger.info(f"[PLAYLIST] 通过loadlist加载了 {len(entries)} 个条目 ({mode})")
+    return success, message, len(entries) if success else 0
+
+
 @app.route('/mpv/build_playlist', methods=['POST'])
 @log_operation("构建播放列表")
 def build_playlist():
     """构建完整播放列表"""
+    global playlist_build_generation
     try:
         # 检查当前时间是否允许播放
         if not is_playback_allowed():
@@ -2458,21 +5186,51 @@ def build_playlist():
             send_mask_reminder("没有找到音频文件", "build_playlist_error")
             return jsonify({"status": "error", "message": "No audio files found"}), 500
         
-        # 清空当前播放列表
+        with playlist_build_lock:
+            playlist_build_generation += 1
+            generation = playlist_build_generation
+        
+        # 清空当前播放列表（手动构建的播放列表不再由预加载管理）
+        gapless_preloader.invalidate()
         send_mpv_command(["playlist-clear"])
-        time.sleep(0.1)
         
-        # 逐个添加文件到播放列表
+        data = request.get_json(silent=True) or {}
+        if data.get('lazy', LAZY_PLAYLIST_ENABLED):
+            # 懒构建：不下载任何文件，按目录顺序生成M3U一次加载；播放到的曲目由中转边播边缓存，
+            # 后面几首由前瞻预缓存按同一播放顺序提前下载
+            success, msg, files_added = load_playlist(all_files, "append", lazy=True)
+            if not success:
+                send_mask_reminder(f"播放列表构建失败: {msg}", "build_playlist_error")
+                return jsonify({"status": "error", "message": msg}), 500
+            send_mask_reminder(f"播放列表构建成功，共 {files_added} 个文件，播放到时再缓存", "build_playlist_success")
+            return jsonify({
+                "status": "ok",
+                "action": "build_playlist",
+                "mode": "lazy",
+                "total_files": len(all_files),
+                "files_added": files_added
+            }), 200
+        
+        # 逐个下载，第一首缓存好后立即追加以便开始播放，之后每缓存一批追加一次；
+        # 下载失败或追加前已被容量管理淘汰的文件使用中转URL，不会从列表中丢失
         files_added = 0
-        for filename in all_files:
-            success, local_path, message, _ = get_file_from_cache_or_nas(filename)
-            if success:
-                success, msg = send_mpv_command(["loadfile", local_path, "append"])
+        batch = []
+        for index, filename in enumerate(all_files):
+            if generation != playlist_build_generation:
+                return jsonify({"status": "error", "message": "Playlist build superseded by a newer request"}), 409
+            success, local_path, message, _ = get_file_from_cache_or_nas(filename, priority=DOWNLOAD_PRIORITY_BULK)
+            if not success:
+                app.logger.warning(f"Failed to cache for playlist: {filename}, error: {message}")
+            batch.append(filename)
+            if len(batch) >= PLAYLIST_APPEND_BATCH or index == 0 or index == len(all_files) - 1:
+                if generation != playlist_build_generation:
+                    return jsonify({"status": "error", "message": "Playlist build superseded by a newer request"}), 409
+                success, msg, added = load_playlist(batch, "append", lazy=False)
                 if success:
-                    files_added += 1
-                    app.logger.info(f"Added to playlist: {filename}")
+                    files_added += added
                 else:
-                    app.logger.warning(f"Failed to add to playlist: {filename}, error: {msg}")
+                    app.logger.warning(f"[PLAYLIST] 追加播放列表失败: {msg}")
+                batch = []
         
         # 发送遮罩提醒
         send_mask_reminder(f"播放列表构建成功，共添加了 {files_added} 个文件，总文件数: {len(all_files)}", "build_playlist_success")
@@ -2480,6 +5238,7 @@ def build_playlist():
         return jsonify({
             "status": "ok", 
             "action": "build_playlist", 
+            "mode": "eager",
             "total_files": len(all_files),
             "files_added": files_added
         }), 200
@@ -2489,10 +5248,65 @@ def build_playlist():
         send_mask_reminder(f"播放列表构建失败: {str(e)}", "build_playlist_error")
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route('/mpv/playlist/export', methods=['GET'])
+@log_operation("导出播放列表")
+def export_playlist():
+    """把mpv当前的播放列表导出为M3U（条目为NAS文件名，可在其他设备或重启后导入）"""
+    playlist, message = get_mpv_property("playlist")
+    if playlist is None:
+        return jsonify({"status": "error", "message": message}), 500
+    names = [playlist_entry_name(item.get("filename", "")) for item in playlist if item.get("filename")]
+    return Response(
+        render_m3u([(name, name) for name in names]),
+        200,
+        headers={"Content-Disposition": 'attachment; filename="playlist.m3u"'},
+        mimetype='audio/x-mpegurl'
+    )
+
+@app.route('/mpv/playlist/import', methods=['POST'])
+@log_operation("导入播放列表")
+def import_playlist():
+    """导入M3U播放列表（请求体为M3U文本），mode=append 追加，mode=replace 替换并开始播放"""
+    if not is_playback_allowed():
+        send_mask_reminder("当前时间不允许播放，只有早上9点到晚上9点可以播放", "playback_not_allowed")
+        return jsonify({"status": "error", "message": "当前时间不允许播放，只有早上9点到晚上9点可以播放"}), 200
+    
+    mode = request.args.get('mode', 'append')
+    if mode not in ('append', 'replace'):
+        return jsonify({"status": "error", "message": "mode must be append or replace"}), 400
+    
+    names = parse_m3u(request.get_data(as_text=True))
+    if not names:
+        return jsonify({"status": "error", "message": "No entries found in playlist"}), 400
+    
+    # 只导入NAS目录或缓存中存在的文件
+    order = get_playback_order(blocking=False)
+    known = [name for name in names if name in order or cache_index.contains(name)]
+    
+    if mode == 'replace':
+        gapless_preloader.invalidate()
+    success, message, files_added = load_playlist(known, mode, lazy=True)
+    if not success:
+        send_mask_reminder(f"导入播放列表失败: {message}", "import_playlist_error")
+        return jsonify({"status": "error", "message": message}), 500
+    
+    send_mask_reminder(f"已导入 {files_added} 个文件", "import_playlist_success")
+    return jsonify({
+        "status": "ok",
+        "mode": mode,
+        "files_added": files_added,
+        "skipped": len(names) - len(known)
+    }), 200
+
 @app.route('/mpv/status', methods=['GET'])
 @log_operation("获取播放状态")
 def get_status():
     """获取播放状态 (优化版: 仅从缓存读取)"""
+    return jsonify(build_status_snapshot()), 200
+
+
+def build_status_snapshot():
+    """播放状态快照，/mpv/status 和 /events 共用"""
     status = {}
     
     # 完全依赖自己记录的状态
@@ -2519,13 +5333,55 @@ def get_status():
     else:
         status["mask_reminder"] = None
     
+    # 按共享的播放顺序给出下一首，供网页展示
+    status["next_file"] = get_playback_order(blocking=False).neighbor(status.get("current_file"), 1) if status.get("current_file") else None
+    
     status["mpv_ready"] = os.path.exists(MPV_SOCKET_PATH)
     status["mpv_error"] = MPV_RUNTIME_ERROR or ""
     
     # 调试日志仅在确实需要时打印，避免刷屏
     # app.logger.debug(f"[状态获取] 快速返回: {json.dumps(status, ensure_ascii=False)}")
     
-    return jsonify(status), 200
+    return status
+
+
+def format_sse(event, data, event_id=None):
+    """按text/event-stream格式编码一条事件"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return "\n".join(lines) + "\n\n"
+
+
+@app.route('/events', methods=['GET'])
+@log_operation("订阅事件推送")
+def event_stream():
+    """服务端事件推送：连接后先发送完整状态，之后推送状态增量(state)、下载进度(download)和时间轴事件(timeline)"""
+    def generate():
+        # 在生成器内订阅：响应未被迭代（客户端在首个字节前断开）时不会留下订阅；
+        # 订阅与try之间没有yield，生成器关闭时finally一定会取消订阅
+        client_queue = event_bus.subscribe()
+        try:
+            # 告诉浏览器断线后3秒重连
+            yield "retry: 3000\n\n"
+            yield format_sse("state", build_status_snapshot())
+            while True:
+                try:
+                    event_id, event, data = client_queue.get(timeout=SSE_KEEPALIVE_INTERVAL)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if event == "resync":
+                    yield format_sse("state", build_status_snapshot(), event_id)
+                else:
+                    yield format_sse(event, data, event_id)
+        finally:
+            event_bus.unsubscribe(client_queue)
+    
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 @app.route('/mpv/status/self', methods=['GET'])
@@ -2544,34 +5400,116 @@ def get_self_recorded_status():
 @app.route('/files', methods=['GET'])
 @log_operation("列出文件列表")
 def list_files():
-    """列出所有音频文件（从NAS获取列表）"""
+    """列出所有音频文件（从NAS目录缓存获取列表）
+
+    支持 offset/limit 分页和 sort=name|name_desc 排序；响应带目录版本号和ETag，
+    If-None-Match 命中时返回304。since=<版本号> 时只返回该版本之后新增和删除的文件名。
+    """
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+        limit = request.args.get('limit')
+        limit = max(0, int(limit)) if limit is not None else None
+        since = request.args.get('since')
+        since = int(since) if since is not None else None
+    except ValueError:
+        return jsonify({"status": "error", "message": "Query parameters 'offset', 'limit' and 'since' must be integers."}), 400
+    sort = request.args.get('sort', 'name')
+    if sort not in ('name', 'name_desc'):
+        return jsonify({"status": "error", "message": "Query parameter 'sort' must be 'name' or 'name_desc'."}), 400
+    
     files, message = rclone_list_files()
-    if files:
-        return jsonify({"files": sorted(files)}), 200
-    else:
+    if not files:
         # 如果NAS获取失败，回退到本地文件
         local_files = get_audio_files()
         return jsonify({"files": local_files, "warning": f"Failed to get files from NAS: {message}"}), 200
+    
+    version = nas_catalog.version
+    etag = f'"files-{version}"'
+    if etag in request.headers.get('If-None-Match', ''):
+        return '', 304, {"ETag": etag}
+    
+    if since is not None:
+        changes = nas_catalog.changes_since(since)
+        if changes is not None:
+            added, removed = changes
+            response = jsonify({"version": version, "delta": True, "added": added, "removed": removed})
+            response.headers["ETag"] = etag
+            return response, 200
+        # 历史记录中已没有该版本，返回完整列表
+    
+    # 目录缓存中的列表已按名称排序
+    ordered = files if sort == 'name' else files[::-1]
+    page = ordered[offset:offset + limit] if limit is not None else ordered[offset:]
+    response = jsonify({"files": page, "total": len(files), "offset": offset, "version": version, "delta": False})
+    response.headers["ETag"] = etag
+    return response, 200
+
+@app.route('/stream/<path:filename>', methods=['GET'])
+def stream_file(filename):
+    """边下边播的本地HTTP中转，供mpv加载（支持Range请求）"""
+    if not stream_relay.is_allowed(filename):
+        return jsonify({"status": "error", "message": "File not found"}), 404
+    if not stream_relay.is_complete(filename):
+        # 懒构建的播放列表播放到未缓存的条目时在这里开始完整缓存
+        stream_relay.start(filename)
+    total_size = stream_relay.remote_size(filename)
+    mime_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    if total_size is None:
+        # 不知道大小时只能从头顺序读取
+        return Response(stream_relay.iter_range(filename, 0, None), 200, mimetype=mime_type)
+    
+    start, end, status_code = 0, total_size - 1, 200
+    match = re.match(r"bytes=(\d*)-(\d*)", request.headers.get('Range', ''))
+    if match and (match.group(1) or match.group(2)):
+        if match.group(1):
+            start = int(match.group(1))
+            if match.group(2):
+                end = min(int(match.group(2)), total_size - 1)
+        else:
+            # bytes=-N 表示最后N个字节
+            start = max(0, total_size - int(match.group(2)))
+        if start >= total_size or start > end:
+            return '', 416, {"Content-Range": f"bytes */{total_size}"}
+        status_code = 206
+    
+    length = end - start + 1
+    headers = {"Accept-Ranges": "bytes", "Content-Length": str(length)}
+    if status_code == 206:
+        headers["Content-Range"] = f"bytes {start}-{end}/{total_size}"
+    return Response(stream_relay.iter_range(filename, start, length), status_code, headers=headers, mimetype=mime_type)
+
+@app.route('/files/catalog', methods=['GET'])
+@log_operation("获取文件目录缓存状态")
+def get_catalog_status():
+    """获取NAS文件目录缓存状态"""
+    return jsonify({"status": "ok", "catalog": nas_catalog.status(), "search": search_index.status(),
+                    "metadata": media_metadata.status()}), 200
 
 @app.route('/files/search', methods=['GET'])
 @log_operation("搜索文件")
 def search_files():
-    """搜索音频文件（从NAS获取列表）"""
-    query = request.args.get('q', '').lower()
+    """搜索音频文件（基于目录缓存的索引，支持模糊、拼音和首字母匹配，结果按相关度排序）"""
+    query = request.args.get('q', '')
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+        limit = request.args.get('limit')
+        limit = max(0, int(limit)) if limit is not None else None
+    except ValueError:
+        return jsonify({"status": "error", "message": "Query parameters 'offset' and 'limit' must be integers."}), 400
     
-    # 从NAS获取文件列表
+    # 从NAS目录缓存获取文件列表
     nas_files, message = rclone_list_files()
     
-    if not nas_files:
-        # 如果NAS获取失败，回退到本地文件
-        nas_files = get_audio_files()
-    
-    if not query:
-        return jsonify({"files": sorted(nas_files)}), 200
+    if nas_files:
+        search_index.ensure_current(nas_files, nas_catalog.version)
+        matched_files = search_index.search(query)
+    else:
+        # 如果NAS获取失败，回退到本地文件做简单匹配
+        query = query.lower()
+        matched_files = sorted(f for f in get_audio_files() if query in f.lower())
     
-    # 筛选匹配的文件
-    matched_files = [f for f in nas_files if query in f.lower()]
-    return jsonify({"files": sorted(matched_files)}), 200
+    page = matched_files[offset:offset + limit] if limit is not None else matched_files[offset:]
+    return jsonify({"files": page, "total": len(matched_files), "offset": offset}), 200
 
 @app.route('/files/sync', methods=['POST'])
 @log_operation("手动同步文件")
@@ -2811,7 +5749,8 @@ def mcp_control():
         # 执行相应的操作
         if action == "play":
             # 获取当前状态，如果已暂停则取消暂停，否则检查是否有正在播放的文件
-            paused, _ = get_mpv_property("pause")
+            values, _ = get_mpv_properties(["pause", "filename"])
+            paused = values["pause"]
             if paused:
                 # 如果当前是暂停状态，取消暂停
                 success, message = send_mpv_command(["set_property", "pause", "no"])
@@ -2819,7 +5758,7 @@ def mcp_control():
                 send_mask_reminder("MCP播放操作：取消暂停", "mcp_play_resume")
             else:
                 # 检查是否有正在播放的文件
-                filename, _ = get_mpv_property("filename")
+                filename = values["filename"]
                 if not filename:
                     # 如果没有正在播放的文件，尝试播放下一首
                     # 发送遮罩提醒
@@ -2846,6 +5785,7 @@ def mcp_control():
             return prev_track()
             
         elif action == "stop":
+            mpv_supervisor.expect_exit()
             success, message = send_mpv_command(["quit"])
             # 发送遮罩提醒
             send_mask_reminder("MCP停止操作：已停止播放", "mcp_stop")
@@ -2875,19 +5815,16 @@ def mcp_control():
                 "data": {}
             }), 400
         
-        # 获取当前状态信息
+        # 获取当前状态信息（一次往返批量获取）
         current_status = {}
-        paused, _ = get_mpv_property("pause")
+        values, _ = get_mpv_properties(["pause", "filename", "path", "volume"])
+        paused = values["pause"]
         current_status["playing"] = not paused if paused is not None else False
         
-        filename, _ = get_mpv_property("filename")
-        if not filename:
-            path, _ = get_mpv_property("path")
-            if path:
-                filename = os.path.basename(path)
+        filename = values["filename"]
         current_status["filename"] = filename or "No file playing"
         
-        volume, _ = get_mpv_property("volume")
+        volume = values["volume"]
         current_status["volume"] = float(volume) if volume is not None else 100.0
         
         if success:
@@ -2927,26 +5864,17 @@ def mcp_control():
 def cache_info():
     """获取缓存信息"""
     try:
-        if not os.path.exists(LOCAL_DIR):
-            return jsonify({"files": [], "total_size": 0, "file_count": 0}), 200
-        
-        files_info = []
-        total_size = 0
-        file_count = 0
-        
-        for filename in os.listdir(LOCAL_DIR):
-            file_path = os.path.join(LOCAL_DIR, filename)
-            if os.path.isfile(file_path):
-                size = os.path.getsize(file_path)
-                mtime = os.path.getmtime(file_path)
-                files_info.append({
-                    "name": filename,
-                    "size": size,
-                    "size_mb": round(size / (1024 * 1024), 2),
-                    "modified": time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(mtime))
-                })
-                total_size += size
-                file_count += 1
+        entries, total_size = cache_index.snapshot()
+        files_info = [
+            {
+                "name": filename,
+                "size": size,
+                "size_mb": round(size / (1024 * 1024), 2),
+                "modified": time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(mtime))
+            }
+            for filename, (size, mtime) in entries.items()
+        ]
+        file_count = len(files_info)
         
         return jsonify({
             "status": "ok",
@@ -2954,7 +5882,11 @@ def cache_info():
             "total_size": f"{round(total_size / (1024 * 1024), 2)} MB",
             "total_size_mb": round(total_size / (1024 * 1024), 2),
             "file_count": file_count,
-            "cache_dir": LOCAL_DIR
+            "cache_dir": LOCAL_DIR,
+            "cache_manager": cache_manager.status(),
+            "prefetch": prefetch_scheduler.status(),
+            "index": cache_index.status(),
+            "audio_extract": audio_extractor.status()
         }), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -2982,6 +5914,10 @@ def clear_cache():
                 os.remove(file_path)
                 removed_count += 1
                 removed_size += size
+        cache_index.invalidate()
+        
+        if library_index is not None:
+            library_index.clear_cached()
         
         # 发送遮罩提醒
         send_mask_reminder(f"缓存已清理，删除了 {removed_count} 个文件，释放了 {round(removed_size / (1024 * 1024), 2)} MB 空间", "clear_cache_success")
@@ -3009,8 +5945,11 @@ def start_timer_thread():
     
     if not timer_thread_running:
         timer_thread_running = True
-        timer_thread = threading.Thread(target=timer_worker, daemon=True)
-        timer_thread.start()
+        if control_loop.running:
+            control_loop.spawn("timer", timer_task)
+        else:
+            timer_thread = threading.Thread(target=timer_worker, daemon=True)
+            timer_thread.start()
         app.logger.info("[TIMER_WORKER] 精确计时线程已启动")
     
     return True, "精确计时线程已启动"
@@ -3022,9 +5961,10 @@ def start_playback_monitor():
     
     if not playback_monitor_running:
         playback_monitor_running = True
-        playback_monitor_thread = threading.Thread(target=playback_monitor_worker, daemon=True)
+        worker = playback_monitor_event_worker if PLAYBACK_MONITOR_MODE == 'event' else playback_monitor_worker
+        playback_monitor_thread = threading.Thread(target=worker, daemon=True)
         playback_monitor_thread.start()
-        app.logger.info("[PLAYBACK_MONITOR] 播放结束监控服务已启动")
+        app.logger.info(f"[PLAYBACK_MONITOR] 播放结束监控服务已启动 (模式: {PLAYBACK_MONITOR_MODE})")
     
     return True, "播放结束监控服务已启动"
 
@@ -3035,6 +5975,8 @@ def stop_playback_monitor():
     
     if playback_monitor_running:
         playback_monitor_running = False
+        # 唤醒阻塞在事件队列上的事件模式线程
+        mpv_event_queue.put(None)
         if playback_monitor_thread:
             playback_monitor_thread.join(timeout=5)  # 等待线程结束，最多5秒
         app.logger.info("[PLAYBACK_MONITOR] 播放结束监控服务已停止")
@@ -3042,6 +5984,19 @@ def stop_playback_monitor():
     return True, "播放结束监控服务已停止"
 
 
+@app.route('/mpv/supervisor', methods=['GET'])
+@log_operation("获取MPV进程守护状态")
+def get_supervisor_status():
+    """获取MPV进程守护状态"""
+    return jsonify({"status": "ok", "supervisor": mpv_supervisor.status()}), 200
+
+
+@app.route('/mpv/gapless', methods=['GET'])
+@log_operation("获取无缝切歌状态")
+def get_gapless_status():
+    """获取下一首预加载状态"""
+    return jsonify({"status": "ok", "gapless": gapless_preloader.status()}), 200
+
 @app.route('/monitor/playback', methods=['POST'])
 @log_operation("控制播放监控")
 def control_playback_monitor():
@@ -3082,6 +6037,7 @@ def control_playback_monitor():
             return jsonify({
                 "status": "ok",
                 "running": playback_monitor_running,
+                "mode": PLAYBACK_MONITOR_MODE,
                 "thread_alive": playback_monitor_thread.is_alive() if playback_monitor_thread else False
             }), 200
         else:
@@ -3190,26 +6146,52 @@ def send_mask_reminder(message, action_type="general"):
         app.logger.error(f"[MASK_REMINDER] 发送提醒失败: {str(e)}", exc_info=True)
         return False, f"提醒发送失败: {str(e)}"
 
-def auto_play():
+def auto_play(delay=1):
     """自动播放函数，在应用启动后延迟执行"""
-    import time
-    # 延迟1秒执行，确保应用程序完全初始化
-    time.sleep(1)
+    # 延迟执行，确保应用程序完全初始化
+    time.sleep(delay)
     app.logger.info("[AUTO_PLAY] 开始自动播放")
     # 发送遮罩提醒
     send_mask_reminder("应用启动，开始自动播放", "auto_play")
     try:
-        # 调用next_track函数开始播放
-        response = next_track()
+        # 调用next_track函数开始播放（后台线程中需要应用上下文）
+        with app.app_context():
+            response = next_track()
         app.logger.info(f"[AUTO_PLAY] 自动播放完成，响应: {response}")
     except Exception as e:
         app.logger.error(f"[AUTO_PLAY] 自动播放失败: {str(e)}", exc_info=True)
 
+
+async def auto_play_task():
+    """自动播放协程，延迟期间不占用线程"""
+    await asyncio.sleep(1)
+    await control_loop.run_blocking(auto_play, 0)
+
 if __name__ == '__main__':
     # 注意：0.0.0.0 允许从外部设备访问
     import os
     import threading
     
+    # 启用时先启动asyncio控制循环，后续的后台任务会调度到其中
+    if ASYNC_CONTROL_PLANE:
+        control_loop.start()
+    
+    # 启动MPV进程守护
+    if MPV_SUPERVISOR_ENABLED:
+        mpv_supervisor.start()
+    
+    # 后台预热NAS文件目录缓存
+    nas_catalog.refresh_async()
+    
+    # 后台探测缓存目录中还没有元数据的文件
+    media_metadata.scan_directory(LOCAL_DIR)
+    
+    # 启动时按容量配额检查一次缓存目录
+    cache_manager.enforce_async()
+    
+    # 后台纯音频化缓存目录中的视频文件
+    audio_extractor.scan()
+    
     # 启动精确计时线程
     start_timer_thread()
     
@@ -3217,11 +6199,12 @@ if __name__ == '__main__':
     start_playback_monitor()
     
     # 启动自动播放线程
-    auto_play_thread = threading.Thread(target=auto_play, daemon=True)
-    auto_play_thread.start()
+    if control_loop.running:
+        control_loop.spawn("auto_play", auto_play_task)
+    else:
+        auto_play_thread = threading.Thread(target=auto_play, daemon=True)
+        auto_play_thread.start()
     app.logger.info("[AUTO_PLAY] 自动播放线程已启动")
     
-    API_PORT = int(os.environ.get('API_PORT', 5000))
     print(f"🚀 启动API服务，绑定到 0.0.0.0:{API_PORT}")
     app.run(host='0.0.0.0', port=API_PORT, debug=False, threaded=True)
- 
\ No newline at end of file